@@ -28,16 +28,20 @@ import pathmagic
 with pathmagic.context():
     from func.jpfuncs import updatenote_body
     from func.logme import log
-    from work.monitor_collect import _fill_empty_dates, collect_one, parse_daily_entries
+    from work.monitor_collect import _fill_empty_dates, collect_one, parse_daily_sections, section_word_count
     from work.monitor_report import generate_all_reports
     from work.monitor_store import (
+        SNAPSHOT_KEYFRAME_INTERVAL,
+        compact_snapshots,
         get_alerts_by_person,
         get_all_unresolved_alerts,
         get_notes_by_person,
         get_snapshot_by_date,
         mark_report_dirty,
         resolve_alert,
-        upsert_daily_stat,
+        set_section_index,
+        transaction,
+        upsert_daily_stats,
     )
 
 # %% [markdown]
@@ -95,19 +99,15 @@ def do_restore(person: str, target_date: str, dry_run: bool = False) -> bool:
     # 执行恢复
     updatenote_body(note_id, body)
 
-    # 用旧快照的snapshot_id重建daily_stats，避免NULL问题
-    daily = parse_daily_entries(body, datetime.now())
-    for entry_date, wc in daily.items():
-        upsert_daily_stat(
-            note_id=note_id,
-            entry_date=entry_date,
-            word_count=wc,
-            is_backfill=0,
-            snapshot_id=snap["id"],
-        )
-    _fill_empty_dates(note_id, body, datetime.now())
-
-    mark_report_dirty(person)
+    # 用旧快照的snapshot_id重建daily_stats，避免NULL问题（一个事务内批量写入）
+    # 恢复是整篇替换，全部日期重写；解析结果与补0值共用
+    text, sections = parse_daily_sections(body, datetime.now())
+    with transaction():
+        upsert_daily_stats(note_id, [(d, section_word_count(text, sec), 0, snap["id"]) for d, sec in sections.items()])
+        _fill_empty_dates(note_id, body, datetime.now(), sections=sections)
+        # daily_stats 已按恢复的正文整篇重写，分节索引随之对齐，之后的快照从这里增量比对
+        set_section_index(note_id, snap["id"], sections)
+        mark_report_dirty(person)
     log.info(f"恢复笔记《{title}》至 {target_date} 的快照 (snapshot_id={snap['id']})")
     print(f"已恢复《{title}》→ {target_date} 快照")
 
@@ -150,6 +150,15 @@ def show_alerts(person: str = None):
         )
 
 
+def do_compact(keyframe_interval: int) -> None:
+    """把快照正文重编码为关键帧 + 差分并回收数据库空间。"""
+    stats = compact_snapshots(keyframe_interval=keyframe_interval)
+    print(f"已压缩 {stats['notes']} 篇笔记的 {stats['snapshots']} 条快照"
+          f"（关键帧 {stats['keyframes']}，差分 {stats['deltas']}）")
+    print(f"  快照正文: {stats['bytes_before']:,} → {stats['bytes_after']:,} 字节")
+    print(f"  数据库文件: {stats['file_before']:,} → {stats['file_after']:,} 字节")
+
+
 # %% [markdown]
 # ## 主函数
 
@@ -162,8 +171,16 @@ def main():
     parser.add_argument("--dry-run", "-n", action="store_true", help="预览模式，不执行实际操作")
     parser.add_argument("--alerts", "-a", action="store_true", help="查看告警列表")
     parser.add_argument("--resolve", "-r", type=int, help="将指定告警ID标记为已处理")
+    parser.add_argument("--compact", action="store_true", help="快照正文重编码为关键帧+差分并压缩数据库")
+    parser.add_argument(
+        "--keyframe-interval", type=int, default=SNAPSHOT_KEYFRAME_INTERVAL, help="差分链长度上限（配合 --compact）"
+    )
     args = parser.parse_args()
 
+    if args.compact:
+        do_compact(args.keyframe_interval)
+        return
+
     if args.resolve:
         resolve_alert(args.resolve)
         print(f"告警 #{args.resolve} 已标记为已处理")
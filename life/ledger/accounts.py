@@ -28,6 +28,72 @@ class AccountManager:
 
     def __init__(self, db: Database):
         self.db = db
+        self._index = None       # 账户解析索引，首次匹配时一次性加载
+        self._match_cache = {}   # (匹配方式, 参数...) → Optional[Account]
+        self._bank_cache = {}    # 短信来源 → 银行标准名，配置变化或 invalidate_cache 时清空
+        self._match_cfg = None   # 两个缓存所对应的 (支付方式映射, 短号码映射, 银行名列表)
+        self._fingerprint = None # 载入索引时账户表的指纹，用于发现其他连接/工具对账户表的修改
+
+    # ── 解析索引 ──
+
+    def _get_index(self) -> dict:
+        """一次查询载入全部账户，按各匹配路径建字典；同键取 id 最小者，与原 SQL 的结果一致。"""
+        if self._index is not None:
+            return self._index
+
+        self._fingerprint = self._table_fingerprint()
+        rows = self.db.fetchall("SELECT * FROM accounts ORDER BY id")
+        idx = {
+            "by_id": {},
+            "by_type": {},                 # type → 首个账户（不论启用）
+            "by_bank_suffix": {},          # (bank, suffix) → 首个账户（不论启用）
+            "active_type_bank_suffix": {}, # (type, bank, suffix)
+            "active_type_bank": {},        # (type, bank)
+            "active_loan": {},             # institution → loan 账户
+            "active_bank_suffix": {},      # (bank, suffix)
+            "active_bank": {},             # bank → 储蓄卡优先
+        }
+        for r in rows:
+            acct = self._row_to_account(r)
+            idx["by_id"][acct.id] = acct
+            idx["by_type"].setdefault(acct.type, acct)
+            idx["by_bank_suffix"].setdefault((acct.bank, acct.card_suffix), acct)
+            if not acct.is_active:
+                continue
+            idx["active_type_bank_suffix"].setdefault((acct.type, acct.bank, acct.card_suffix), acct)
+            idx["active_type_bank"].setdefault((acct.type, acct.bank), acct)
+            if acct.type == "loan":
+                idx["active_loan"].setdefault(acct.institution, acct)
+            idx["active_bank_suffix"].setdefault((acct.bank, acct.card_suffix), acct)
+            cur = idx["active_bank"].get(acct.bank)
+            if cur is None or (cur.type != "bank_debit" and acct.type == "bank_debit"):
+                idx["active_bank"][acct.bank] = acct
+        self._index = idx
+        return idx
+
+    def invalidate_cache(self):
+        """账户表有变动时清空解析索引和匹配缓存，下次匹配重新载入。"""
+        self._index = None
+        self._fingerprint = None
+        self._match_cache.clear()
+        self._bank_cache.clear()
+
+    def _table_fingerprint(self) -> tuple:
+        r = self.db.fetchone(
+            "SELECT COUNT(*) AS n, MAX(id) AS max_id, SUM(is_active) AS active, MAX(updated_at) AS updated"
+            " FROM accounts"
+        )
+        return (r["n"], r["max_id"], r["active"], r["updated"])
+
+    def refresh_if_changed(self) -> bool:
+        """账户表被本管理器以外的途径修改过（如 tools/add_jdbt_account.py、另一连接上的初始化）时清空缓存。
+
+        在每批导入开始时调用一次（FlowRouter.route_events），批内仍只用内存索引。返回是否清空了缓存。
+        """
+        if self._index is None or self._fingerprint == self._table_fingerprint():
+            return False
+        self.invalidate_cache()
+        return True
 
     # ── 查询 ──
 
@@ -45,13 +111,15 @@ class AccountManager:
         return [self._row_to_account(r) for r in rows]
 
     def get_account(self, account_id: int) -> Optional[Account]:
-        row = self.db.fetchone("SELECT * FROM accounts WHERE id=?", (account_id,))
-        return self._row_to_account(row) if row else None
+        return self._get_index()["by_id"].get(account_id)
 
     def get_account_by_type(self, acct_type: str) -> Optional[Account]:
         """按类型获取唯一账户（微信零钱/支付宝等）。"""
-        row = self.db.fetchone("SELECT * FROM accounts WHERE type=?", (acct_type,))
-        return self._row_to_account(row) if row else None
+        return self._get_index()["by_type"].get(acct_type)
+
+    def get_credit_card_for_bank(self, bank: str) -> Optional[Account]:
+        """指定银行的首张启用信用卡。"""
+        return self._get_index()["active_type_bank"].get(("bank_credit", bank))
 
     def get_wechat_wallet(self) -> Optional[Account]:
         return self.get_account_by_type("wechat_wallet")
@@ -67,42 +135,40 @@ class AccountManager:
         例如 "广发信用卡" → bank_credit + 广发银行。
         如果 card_suffix 有值，优先匹配尾号。
         """
+        self._check_config()
+        key = ("pm", method, card_suffix)
+        if key in self._match_cache:
+            return self._match_cache[key]
+
         pmap = _get_payment_method_map()
         rule = pmap.get(method)
         if not rule:
             # 尝试模糊匹配银行名
-            for key, val in pmap.items():
-                if key in method or method in key:
+            for k, val in pmap.items():
+                if k in method or method in k:
                     rule = val
                     break
         if not rule:
+            self._match_cache[key] = None
             return None
 
+        idx = self._get_index()
         acct_type, bank = rule
+        acct = None
         if bank and card_suffix:
-            row = self.db.fetchone(
-                "SELECT * FROM accounts WHERE type=? AND bank=? AND card_suffix=? AND is_active=1",
-                (acct_type, bank, card_suffix),
-            )
-            if row:
-                return self._row_to_account(row)
+            acct = idx["active_type_bank_suffix"].get((acct_type, bank, card_suffix))
 
-        if bank:
+        if acct is None and bank:
             if acct_type == "loan":
                 # 贷款账户用 institution 列匹配
-                row = self.db.fetchone(
-                    "SELECT * FROM accounts WHERE type=? AND institution=? AND is_active=1 ORDER BY id LIMIT 1",
-                    (acct_type, bank),
-                )
+                acct = idx["active_loan"].get(bank)
             else:
-                row = self.db.fetchone(
-                    "SELECT * FROM accounts WHERE type=? AND bank=? AND is_active=1 ORDER BY id LIMIT 1",
-                    (acct_type, bank),
-                )
-            if row:
-                return self._row_to_account(row)
+                acct = idx["active_type_bank"].get((acct_type, bank))
 
-        return self.get_account_by_type(acct_type)
+        if acct is None:
+            acct = idx["by_type"].get(acct_type)
+        self._match_cache[key] = acct
+        return acct
 
     def match_by_bank_sms(self, org: str, card_suffix: str) -> Optional[Account]:
         """根据银行短信匹配账户。
@@ -110,32 +176,27 @@ class AccountManager:
         org 可能为 "招商银行" / "广发银行" 等银行名或短号码。
         card_suffix 为卡号尾号4位。
         """
-        bank = self._normalize_bank_name(org)
-        if not bank:
-            return None
+        self._check_config()
+        key = ("sms", org, card_suffix)
+        if key in self._match_cache:
+            return self._match_cache[key]
 
-        if card_suffix:
-            row = self.db.fetchone(
-                "SELECT * FROM accounts WHERE bank=? AND card_suffix=? AND is_active=1",
-                (bank, card_suffix),
-            )
-            if row:
-                return self._row_to_account(row)
-
-        row = self.db.fetchone(
-            "SELECT * FROM accounts WHERE bank=? AND is_active=1 ORDER BY CASE WHEN type='bank_debit' THEN 0 ELSE 1 END, id LIMIT 1",
-            (bank,),
-        )
-        return self._row_to_account(row) if row else None
+        bank = self.normalize_bank_name(org)
+        acct = None
+        if bank:
+            idx = self._get_index()
+            if card_suffix:
+                acct = idx["active_bank_suffix"].get((bank, card_suffix))
+            if acct is None:
+                acct = idx["active_bank"].get(bank)
+        self._match_cache[key] = acct
+        return acct
 
     def get_or_create_loan(self, institution: str) -> Account:
         """获取或自动创建贷款账户。"""
-        row = self.db.fetchone(
-            "SELECT * FROM accounts WHERE type='loan' AND institution=? AND is_active=1",
-            (institution,),
-        )
-        if row:
-            return self._row_to_account(row)
+        acct = self._get_index()["active_loan"].get(institution)
+        if acct:
+            return acct
 
         acct_id = self.db.insert("accounts", {
             "name": institution,
@@ -143,16 +204,14 @@ class AccountManager:
             "institution": institution,
             "notes": "自动创建",
         })
+        self.invalidate_cache()
         return self.get_account(acct_id)
 
     def get_or_create_bank_card(self, bank: str, card_suffix: str, card_type: str = "bank_credit") -> Account:
         """获取或自动创建银行卡账户。"""
-        row = self.db.fetchone(
-            "SELECT * FROM accounts WHERE bank=? AND card_suffix=?",
-            (bank, card_suffix),
-        )
-        if row:
-            return self._row_to_account(row)
+        acct = self._get_index()["by_bank_suffix"].get((bank, card_suffix))
+        if acct:
+            return acct
 
         name = f"{bank}-尾号{card_suffix}"
         acct_id = self.db.insert("accounts", {
@@ -162,6 +221,7 @@ class AccountManager:
             "card_suffix": card_suffix,
             "notes": "自动创建",
         })
+        self.invalidate_cache()
         return self.get_account(acct_id)
 
     # ── 手动管理 ──
@@ -177,11 +237,13 @@ class AccountManager:
             "institution": institution,
             "notes": notes or "",
         })
+        self.invalidate_cache()
         return self.get_account(acct_id)
 
     def deactivate(self, account_id: int):
         self.db.update("accounts", {"is_active": 0, "updated_at": "datetime('now','localtime')"},
                        {"id": account_id})
+        self.invalidate_cache()
 
     # ── 辅助 ──
 
@@ -196,6 +258,21 @@ class AccountManager:
             notes=row.get("notes"),
         )
 
+    def _check_config(self):
+        """云端配置（支付方式映射/短号码/银行名）与缓存建立时不同则清空匹配缓存与银行名缓存。"""
+        cfg = (_get_payment_method_map(), _get_bank_short_codes(), _get_bank_names())
+        if cfg != self._match_cfg:
+            self._match_cfg = cfg
+            self._match_cache.clear()
+            self._bank_cache.clear()
+
+    def normalize_bank_name(self, org: str) -> Optional[str]:
+        """将短信来源统一为银行标准名，结果按当前配置缓存。"""
+        self._check_config()
+        if org not in self._bank_cache:
+            self._bank_cache[org] = self._normalize_bank_name(org)
+        return self._bank_cache[org]
+
     @staticmethod
     def _normalize_bank_name(org: str) -> Optional[str]:
         """将短信来源统一为银行标准名。"""
@@ -4,6 +4,7 @@
 用法：
     python life/ledger/batch_import.py          # 全量导入 2025-07 ~ 2026-06
     python life/ledger/batch_import.py --clear  # 清空后全量
+    python life/ledger/batch_import.py --prefetch 3 --workers 4  # 流水线：预取 + 多进程解析 + 单线程按月写库
 """
 
 import argparse
@@ -27,15 +28,15 @@ if str(JOPLINAI) not in sys.path:
 from life.ledger.db import Database
 from life.ledger.accounts import AccountManager
 from life.ledger.transactions import TransactionManager
-from life.ledger.cloudcfg import get_sms_api_url
-from life.wechat_finance import parse_finance_messages, classify_merchant, load_category_map
-from life.sms_finance import parse_sms_records
+from life.ledger.fetchcache import MonthCache
+from life.ledger.pipeline import (
+    run_pipeline, thread_local_factory, init_parse_worker, parse_worker_args, parse_month_messages,
+)
+from life.wechat_finance import load_category_map
 from aimod.wechat_client import WeChatClient
 from func.configpr import getcfpoptionvalue
 from func.logme import log
 
-import urllib.request, json, ssl
-
 
 def get_sms_api_key() -> str:
     key = getcfpoptionvalue("happyjphard", "sms_collector", "api_key")
@@ -44,61 +45,16 @@ def get_sms_api_key() -> str:
     return ""
 
 
-def fetch_wechat_financial(account_name: str, year: int, month: int, client, cat_map) -> list:
-    date_from = f"{year}-{month:02d}-01"
-    if month == 12:
-        date_to = f"{year + 1}-01-01"
-    else:
-        date_to = f"{year}-{month + 1:02d}-01"
-    msgs = client.query(account_name, date_from=date_from, date_to=date_to, limit=50000)
-    records = parse_finance_messages(msgs)
-    for r in records:
-        if r["category"] == "未分类-其他":
-            r["category"] = classify_merchant(r["merchant"], cat_map)
-    return records
-
-
-def fetch_sms_financial(year: int, month: int) -> list:
-    sms_api = get_sms_api_url()
-    key = get_sms_api_key()
-    if not key:
-        return []
-
-    date_from = f"{year}-{month:02d}-01"
-    if month == 12:
-        date_to = f"{year + 1}-01-01"
-    else:
-        date_to = f"{year}-{month + 1:02d}-01"
-
-    url = f"{sms_api}?date_from={date_from}&date_to={date_to}&limit=50000"
-    ctx = ssl.create_default_context()
-    ctx.check_hostname = False
-    ctx.verify_mode = ssl.CERT_NONE
-    req = urllib.request.Request(url)
-    req.add_header("X-API-Key", key)
-
-    try:
-        resp = urllib.request.urlopen(req, timeout=30, context=ctx)
-        data = json.loads(resp.read().decode())
-        sms_list = data.get("records", [])
-    except Exception as e:
-        log.warning(f"SMS API 失败 ({year}-{month:02d}): {e}")
-        return []
-
-    records = parse_sms_records(sms_list)
-    cat_map = load_category_map()
-    for r in records:
-        if r.get("category", "") == "未分类-其他":
-            r["category"] = classify_merchant(r["merchant"], cat_map)
-    return records
-
-
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("--clear", action="store_true", help="清空现有流水后重新导入")
     parser.add_argument("--from-month", default="2025-07", help="起始月份 格式 YYYY-MM")
     parser.add_argument("--to-month", default="2026-06", help="截止月份 格式 YYYY-MM")
     parser.add_argument("--account", default="白晔峰", help="微信账户名")
+    parser.add_argument("--refresh-cache", action="store_true", help="忽略已封月的本地缓存，重新拉取")
+    parser.add_argument("--prefetch", type=int, default=0,
+                        help="流水线模式：提前拉取/解析的月份数（0 为逐月顺序导入）")
+    parser.add_argument("--workers", type=int, default=2, help="流水线模式下解析月份的进程数")
     args = parser.parse_args()
 
     db = Database()
@@ -109,55 +65,71 @@ def main():
         confirm = input("将清空所有 account_flows 数据，确认？(yes/no): ")
         if confirm == "yes":
             db.execute("DELETE FROM account_flows")
+            db.execute("DELETE FROM flow_rollups")
+            db.execute("DELETE FROM import_journal")
+            db.commit()
             print("已清空所有流水数据")
         else:
             print("取消")
             return
 
-    # 初始化 WeChatClient
-    client = WeChatClient(mode="local", db_path=str(JOPLINAI / "data" / "wcitemsall_merged.db"))
-    cat_map = load_category_map()
+    # WeChatClient 本地模式持有 SQLite 连接，预取线程各建一个
+    wechat_client = thread_local_factory(
+        lambda: WeChatClient(mode="local", db_path=str(JOPLINAI / "data" / "wcitemsall_merged.db")))
+    cache = MonthCache(refresh=args.refresh_cache)
+    sms_key = get_sms_api_key()
+    # 没有短信密钥时只按微信来源替换，空短信列表绝不能进 merged 替换（会删光该月短信流水）
+    source = "merged" if sms_key else "wechat"
+    if not sms_key:
+        log.warning("未配置 SMS API 密钥，只导入微信流水，库内短信流水保持不变")
 
     # 解析月份范围
     from_year, from_month = map(int, args.from_month.split("-"))
     to_year, to_month = map(int, args.to_month.split("-"))
+    months = [(y, m) for y in range(from_year, to_year + 1)
+              for m in range(from_month if y == from_year else 1, (to_month if y == to_year else 12) + 1)]
 
-    total_flows = 0
-    months_processed = 0
-
-    year, month = from_year, from_month
-    while (year < to_year) or (year == to_year and month <= to_month):
-        month_key = f"{year}-{month:02d}"
-        print(f"\n{'='*50}")
-        print(f"  处理 {month_key}")
-
-        # 微信
+    def fetch(ym):
+        year, month = ym
         try:
-            wx_records = fetch_wechat_financial(args.account, year, month, client, cat_map)
+            msgs = cache.wechat_month(wechat_client(), args.account, year, month, limit=50000)
         except Exception as e:
-            log.error(f"微信 {month_key} 失败: {e}")
-            wx_records = []
-
-        # 短信
-        sms_records = fetch_sms_financial(year, month)
-
+            # 按月替换流水，缺了微信会把该月微信流水当作消失而删除，整月跳过
+            log.error(f"微信 {year}-{month:02d} 失败，本月跳过: {e}")
+            return [], []
+        if not sms_key:
+            return msgs, []
+        try:
+            sms_list = cache.sms_month(year, month, api_key=sms_key)
+        except Exception as e:
+            # 同理，拿不到短信也不能当作本月无短信
+            log.error(f"短信 {year}-{month:02d} 失败，本月跳过: {e}")
+            return [], []
+        return msgs, sms_list
+
+    def write(ym, parsed):
+        month_key = f"{ym[0]}-{ym[1]:02d}"
+        wx_records, sms_records = parsed
+        print(f"\n{'='*50}")
+        print(f"  处理 {month_key}")
         print(f"  微信: {len(wx_records)} 条, 短信: {len(sms_records)} 条")
 
         if not wx_records and not sms_records:
             print(f"  跳过（无数据）")
+            return 0
+        result = tx_mgr.import_month(wx_records, sms_records, month_key, source=source)
+        if not result["changed"]:
+            print(f"  未变化，保留 {result['kept']} 条流水")
         else:
-            result = tx_mgr.import_merged(wx_records, sms_records, month_key)
-            print(f"  导入完成: {result['total_flows']} 条流水, {result['accounts_involved']} 个账户")
-            total_flows += result["total_flows"]
-
-        months_processed += 1
-
-        # 下个月
-        if month == 12:
-            year += 1
-            month = 1
-        else:
-            month += 1
+            print(f"  导入完成: {result['total_flows']} 条流水"
+                  f"（新写入 {result['inserted']} / 删除 {result['deleted']} / 保留 {result['kept']}）")
+        return result["total_flows"]
+
+    total_flows = sum(run_pipeline(
+        months, fetch, parse_month_messages, write, prefetch=args.prefetch, workers=args.workers,
+        initializer=init_parse_worker, initargs=parse_worker_args(load_category_map()),
+    ))
+    months_processed = len(months)
 
     print(f"\n{'='*50}")
     print(f"全量导入完成: {months_processed} 个月, 共 {total_flows} 条流水")
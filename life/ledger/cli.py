@@ -18,6 +18,9 @@
     python -m life.ledger.cli tx add --date 2026-06-15 --amount 5000 --account 1 --direction outflow
 
     python -m life.ledger.cli balance set --account 1 --year 2026 --month 6 --balance 12345.67
+
+    python -m life.ledger.cli rollup verify
+    python -m life.ledger.cli rollup rebuild
 """
 
 import argparse
@@ -120,6 +123,22 @@ def _import_wechat_events(args, year: int, month: int):
     return []
 
 
+def _apply_import(tx_mgr: TransactionManager, wx_records: list, sms_records: list,
+                  month_key: str, source: str, force: bool = False) -> dict:
+    """按导入日志导入一个月：输入未变则跳过；有变化且已有余额记录时从该月起滚动余额。"""
+    result = tx_mgr.import_month(wx_records, sms_records, month_key, source=source, force=force)
+    if not result["changed"]:
+        print(f"{month_key} 输入未变化，跳过（保留 {result['kept']} 条流水）")
+        return result
+    log.info(f"{month_key}: 新写入 {result['inserted']} / 删除 {result['deleted']} / 保留 {result['kept']} 条流水"
+             f"（保留中改分类 {result['recategorized']} 条）")
+    if tx_mgr.db.fetchone("SELECT 1 AS x FROM account_balances LIMIT 1"):
+        year, month = map(int, month_key.split("-"))
+        balances = tx_mgr.roll_balances_forward(year, month)
+        log.info(f"已从 {month_key} 起滚动余额: {len(balances)} 条")
+    return result
+
+
 def cmd_import_wechat(args):
     year, month = _parse_month(args.month)
     month_key = f"{year}-{month:02d}"
@@ -128,7 +147,7 @@ def cmd_import_wechat(args):
     tx_mgr = TransactionManager(db, acct_mgr)
 
     # 复用 wechat_finance 的 parse_finance_messages
-    from life.wechat_finance import parse_finance_messages, classify_merchant, load_category_map
+    from life.wechat_finance import parse_finance_messages, MerchantClassifier, load_category_map
     from aimod.wechat_client import WeChatClient
 
     client = WeChatClient(mode="local", db_path=str(JOPLINAI / "data" / "wcitemsall_merged.db"))
@@ -138,14 +157,14 @@ def cmd_import_wechat(args):
     msgs = client.query(args.account, date_from=date_from, date_to=date_to, limit=50000)
     log.info(f"拉取 {len(msgs)} 条消息")
     records = parse_finance_messages(msgs)
-    cat_map = load_category_map()
+    classifier = MerchantClassifier(load_category_map())
     for r in records:
         if r["category"] == "未分类-其他":
-            r["category"] = classify_merchant(r["merchant"], cat_map)
+            r["category"] = classifier.classify(r["merchant"])
 
     log.info(f"识别 {len(records)} 条财务记录")
-    result = tx_mgr.import_wechat(records, month_key)
-    print(f"微信导入完成: {result} 条流水")
+    result = _apply_import(tx_mgr, records, [], month_key, "wechat", args.force)
+    print(f"微信导入完成: {result['total_flows']} 条流水")
 
 
 def cmd_import_sms(args):
@@ -186,13 +205,13 @@ def cmd_import_sms(args):
 
     records = parse_sms_records(sms_list)
     log.info(f"SMS: {len(sms_list)}条 → {len(records)}条财务记录")
-    from life.wechat_finance import classify_merchant, load_category_map
-    sms_cat_map = load_category_map()
+    from life.wechat_finance import MerchantClassifier, load_category_map
+    classifier = MerchantClassifier(load_category_map())
     for r in records:
         if r.get("category", "") == "未分类-其他":
-            r["category"] = classify_merchant(r["merchant"], sms_cat_map)
-    result = tx_mgr.import_sms(records, month_key)
-    print(f"短信导入完成: {result} 条流水")
+            r["category"] = classifier.classify(r["merchant"])
+    result = _apply_import(tx_mgr, [], records, month_key, "sms", args.force)
+    print(f"短信导入完成: {result['total_flows']} 条流水")
 
 
 def cmd_import_all(args):
@@ -203,7 +222,7 @@ def cmd_import_all(args):
     tx_mgr = TransactionManager(db, acct_mgr)
 
     # 微信
-    from life.wechat_finance import parse_finance_messages, classify_merchant, load_category_map
+    from life.wechat_finance import parse_finance_messages, MerchantClassifier, load_category_map
     from aimod.wechat_client import WeChatClient
 
     client = WeChatClient(mode="local", db_path=str(JOPLINAI / "data" / "wcitemsall_merged.db"))
@@ -213,10 +232,10 @@ def cmd_import_all(args):
     msgs = client.query(args.account, date_from=date_from, date_to=date_to, limit=50000)
     log.info(f"微信: 拉取 {len(msgs)} 条消息")
     wx_records = parse_finance_messages(msgs)
-    cat_map = load_category_map()
+    classifier = MerchantClassifier(load_category_map())
     for r in wx_records:
         if r["category"] == "未分类-其他":
-            r["category"] = classify_merchant(r["merchant"], cat_map)
+            r["category"] = classifier.classify(r["merchant"])
     log.info(f"微信: {len(wx_records)} 条财务记录")
 
     # 短信
@@ -240,17 +259,18 @@ def cmd_import_all(args):
         data = json.loads(resp.read().decode())
         sms_list = data.get("records", [])
     except Exception as e:
-        log.warning(f"SMS API 失败: {e}")
-        sms_list = []
+        # 按月替换流水，缺了短信会把该月短信流水当作消失而删除，宁可本次不导入
+        log.error(f"SMS API 失败，本月不导入: {e}")
+        return
 
     sms_records = parse_sms_records(sms_list) if sms_list else []
     for r in sms_records:
         if r.get("category", "") == "未分类-其他":
-            r["category"] = classify_merchant(r["merchant"], cat_map)
+            r["category"] = classifier.classify(r["merchant"])
     log.info(f"SMS: {len(sms_list)}条 → {len(sms_records)}条记录")
 
     # 归并导入
-    result = tx_mgr.import_merged(wx_records, sms_records, month_key)
+    result = _apply_import(tx_mgr, wx_records, sms_records, month_key, "merged", args.force)
     print(f"合并导入完成: 共 {result['total_flows']} 条流水")
     print(f"  来源分布: {result['by_source']}")
     print(f"  涉及账户: {result['accounts_involved']} 个")
@@ -362,6 +382,33 @@ def cmd_balance_calc(args):
     print(f"已计算 {len(results)} 个账户的 {year}-{month:02d} 余额")
 
 
+# ── rollup ──
+
+def cmd_rollup_verify(args):
+    from .rollups import FlowRollups
+    db = _get_db()
+    mismatches = FlowRollups(db).verify()
+    if not mismatches:
+        n = db.fetchone("SELECT COUNT(*) AS n FROM flow_rollups")["n"]
+        print(f"月度汇总与流水一致（{n} 行）")
+        return
+    print(f"{'年月':<8} {'账户':<6} {'分类':<6} {'方向':<8} {'类型':<18} {'应为':<24} {'实际':<24}")
+    print("-" * 98)
+    for m in mismatches[:args.limit]:
+        expected = f"¥{m['expected_total']:,.2f}/{m['expected_cnt']}笔"
+        actual = f"¥{m['total']:,.2f}/{m['cnt']}笔"
+        print(f"{m['ym']:<8} {m['account_id']:<6} {m['category_id']:<6} {m['direction']:<8} {m['tx_type']:<18} "
+              f"{expected:<24} {actual:<24}")
+    print(f"\n共 {len(mismatches)} 组不一致，运行 rollup rebuild 重建")
+    sys.exit(1)
+
+
+def cmd_rollup_rebuild(args):
+    from .rollups import FlowRollups
+    n = FlowRollups(_get_db()).rebuild()
+    print(f"已由流水重建月度汇总：{n} 行")
+
+
 # ── 主入口 ──
 
 def main():
@@ -394,10 +441,12 @@ def main():
         p = p_import_sub.add_parser(src)
         p.add_argument("--month", required=True)
         p.add_argument("--account", default="白晔峰")
+        p.add_argument("--force", action="store_true", help="忽略导入日志，重新路由比对本月流水")
 
     p_all = p_import_sub.add_parser("all")
     p_all.add_argument("--month", required=True)
     p_all.add_argument("--account", default="白晔峰")
+    p_all.add_argument("--force", action="store_true", help="忽略导入日志，重新路由比对本月流水")
 
     # report
     p_report = sub.add_parser("report")
@@ -455,6 +504,16 @@ def main():
     p_bal_calc = p_bal_sub.add_parser("calc")
     p_bal_calc.add_argument("--month")
 
+    # rollup
+    p_roll = sub.add_parser("rollup")
+    p_roll_sub = p_roll.add_subparsers(dest="action")
+    p_roll_sub.required = True
+
+    p_roll_verify = p_roll_sub.add_parser("verify")
+    p_roll_verify.add_argument("--limit", type=int, default=50, help="最多列出的不一致分组数")
+
+    p_roll_sub.add_parser("rebuild")
+
     args = parser.parse_args()
 
     # 分发
@@ -472,6 +531,8 @@ def main():
         ("tx", "add"): cmd_tx_add,
         ("balance", "set"): cmd_balance_set,
         ("balance", "calc"): cmd_balance_calc,
+        ("rollup", "verify"): cmd_rollup_verify,
+        ("rollup", "rebuild"): cmd_rollup_rebuild,
     }
 
     key = (args.cmd, getattr(args, "action", None) or getattr(args, "source", None) or getattr(args, "report_type", None))
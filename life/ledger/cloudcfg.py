@@ -5,6 +5,7 @@
 
 设计：
     - 进程级一次性加载，首次 get_*() 触发 _load_from_cloud()
+    - 子进程用 install_config(export_config()) 复用父进程已加载的配置
     - Joplin API 不可达时静默失败，返回硬编码默认值
     - 复杂结构（映射/列表）用 JSON 值存储
 """
@@ -25,6 +26,7 @@ with pathmagic.context():
 _DEFAULT_SMS_API_URL = "https://ollama.qingxd.com/sms/query"
 _DEFAULT_WECHAT_API_URL = "https://ollama.qingxd.com/wechat/query"
 _DEFAULT_MERGE_WINDOW = 30
+_DEFAULT_LOAN_DEDUP_DAYS = 3
 
 _DEFAULT_BANK_SHORT_CODES = {
     "95555": "招商银行", "95588": "工商银行", "95599": "农业银行",
@@ -129,6 +131,19 @@ def _ensure_loaded():
         _cache_loaded = True
 
 
+def export_config() -> dict:
+    """已加载配置的快照（可 pickle），用于把同一份配置交给子进程。"""
+    _ensure_loaded()
+    return dict(_cache)
+
+
+def install_config(config: dict):
+    """以现成快照作为本进程配置，不再读取云端；用作进程池 initializer，各 worker 只读共享父进程已加载的配置。"""
+    global _cache, _cache_loaded
+    _cache = dict(config)
+    _cache_loaded = True
+
+
 # ── 类型化访问器 ──
 
 def get_sms_api_url() -> str:
@@ -146,6 +161,12 @@ def get_merge_window() -> int:
     return int(_cache.get("merge_window", _DEFAULT_MERGE_WINDOW))
 
 
+def get_loan_dedup_days() -> int:
+    """贷款流水近重复判定的日期窗口（±天）。"""
+    _ensure_loaded()
+    return int(_cache.get("loan_dedup_days", _DEFAULT_LOAN_DEDUP_DAYS))
+
+
 def get_bank_short_codes() -> dict:
     _ensure_loaded()
     return _cache.get("bank_short_codes", dict(_DEFAULT_BANK_SHORT_CODES))
@@ -2,6 +2,7 @@
 
 import sqlite3
 import threading
+from contextlib import contextmanager
 from pathlib import Path
 
 import pathmagic
@@ -63,6 +64,30 @@ class Database:
     def fetchall(self, sql: str, params=()) -> list:
         return [dict(r) for r in self.conn.execute(sql, params).fetchall()]
 
+    @contextmanager
+    def transaction(self):
+        """显式事务：块内的 insert/update/upsert 不再逐条提交，退出时统一提交，异常时回滚。
+
+        可嵌套，只有最外层负责提交/回滚。
+        """
+        depth = getattr(_local, "tx_depth", 0)
+        _local.tx_depth = depth + 1
+        try:
+            yield self
+        except BaseException:
+            if depth == 0:
+                self.conn.rollback()
+            raise
+        else:
+            if depth == 0:
+                self.conn.commit()
+        finally:
+            _local.tx_depth = depth
+
+    def _autocommit(self):
+        if getattr(_local, "tx_depth", 0) == 0:
+            self.conn.commit()
+
     def insert(self, table: str, data: dict) -> int:
         cols = ", ".join(data.keys())
         vals = ", ".join(["?"] * len(data))
@@ -70,20 +95,25 @@ class Database:
             f"INSERT INTO {table} ({cols}) VALUES ({vals})",
             list(data.values()),
         )
-        self.conn.commit()
+        self._autocommit()
         return cur.lastrowid
 
     def insert_many(self, table: str, records: list) -> list:
+        """executemany 批量插入，返回全部新 id（与 records 顺序一致）。
+
+        records 须键相同且不含 id；同一事务内 rowid 连续分配，由 last_insert_rowid() 倒推。
+        """
         if not records:
             return []
         cols = ", ".join(records[0].keys())
         vals = ", ".join(["?"] * len(records[0]))
         rows = [list(r.values()) for r in records]
-        cur = self.conn.executemany(
-            f"INSERT INTO {table} ({cols}) VALUES ({vals})", rows
-        )
-        self.conn.commit()
-        return [cur.lastrowid]
+        with self.transaction():
+            self.conn.executemany(
+                f"INSERT INTO {table} ({cols}) VALUES ({vals})", rows
+            )
+            last_id = self.conn.execute("SELECT last_insert_rowid()").fetchone()[0]
+        return list(range(last_id - len(rows) + 1, last_id + 1))
 
     def update(self, table: str, data: dict, where: dict):
         set_clause = ", ".join(f"{k}=?" for k in data)
@@ -92,7 +122,7 @@ class Database:
             f"UPDATE {table} SET {set_clause} WHERE {where_clause}",
             list(data.values()) + list(where.values()),
         )
-        self.conn.commit()
+        self._autocommit()
 
     def upsert(self, table: str, data: dict, conflict_cols: list):
         """INSERT ... ON CONFLICT DO UPDATE。"""
@@ -101,7 +131,7 @@ class Database:
         updates = ", ".join(f"{k}=excluded.{k}" for k in data if k not in conflict_cols)
         sql = f"INSERT INTO {table} ({cols}) VALUES ({vals}) ON CONFLICT({','.join(conflict_cols)}) DO UPDATE SET {updates}"
         self.conn.execute(sql, list(data.values()))
-        self.conn.commit()
+        self._autocommit()
 
     def commit(self):
         self.conn.commit()
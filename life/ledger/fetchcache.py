@@ -0,0 +1,283 @@
+# 个人财务系统 — 月度原始数据本地缓存
+
+"""按月缓存从 SMS API / WeChatClient 拉取的原始消息，重导时已结束的月份直接读盘。
+
+存储：data/ledger_fetch_cache.db
+    - blobs:  digest → zlib 压缩的 JSON 数组（内容寻址，相同内容只存一份）
+    - months: (source, key, month) → digest + 校验信息（etag、max_id、条数、拉取时间、是否已封月）
+
+校验策略：
+    - 封月：月末 + grace_days 之后拉取的条目视为最终版本，直接读盘，不再访问网络
+    - 未封月（当月或刚结束）：SMS 带 If-None-Match 请求，304 直接读盘；
+      200 时比较内容 digest，未变化只刷新拉取时间，变化才写入新 blob（日志给出条数与 max_id 变化）
+    - 微信本地库查询无 ETag，未封月每次重查，封月后读盘
+
+用法：
+    from life.ledger.fetchcache import MonthCache
+    cache = MonthCache()
+    sms_list = cache.sms_month(2025, 3, api_key=key)
+    msgs = cache.wechat_month(client, "白晔峰", 2025, 3)
+"""
+
+import hashlib
+import json
+import sqlite3
+import ssl
+import urllib.error
+import urllib.request
+import zlib
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Optional
+
+import pathmagic
+
+with pathmagic.context():
+    from func.first import getdirmain
+    from func.logme import log
+
+from .cloudcfg import get_sms_api_url
+
+__all__ = ["MonthCache", "fetch_sms_api"]
+
+_CACHE_SQL = """
+CREATE TABLE IF NOT EXISTS blobs (
+    digest TEXT PRIMARY KEY,
+    data BLOB NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS months (
+    source TEXT NOT NULL,
+    key TEXT NOT NULL DEFAULT '',
+    month TEXT NOT NULL,
+    digest TEXT NOT NULL REFERENCES blobs(digest),
+    etag TEXT DEFAULT '',
+    max_id TEXT DEFAULT '',
+    count INTEGER DEFAULT 0,
+    fetched_at TEXT NOT NULL,
+    is_final INTEGER DEFAULT 0,
+    PRIMARY KEY (source, key, month)
+);
+"""
+
+_DEFAULT_GRACE_DAYS = 3  # 月末后多少天内仍可能有迟到的消息
+
+
+def _month_bounds(year: int, month: int) -> tuple:
+    """[月初, 次月初) 日期字符串。"""
+    date_from = f"{year}-{month:02d}-01"
+    date_to = f"{year}-{month + 1:02d}-01" if month < 12 else f"{year + 1}-01-01"
+    return date_from, date_to
+
+
+def _digest(records: list) -> tuple:
+    """规范化 JSON 的 sha256 与对应字节串。"""
+    raw = json.dumps(records, ensure_ascii=False, sort_keys=True, default=str).encode("utf-8")
+    return hashlib.sha256(raw).hexdigest(), raw
+
+
+def _max_id(records: list) -> str:
+    """记录水位：有 id 取最大 id，否则取最晚的 received/time。"""
+    ids = [r.get("id") for r in records if isinstance(r, dict) and r.get("id") is not None]
+    if ids:
+        return str(max(ids, key=lambda v: (isinstance(v, str), v)))
+    stamps = [str(r.get("received") or r.get("time") or "") for r in records if isinstance(r, dict)]
+    return max(stamps, default="")
+
+
+def fetch_sms_api(date_from: str, date_to: str, api_key: str = "", etag: str = "",
+                  timeout: int = 30) -> tuple:
+    """请求 SMS API，返回 (records, etag, not_modified)。
+
+    带 etag 时发送 If-None-Match，服务端返回 304 则 not_modified=True、records 为 None。
+    请求失败抛出异常，由调用方决定回落。
+    """
+    url = f"{get_sms_api_url()}?date_from={date_from}&date_to={date_to}&limit=50000"
+    ctx = ssl.create_default_context()
+    ctx.check_hostname = False
+    ctx.verify_mode = ssl.CERT_NONE
+
+    req = urllib.request.Request(url)
+    if api_key:
+        req.add_header("X-API-Key", api_key)
+    if etag:
+        req.add_header("If-None-Match", etag)
+
+    try:
+        resp = urllib.request.urlopen(req, timeout=timeout, context=ctx)
+    except urllib.error.HTTPError as e:
+        if e.code == 304:
+            return None, etag, True
+        raise
+    data = json.loads(resp.read().decode())
+    return data.get("records", []), resp.headers.get("ETag", "") or "", False
+
+
+class MonthCache:
+    """月度原始消息的本地缓存，每次操作单独开连接，可在多线程预取中共用。"""
+
+    def __init__(self, path: str = None, grace_days: int = _DEFAULT_GRACE_DAYS, refresh: bool = False) -> None:
+        """打开（必要时建表）缓存库，path 默认 data/ledger_fetch_cache.db；grace_days 为次月初之后的封月宽限天数。"""
+        if path is None:
+            path = str(getdirmain() / "data" / "ledger_fetch_cache.db")
+        self.path = path
+        self.grace_days = grace_days
+        self.refresh = refresh  # True 时忽略已封月条目，强制重新拉取
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        with self._connect() as conn:
+            conn.executescript(_CACHE_SQL)
+
+    @contextmanager
+    def _connect(self):
+        """短连接：退出时提交并关闭。"""
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    # ── 封月判断 ──
+
+    def closed_at(self, year: int, month: int) -> datetime:
+        """该月数据视为不再变化的时刻：次月初 + grace_days。"""
+        _, date_to = _month_bounds(year, month)
+        return datetime.strptime(date_to, "%Y-%m-%d") + timedelta(days=self.grace_days)
+
+    def is_closed(self, year: int, month: int, now: datetime = None) -> bool:
+        """now（默认当前时刻）是否已过该月的封月时刻。"""
+        return (now or datetime.now()) >= self.closed_at(year, month)
+
+    # ── 读写 ──
+
+    def lookup(self, source: str, key: str, year: int, month: int) -> Optional[dict]:
+        """缓存元信息（不含数据），无条目返回 None。"""
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT * FROM months WHERE source=? AND key=? AND month=?",
+                (source, key, f"{year}-{month:02d}"),
+            ).fetchone()
+        return dict(row) if row else None
+
+    def load(self, digest: str) -> Optional[list]:
+        """按 digest 取回解压后的记录列表，blob 不存在返回 None。"""
+        with self._connect() as conn:
+            row = conn.execute("SELECT data FROM blobs WHERE digest=?", (digest,)).fetchone()
+        if row is None:
+            return None
+        return json.loads(zlib.decompress(row["data"]).decode("utf-8"))
+
+    def store(self, source: str, key: str, year: int, month: int, records: list, etag: str = "") -> str:
+        """写入一个月的数据，返回内容 digest。"""
+        digest, raw = _digest(records)
+        now = datetime.now()
+        with self._connect() as conn:
+            conn.execute("INSERT OR IGNORE INTO blobs (digest, data) VALUES (?, ?)",
+                         (digest, zlib.compress(raw, 6)))
+            conn.execute(
+                """INSERT INTO months (source, key, month, digest, etag, max_id, count, fetched_at, is_final)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                   ON CONFLICT(source, key, month) DO UPDATE SET
+                   digest=excluded.digest, etag=excluded.etag, max_id=excluded.max_id,
+                   count=excluded.count, fetched_at=excluded.fetched_at, is_final=excluded.is_final""",
+                (source, key, f"{year}-{month:02d}", digest, etag, _max_id(records), len(records),
+                 now.isoformat(timespec="seconds"), 1 if self.is_closed(year, month, now) else 0),
+            )
+            conn.execute("DELETE FROM blobs WHERE digest NOT IN (SELECT digest FROM months)")
+        return digest
+
+    def touch(self, source: str, key: str, year: int, month: int, etag: str = ""):
+        """内容未变：只刷新拉取时间（及封月标记、etag）。"""
+        now = datetime.now()
+        with self._connect() as conn:
+            conn.execute(
+                """UPDATE months SET fetched_at=?, is_final=?, etag=CASE WHEN ?='' THEN etag ELSE ? END
+                   WHERE source=? AND key=? AND month=?""",
+                (now.isoformat(timespec="seconds"), 1 if self.is_closed(year, month, now) else 0,
+                 etag, etag, source, key, f"{year}-{month:02d}"),
+            )
+
+    def invalidate(self, source: str = None, month: str = None) -> int:
+        """删除缓存条目（可按来源/月份过滤），返回删除条数。"""
+        sql, params = "DELETE FROM months WHERE 1=1", []
+        if source:
+            sql += " AND source=?"
+            params.append(source)
+        if month:
+            sql += " AND month=?"
+            params.append(month)
+        with self._connect() as conn:
+            n = conn.execute(sql, params).rowcount
+            conn.execute("DELETE FROM blobs WHERE digest NOT IN (SELECT digest FROM months)")
+        return n
+
+    def _cached_final(self, source: str, key: str, year: int, month: int) -> tuple:
+        """(元信息, 数据)；只有已封月且未要求刷新时才返回数据。"""
+        meta = self.lookup(source, key, year, month)
+        if meta is None or self.refresh or not meta["is_final"]:
+            return meta, None
+        return meta, self.load(meta["digest"])
+
+    # ── 数据源 ──
+
+    def sms_month(self, year: int, month: int, api_key: str = "") -> list:
+        """一个月的原始短信。封月读盘；否则按 ETag / 内容 digest 校验后决定是否更新缓存。
+
+        API 失败时回落到已有缓存（哪怕未封月）；都没有则抛出原异常，不返回 []——
+        空列表会被按月替换导入当作"本月无短信"而删光该月短信流水，调用方应跳过该月。
+        """
+        source, key = "sms", ""
+        meta, records = self._cached_final(source, key, year, month)
+        if records is not None:
+            return records
+
+        date_from, date_to = _month_bounds(year, month)
+        try:
+            fetched, etag, not_modified = fetch_sms_api(
+                date_from, date_to, api_key=api_key, etag=(meta or {}).get("etag", "") or "")
+        except Exception as e:
+            log.warning(f"SMS API 失败 ({year}-{month:02d}): {e}")
+            cached = self.load(meta["digest"]) if meta else None
+            if cached is None:
+                raise
+            return cached
+
+        if not_modified and meta:
+            self.touch(source, key, year, month, etag)
+            return self.load(meta["digest"]) or []
+        self._update(source, key, year, month, meta, fetched, etag)
+        return fetched
+
+    def wechat_month(self, client, account: str, year: int, month: int, limit: int = 100000) -> list:
+        """一个月的微信消息（WeChatClient.query）。封月读盘，否则重查并更新缓存。"""
+        source, key = "wechat", account
+        meta, records = self._cached_final(source, key, year, month)
+        if records is not None:
+            return records
+
+        date_from, date_to = _month_bounds(year, month)
+        fetched = client.query(account, date_from=date_from, date_to=date_to, limit=limit)
+        self._update(source, key, year, month, meta, fetched)
+        return fetched
+
+    def _update(self, source: str, key: str, year: int, month: int, meta: Optional[dict],
+                fetched: list, etag: str = ""):
+        """新拉到的数据与缓存比较：内容相同只 touch，不同才写新 blob。"""
+        if meta and meta["digest"] == _digest(fetched)[0]:
+            self.touch(source, key, year, month, etag)
+            return
+        if meta:
+            log.info(f"  缓存更新 {source} {year}-{month:02d}: {meta['count']} → {len(fetched)} 条，"
+                     f"max_id {meta['max_id'] or '-'} → {_max_id(fetched) or '-'}")
+        self.store(source, key, year, month, fetched, etag)
+
+    def stats(self) -> list:
+        """各来源缓存概况：[(source, key, 月数, 封月数, 消息总数)]。"""
+        with self._connect() as conn:
+            rows = conn.execute(
+                """SELECT source, key, COUNT(*) AS months, SUM(is_final) AS final, SUM(count) AS total
+                   FROM months GROUP BY source, key ORDER BY source, key"""
+            ).fetchall()
+        return [tuple(r) for r in rows]
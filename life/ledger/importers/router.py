@@ -3,18 +3,21 @@
 import json
 import re
 import hashlib
+from bisect import bisect_left, insort
 from collections import defaultdict
-from datetime import datetime, timedelta
+from datetime import datetime
 from typing import Optional
 
 from ..db import Database
 from ..accounts import AccountManager
-from ..cloudcfg import get_merge_window, get_loan_platforms
+from ..cloudcfg import get_merge_window, get_loan_dedup_days, get_loan_platforms
 from ..models import Account, AccountFlow
 
 __all__ = ["FlowRouter"]
 
 MERGE_WINDOW = get_merge_window()
+LOAN_DEDUP_DAYS = get_loan_dedup_days()
+_EPOCH0 = datetime(1970, 1, 1)
 
 
 class FlowRouter:
@@ -26,10 +29,13 @@ class FlowRouter:
     3. 路由：单条分录（常规收支）vs 双条分录（贷款放款/还款）
     """
 
-    def __init__(self, db: Database, acct_mgr: AccountManager):
+    def __init__(self, db: Database, acct_mgr: AccountManager, merge_window: Optional[int] = None):
         self.db = db
         self.acct_mgr = acct_mgr
+        self.merge_window = MERGE_WINDOW if merge_window is None else int(merge_window)
         self._cat_cache = {}  # category_name → category_id
+        self._credit_inflows = None  # (account_id, 金额分) → 有序日序号，route_events 内按需载入
+        self._replacing = None  # (ym, sources)：route_events 将替换的旧流水，载入入账索引时排除
 
     @staticmethod
     def _detect_loan_platform(text: str):
@@ -41,43 +47,31 @@ class FlowRouter:
                 return p
         return None
 
-    def route_events(self, wechat_events: list, sms_records: list) -> list:
-        """主入口：归并 + 匹配 + 路由。返回 AccountFlow 列表。"""
+    def route_events(self, wechat_events: list, sms_records: list, replacing: tuple = None) -> list:
+        """主入口：归并 + 匹配 + 路由。返回 AccountFlow 列表。
+
+        replacing=(ym, sources)：本批将替换库内该月这些来源的旧流水，旧流水不计入已有信用卡入账。
+        """
         flows = []
         used_sms = set()
+        # 信用卡入账索引每批重新载入：上一批的流水此时已写库；账户表被外部修改过则重载账户索引
+        self._credit_inflows = None
+        self.acct_mgr.refresh_if_changed()
+        self._replacing = replacing
 
-        # 建立 WeChat 事件索引: (date, amount) → [(event, idx)]
-        wx_index = defaultdict(list)
-        for i, evt in enumerate(wechat_events):
-            date = (evt.get("time") or "")[:10]
-            amt = round(evt.get("amount", 0), 2)
-            if amt > 0:
-                wx_index[(date, amt)].append((evt, i))
-
+        # 预先配对：按 (金额, 时间) 双指针扫描，跨零点也能归并
+        pairs = self._match_pairs(wechat_events, sms_records, self.merge_window)
         used_wx = set()
 
         # Phase 1: SMS 找 WeChat 归并
         for si, sms in enumerate(sms_records):
-            date = (sms.get("time") or "")[:10]
             amt = round(sms.get("amount", 0), 2)
             if amt <= 0:
                 continue
 
-            candidates = wx_index.get((date, amt), [])
-            matched = None
-            for wx_evt, wi in candidates:
-                if wi in used_wx:
-                    continue
-                # 内部转账（零钱提现/充值）不归并，它们是跨账户的不同交易腿
-                if wx_evt.get("category") == "内部-转账":
-                    continue
-                # 检查时间窗口
-                if self._time_diff_seconds(wx_evt.get("time", ""), sms.get("time", "")) <= MERGE_WINDOW:
-                    matched = (wx_evt, wi)
-                    break
-
-            if matched:
-                wx_evt, wi = matched
+            wi = pairs.get(si)
+            if wi is not None:
+                wx_evt = wechat_events[wi]
                 used_wx.add(wi)
                 used_sms.add(si)
                 # 归并：payment_method 从微信取，card_suffix 从短信取
@@ -88,6 +82,7 @@ class FlowRouter:
                 f = self._route_single_sms(sms)
                 if f:
                     flows.extend(f if isinstance(f, list) else [f])
+                    self._track_credit_inflows(f if isinstance(f, list) else [f])
                 used_sms.add(si)
 
         # Phase 2: 未被归并的 WeChat 事件
@@ -108,6 +103,7 @@ class FlowRouter:
             f = self._route_single_sms(sms)
             if f:
                 flows.extend(f if isinstance(f, list) else [f])
+                self._track_credit_inflows(f if isinstance(f, list) else [f])
 
         # 去重：同一 account_id + amount + 日期 ±1天 + direction 的合并
         flows = self._dedup_flows(flows)
@@ -116,6 +112,47 @@ class FlowRouter:
         flows.sort(key=lambda f: f.tx_date or "")
         return flows
 
+    @classmethod
+    def _match_pairs(cls, wechat_events: list, sms_records: list, window: int) -> dict:
+        """按 (金额, 时间) 排序后双指针扫描配对，返回 {sms 下标: wechat 下标}。
+
+        时间只解析一次为 epoch 秒；同金额组内两边都按时间升序，
+        短信依次取窗口内最早的未用微信事件，等价于逐条贪心但为线性复杂度。
+        """
+        wx_keyed = []
+        for i, evt in enumerate(wechat_events):
+            # 内部转账（零钱提现/充值）不归并，它们是跨账户的不同交易腿
+            if evt.get("category") == "内部-转账":
+                continue
+            cents = round(evt.get("amount", 0) * 100)
+            ts = cls._to_epoch(evt.get("time"))
+            if cents > 0 and ts is not None:
+                wx_keyed.append((cents, ts, i))
+
+        sms_keyed = []
+        for si, sms in enumerate(sms_records):
+            cents = round(sms.get("amount", 0) * 100)
+            ts = cls._to_epoch(sms.get("time"))
+            if cents > 0 and ts is not None:
+                sms_keyed.append((cents, ts, si))
+
+        if not wx_keyed or not sms_keyed:
+            return {}
+        wx_keyed.sort()
+        sms_keyed.sort()
+
+        pairs = {}
+        j, n = 0, len(wx_keyed)
+        for cents, ts, si in sms_keyed:
+            # 跳过金额更小、或已落在窗口左侧的微信事件（后续短信只会更晚）
+            while j < n and (wx_keyed[j][0] < cents
+                             or (wx_keyed[j][0] == cents and wx_keyed[j][1] < ts - window)):
+                j += 1
+            if j < n and wx_keyed[j][0] == cents and wx_keyed[j][1] <= ts + window:
+                pairs[si] = wx_keyed[j][2]
+                j += 1
+        return pairs
+
     # ── 归并 ──
 
     def _merge_event(self, wx_evt: dict, sms: dict) -> AccountFlow:
@@ -251,7 +288,7 @@ class FlowRouter:
             "信用卡还款" in source_text and "还款" in source_text
         )
         if is_cc_repayment:
-            bank = AccountManager._normalize_bank_name(org)
+            bank = self.acct_mgr.normalize_bank_name(org)
             if bank:
                 credit_acct = self._find_credit_card_for_bank(bank)
                 if credit_acct and not self._has_credit_inflow(credit_acct.id, amt, sms.get("time", "")):
@@ -381,29 +418,52 @@ class FlowRouter:
 
     def _find_credit_card_for_bank(self, bank_name: str) -> Optional[Account]:
         """找到指定银行的信用卡账户（还款双条分录用）。"""
-        row = self.db.fetchone(
-            "SELECT * FROM accounts WHERE type='bank_credit' AND bank=? AND is_active=1 ORDER BY id LIMIT 1",
-            (bank_name,),
-        )
-        if row:
-            return AccountManager._row_to_account(row)
-        return None
+        return self.acct_mgr.get_credit_card_for_bank(bank_name)
+
+    def _load_credit_inflows(self) -> dict:
+        """一次载入库内全部信用卡入账，按 (account_id, 金额分) 建有序日序号索引。"""
+        if self._credit_inflows is not None:
+            return self._credit_inflows
+        index = defaultdict(list)
+        sql = """SELECT f.account_id, f.amount, f.tx_date FROM account_flows f
+                 JOIN accounts a ON a.id = f.account_id
+                 WHERE a.type='bank_credit' AND f.direction='inflow'"""
+        params = []
+        if self._replacing:
+            ym, sources = self._replacing
+            sql += f" AND NOT (f.ym=? AND f.source IN ({','.join('?' * len(sources))}))"
+            params = [ym, *sources]
+        rows = self.db.fetchall(sql, params)
+        for r in rows:
+            day = self._to_ordinal(r["tx_date"])
+            if day is not None:
+                index[(r["account_id"], round(r["amount"] * 100))].append(day)
+        for days in index.values():
+            days.sort()
+        self._credit_inflows = index
+        return index
+
+    def _track_credit_inflows(self, flows: list):
+        """本批新产生的信用卡入账也记入索引，批内重复通知同样能被识别。"""
+        for f in flows:
+            if f.direction != "inflow":
+                continue
+            acct = self.acct_mgr.get_account(f.account_id)
+            day = self._to_ordinal(f.tx_date)
+            if acct and acct.type == "bank_credit" and day is not None:
+                index = self._load_credit_inflows()
+                insort(index[(f.account_id, round(f.amount * 100))], day)
 
     def _has_credit_inflow(self, credit_acct_id: int, amount: float, tx_date: str, days: int = 2) -> bool:
         """检查信用卡在时间窗口内是否已有同等金额的还款入账（防重复）。"""
-        try:
-            dt = datetime.strptime(tx_date[:10], "%Y-%m-%d")
-            start = (dt - timedelta(days=days)).strftime("%Y-%m-%d")
-            end = (dt + timedelta(days=days)).strftime("%Y-%m-%d")
-        except (ValueError, TypeError):
+        day = self._to_ordinal(tx_date)
+        if day is None:
             return False
-        row = self.db.fetchone(
-            """SELECT COUNT(*) as cnt FROM account_flows
-               WHERE account_id=? AND direction='inflow' AND amount=?
-               AND tx_date BETWEEN ? AND ?""",
-            (credit_acct_id, amount, start, end),
-        )
-        return row and row["cnt"] > 0
+        found = self._load_credit_inflows().get((credit_acct_id, round(amount * 100)))
+        if not found:
+            return False
+        pos = bisect_left(found, day - days)
+        return pos < len(found) and found[pos] <= day + days
 
     # ── 辅助 ──
 
@@ -451,13 +511,27 @@ class FlowRouter:
         return cat_id
 
     @staticmethod
-    def _time_diff_seconds(t1: str, t2: str) -> float:
+    def _to_epoch(t: str) -> Optional[int]:
+        """'YYYY-MM-DD HH:MM:SS' → 秒数（按本地时间直接折算，仅用于比较差值），无法解析返回 None。"""
+        try:
+            return int((datetime.strptime(t[:19], "%Y-%m-%d %H:%M:%S") - _EPOCH0).total_seconds())
+        except (ValueError, TypeError):
+            return None
+
+    @staticmethod
+    def _to_ordinal(tx_date: str) -> Optional[int]:
+        """'YYYY-MM-DD...' → 日序号，无法解析返回 None。"""
         try:
-            dt1 = datetime.strptime(t1[:19], "%Y-%m-%d %H:%M:%S")
-            dt2 = datetime.strptime(t2[:19], "%Y-%m-%d %H:%M:%S")
-            return abs((dt1 - dt2).total_seconds())
-        except (ValueError, OSError):
+            return datetime.strptime(tx_date[:10], "%Y-%m-%d").toordinal()
+        except (ValueError, TypeError):
+            return None
+
+    @classmethod
+    def _time_diff_seconds(cls, t1: str, t2: str) -> float:
+        e1, e2 = cls._to_epoch(t1), cls._to_epoch(t2)
+        if e1 is None or e2 is None:
             return 9999
+        return abs(e1 - e2)
 
     @staticmethod
     def _make_group_id(*items) -> str:
@@ -465,14 +539,18 @@ class FlowRouter:
         return hashlib.md5(raw.encode()).hexdigest()[:12]
 
     @staticmethod
-    def _dedup_flows(flows: list) -> list:
+    def _dedup_flows(flows: list, loan_days: int = None) -> list:
         """去除重复流水。
 
         精确匹配：相同 account + amount + date + direction。
-        贷款近匹配：相同 account + amount + direction，日期在 ±2 天内。
+        贷款近匹配：相同 account + amount + direction，日期在 ±loan_days 天内。
+        贷款近匹配按 (account, amount, direction) 分组，组内保存有序的日序号，
+        二分查找最近邻即可判定，无需回扫全部已见贷款流水。
         """
+        if loan_days is None:
+            loan_days = LOAN_DEDUP_DAYS
         seen_exact = set()
-        seen_loan = []  # [(account_id, amount, direction, tx_date)]
+        seen_loan = defaultdict(list)  # (account_id, amount, direction) → 有序日序号
         result = []
         for f in flows:
             amt = round(f.amount, 2)
@@ -483,26 +561,18 @@ class FlowRouter:
                 continue
             seen_exact.add(key)
 
-            # 贷款近匹配：同一 account + amount + direction 且在 ±3 天内
             is_loan_type = f.tx_type in ("loan_repayment", "loan_disbursement")
             if is_loan_type:
-                try:
-                    f_date = datetime.strptime(f.tx_date[:10], "%Y-%m-%d").date()
-                except (ValueError, TypeError):
+                f_day = FlowRouter._to_ordinal(f.tx_date)
+                if f_day is None:
                     result.append(f)
                     continue
 
-                is_dup = False
-                for sid, s_amt, s_dir, s_date in seen_loan:
-                    if sid == f.account_id and s_amt == amt and s_dir == f.direction:
-                        d_diff = abs((f_date - s_date).days)
-                        if d_diff <= 3:
-                            is_dup = True
-                            break
-
-                if is_dup:
+                days = seen_loan[(f.account_id, amt, f.direction)]
+                pos = bisect_left(days, f_day - loan_days)
+                if pos < len(days) and days[pos] <= f_day + loan_days:
                     continue
-                seen_loan.append((f.account_id, amt, f.direction, f_date))
+                insort(days, f_day)
 
             result.append(f)
         return result
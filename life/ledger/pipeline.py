@@ -0,0 +1,148 @@
+# 个人财务系统 — 多月份流水线导入
+
+"""按月份流水线导入：预取（线程池）→ 解析（进程池）→ 单线程按月份顺序写库。
+
+    run_pipeline(months, fetch, parse, write, prefetch=3, workers=2)
+
+    - fetch(month) 在线程池里执行（网络/本地库 I/O），最多领先写入 prefetch 个月
+    - parse(raw) 在进程池里执行（CPU 密集），必须是可 pickle 的模块级函数
+    - write(month, parsed) 只在调用线程里执行，严格按 months 顺序，ledger.db 只有一个写者
+    - 无法创建进程池（如 Termux 缺少 sem_open）或 workers <= 1 时，解析在预取线程里完成
+
+总耗时趋近 max(拉取, 解析, 写入) 而非三者之和。
+
+解析函数 parse_month_messages() 供 reimport_full / batch_import 共用，
+worker 用 init_parse_worker() 以父进程的分类表和云端配置初始化。
+"""
+
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+
+import pathmagic
+
+with pathmagic.context():
+    from func.logme import log
+
+from .cloudcfg import export_config, install_config
+
+__all__ = [
+    "run_pipeline", "thread_local_factory",
+    "init_parse_worker", "parse_worker_args", "parse_month_messages",
+]
+
+
+# ── 解析 worker ──
+
+_classifier = None
+
+
+def init_parse_worker(category_map: dict, config: dict = None):
+    """进程池 initializer：安装父进程的云端配置快照与商户分类表。"""
+    global _classifier
+    if config is not None:
+        install_config(config)
+    from life.wechat_finance import MerchantClassifier
+    _classifier = MerchantClassifier(category_map)
+
+
+def parse_month_messages(payload: tuple, workers: int = 1) -> tuple:
+    """(微信消息, 原始短信) → (微信财务记录, 短信财务记录)，未分类记录按商户分类。
+
+    workers 透传给单月内部的分批解析；流水线模式下月份之间已并行，保持 1。
+    """
+    from life.sms_finance import parse_sms_records
+    from life.wechat_finance import MerchantClassifier, load_category_map, parse_finance_messages
+
+    global _classifier
+    if _classifier is None:
+        _classifier = MerchantClassifier(load_category_map())
+
+    wx_msgs, sms_list = payload
+    wx_records = parse_finance_messages(wx_msgs, workers=workers) if wx_msgs else []
+    sms_records = parse_sms_records(sms_list, workers=workers) if sms_list else []
+    for r in wx_records:
+        if r["category"] == "未分类-其他":
+            r["category"] = _classifier.classify(r["merchant"])
+    for r in sms_records:
+        if r.get("category", "") == "未分类-其他":
+            r["category"] = _classifier.classify(r["merchant"])
+    return wx_records, sms_records
+
+
+# ── 流水线 ──
+
+
+def _make_parse_pool(workers: int, initializer, initargs: tuple):
+    if workers <= 1:
+        return None
+    try:
+        return ProcessPoolExecutor(max_workers=workers, initializer=initializer, initargs=initargs)
+    except (ImportError, OSError, NotImplementedError) as e:
+        log.warning(f"无法创建进程池，解析退化为在预取线程中执行。{e}")
+        return None
+
+
+def run_pipeline(months: list, fetch, parse, write, prefetch: int = 3, workers: int = 2,
+                 initializer=None, initargs: tuple = ()) -> list:
+    """按 months 顺序调用 write(month, parse(fetch(month)))，拉取与解析提前并发进行。
+
+    prefetch 限定领先写入的月份数（同时也是预取线程数），控制内存占用；
+    prefetch <= 0 时在调用线程里逐月串行执行，与旧的顺序导入等价。
+    任一阶段抛出的异常在写入该月时原样抛出，未开始的月份随之取消。
+    返回各月 write() 的返回值列表。
+    """
+    months = list(months)
+    if not months:
+        return []
+    if prefetch <= 0:
+        if initializer is not None:
+            initializer(*initargs)
+        return [write(month, parse(fetch(month))) for month in months]
+
+    parse_pool = _make_parse_pool(workers, initializer, initargs)
+    if parse_pool is None and initializer is not None:
+        initializer(*initargs)
+
+    def stage(month):
+        raw = fetch(month)
+        if parse_pool is None:
+            return parse(raw)
+        return parse_pool.submit(parse, raw)
+
+    results = []
+    fetch_pool = ThreadPoolExecutor(max_workers=prefetch, thread_name_prefix="prefetch")
+    try:
+        pending = {}
+        for i, month in enumerate(months[:prefetch]):
+            pending[i] = fetch_pool.submit(stage, month)
+        for i, month in enumerate(months):
+            parsed = pending.pop(i).result()
+            if isinstance(parsed, Future):
+                parsed = parsed.result()
+            if i + prefetch < len(months):
+                pending[i + prefetch] = fetch_pool.submit(stage, months[i + prefetch])
+            results.append(write(month, parsed))
+    finally:
+        for fut in pending.values():
+            fut.cancel()
+        fetch_pool.shutdown(wait=True)
+        if parse_pool is not None:
+            parse_pool.shutdown(wait=True, cancel_futures=True)
+    return results
+
+
+def thread_local_factory(factory):
+    """每个线程各自构造一次对象（如 WeChatClient 持有的 SQLite 连接不能跨线程）。"""
+    local = threading.local()
+
+    def get():
+        obj = getattr(local, "obj", None)
+        if obj is None:
+            obj = local.obj = factory()
+        return obj
+    return get
+
+
+def parse_worker_args(category_map: dict) -> tuple:
+    """init_parse_worker 的 initargs：分类表 + 父进程已加载的云端配置。"""
+    return category_map, export_config()
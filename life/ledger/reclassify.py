@@ -8,7 +8,8 @@ sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspa
 import pathmagic
 with pathmagic.context():
     from life.ledger.db import Database
-    from life.wechat_finance import classify_merchant, load_category_map
+    from life.ledger.rollups import FlowRollups
+    from life.wechat_finance import MerchantClassifier, load_category_map
 
 def ensure_category(db, name, direction="expense", is_loan=0):
     row = db.fetchone("SELECT id FROM categories WHERE name=?", (name,))
@@ -21,6 +22,7 @@ def ensure_category(db, name, direction="expense", is_loan=0):
 def main():
     db = Database()
     cat_map = load_category_map()
+    classifier = MerchantClassifier(cat_map)
 
     # 确保所有 map 中引用的分类在 DB 中存在
     for cat_name in set(cat_map.values()):
@@ -46,18 +48,22 @@ def main():
     )
     print(f"待重新分类: {len(rows)} 条")
 
-    updated = 0
+    updates = []
     for r in rows:
-        new_cat_name = classify_merchant(r["merchant"], cat_map)
+        new_cat_name = classifier.classify(r["merchant"])
         if new_cat_name and new_cat_name != "未分类-其他":
             new_cat_id = cat_name_to_id.get(new_cat_name)
             if new_cat_id:
-                db.execute("UPDATE account_flows SET category_id=? WHERE id=?", (new_cat_id, r["id"]))
-                updated += 1
+                updates.append((new_cat_id, r["id"]))
 
-    # 提交事务
-    db.conn.commit()
-    print(f"已更新: {updated} 条")
+    # 一个事务内改分类，月度汇总先扣除旧分类、改完再计入新分类
+    rollups = FlowRollups(db)
+    ids = [flow_id for _, flow_id in updates]
+    with db.transaction():
+        rollups.remove(ids)
+        db.executemany("UPDATE account_flows SET category_id=? WHERE id=?", updates)
+        rollups.add(ids)
+    print(f"已更新: {len(updates)} 条")
 
     # 验证
     r = db.fetchone("SELECT COUNT(*) as cnt FROM account_flows f JOIN categories c ON f.category_id=c.id WHERE c.name='未分类-其他'")
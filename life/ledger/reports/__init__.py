@@ -2,3 +2,4 @@ from .net_worth import generate_net_worth_report
 from .cash_flow import generate_cash_flow_report
 from .monthly import generate_monthly_report
 from .balances import generate_balance_report
+from .query import ReportQuery
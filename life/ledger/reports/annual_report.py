@@ -3,7 +3,6 @@
 """
 
 import sys, os
-from collections import defaultdict
 from datetime import datetime
 
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
@@ -11,31 +10,29 @@ sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspa
 import pathmagic
 with pathmagic.context():
     from life.ledger.db import Database
-    from life.ledger.accounts import AccountManager
-    from life.ledger.transactions import TransactionManager
+    from life.ledger.reports.query import ReportQuery
 
 
-def generate_annual_report():
-    db = Database()
-    acct_mgr = AccountManager(db)
-    tx_mgr = TransactionManager(db, acct_mgr)
-
-    flows = tx_mgr.get_flows(limit=10000)
-    active = [f for f in flows if f["tx_type"] not in ("loan_disbursement", "loan_repayment")]
-    loans = [f for f in flows if f["tx_type"] in ("loan_disbursement", "loan_repayment")]
+def generate_annual_report(db: Database = None, start: str = "2025-07", end: str = "2026-06"):
+    """报告周期 [start, end]（YYYY-MM），全部汇总在 SQLite 中分组完成。"""
+    q = ReportQuery(db or Database())
+    sy, sm = map(int, start.split("-"))
+    ey, em = map(int, end.split("-"))
+    ym_from, ym_to = q.month_ym(sy, sm), q.month_ym(ey, em)
+    summary = q.summary(ym_from, ym_to)
 
     lines = []
     lines.append("# 个人财务年度报告")
     lines.append("")
-    lines.append(f"**报告周期**：2025年7月 — 2026年6月")
+    lines.append(f"**报告周期**：{sy}年{sm}月 — {ey}年{em}月")
     lines.append(f"**生成时间**：{datetime.now().strftime('%Y-%m-%d %H:%M')}")
     lines.append("")
     lines.append("---")
     lines.append("")
 
     # ── 年度总览 ──
-    total_inc = sum(f["amount"] for f in active if f["direction"] == "inflow")
-    total_exp = sum(f["amount"] for f in active if f["direction"] == "outflow")
+    total_inc = summary["income"]
+    total_exp = summary["expense"]
     net_total = total_inc - total_exp
 
     lines.append("## 一、年度总览")
@@ -45,10 +42,10 @@ def generate_annual_report():
     lines.append(f"| 总收入 | ¥{total_inc:,.2f} |")
     lines.append(f"| 总支出 | ¥{total_exp:,.2f} |")
     lines.append(f"| 净结余 | ¥{net_total:,.2f} |")
-    lines.append(f"| 总交易笔数 | {len(active)} 笔 |")
-    if loans:
-        loan_in = sum(f["amount"] for f in loans if f["direction"] == "outflow")  # 放款
-        loan_out = sum(f["amount"] for f in loans if f["direction"] == "inflow")  # 还款
+    lines.append(f"| 总交易笔数 | {summary['count']} 笔 |")
+    if summary["loan_count"]:
+        loan_in = summary["loan_outflow"]  # 放款
+        loan_out = summary["loan_inflow"]  # 还款
         lines.append(f"| 贷款放款 | ¥{loan_in:,.2f} |")
         lines.append(f"| 贷款还款 | ¥{loan_out:,.2f} |")
     lines.append("")
@@ -56,50 +53,37 @@ def generate_annual_report():
     # ── 月度走势 ──
     lines.append("## 二、月度收支走势")
     lines.append("")
-    monthly = defaultdict(lambda: {"inc": 0.0, "exp": 0.0, "cnt": 0})
-    for f in active:
-        mon = f["tx_date"][:7]
-        if f["direction"] == "inflow":
-            monthly[mon]["inc"] += f["amount"]
-        else:
-            monthly[mon]["exp"] += f["amount"]
-        monthly[mon]["cnt"] += 1
+    monthly = q.pivot("ym", ym_from, ym_to, loans=False)
 
     lines.append("| 月份 | 收入 | 支出 | 净额 | 笔数 |")
     lines.append("|------|------|------|------|------|")
     for mon in sorted(monthly):
         d = monthly[mon]
-        net = d["inc"] - d["exp"]
-        lines.append(f"| {mon} | ¥{d['inc']:,.2f} | ¥{d['exp']:,.2f} | ¥{net:,.2f} | {d['cnt']} |")
+        net = d["inflow"] - d["outflow"]
+        lines.append(f"| {mon // 100}-{mon % 100:02d} | ¥{d['inflow']:,.2f} | ¥{d['outflow']:,.2f} | ¥{net:,.2f} | {d['cnt']} |")
     lines.append("")
 
     # ── 支出分类年度统计 ──
     lines.append("## 三、年度支出分类")
     lines.append("")
-    cat_exp = defaultdict(float)
-    cat_inc = defaultdict(float)
-    for f in active:
-        cat = f.get("category_name") or "未分类"
-        if f["direction"] == "inflow":
-            cat_inc[cat] += f["amount"]
-        else:
-            cat_exp[cat] += f["amount"]
+    cat_exp = q.aggregate(("category",), ym_from, ym_to, loans=False, direction="outflow", ranked=True)
+    cat_inc = q.aggregate(("category",), ym_from, ym_to, loans=False, direction="inflow", top=10)
 
     lines.append("### 支出 Top 15")
     lines.append("")
     lines.append("| 分类 | 金额 | 占比 |")
     lines.append("|------|------|------|")
-    for cat, amt in sorted(cat_exp.items(), key=lambda x: -x[1])[:15]:
-        pct = amt / total_exp * 100
-        lines.append(f"| {cat} | ¥{amt:,.2f} | {pct:.1f}% |")
+    for r in cat_exp[:15]:
+        pct = r["total"] / total_exp * 100
+        lines.append(f"| {r['category']} | ¥{r['total']:,.2f} | {pct:.1f}% |")
     lines.append("")
 
     lines.append("### 收入 Top 10")
     lines.append("")
     lines.append("| 分类 | 金额 |")
     lines.append("|------|------|")
-    for cat, amt in sorted(cat_inc.items(), key=lambda x: -x[1])[:10]:
-        lines.append(f"| {cat} | ¥{amt:,.2f} |")
+    for r in cat_inc:
+        lines.append(f"| {r['category']} | ¥{r['total']:,.2f} |")
     lines.append("")
 
     # ── 下钻：分类详情（排除内部-转账） ──
@@ -107,60 +91,40 @@ def generate_annual_report():
     lines.append("")
     exclude_cats = ("内部-转账", "未分类-其他", "金融-其他", "金融-贷款", "金融-手续费")
     # 取余额最大的几个消费类
-    consumer_cats = [(c, a) for c, a in cat_exp.items() if c not in exclude_cats]
-    for cat_name, _ in sorted(consumer_cats, key=lambda x: -x[1])[:6]:
-        cat_flows = [f for f in active if f["direction"] == "outflow" and f.get("category_name") == cat_name]
-        cat_total = sum(f["amount"] for f in cat_flows)
-        lines.append(f"### {cat_name} —— ¥{cat_total:,.2f}")
+    consumer_cats = [r for r in cat_exp if r["category"] not in exclude_cats]
+    for r in consumer_cats[:6]:
+        lines.append(f"### {r['category']} —— ¥{r['total']:,.2f}")
         lines.append("")
         # Top 商户
-        merchants = defaultdict(float)
-        for f in cat_flows:
-            m = f.get("merchant") or "(未知)"
-            merchants[m] += f["amount"]
-        sorted_m = sorted(merchants.items(), key=lambda x: -x[1])[:5]
-        for m, a in sorted_m:
-            lines.append(f"- {m}: ¥{a:,.2f}")
+        merchants = q.aggregate(("merchant",), ym_from, ym_to, loans=False, direction="outflow",
+                                category=r["category"], top=5)
+        for m in merchants:
+            lines.append(f"- {m['merchant']}: ¥{m['total']:,.2f}")
         lines.append("")
 
     # ── 账户分析 ──
     lines.append("## 五、账户分析")
     lines.append("")
-    acct_inc = defaultdict(float)
-    acct_exp = defaultdict(float)
-    for f in active:
-        name = f.get("account_name") or "?"
-        if f["direction"] == "inflow":
-            acct_inc[name] += f["amount"]
-        else:
-            acct_exp[name] += f["amount"]
+    by_acct = q.pivot("account", ym_from, ym_to, loans=False)
 
-    all_accts = sorted(set(list(acct_inc.keys()) + list(acct_exp.keys())))
     lines.append("| 账户 | 收入 | 支出 | 净额 | 笔数 |")
     lines.append("|------|------|------|------|------|")
-    for name in all_accts:
-        inc = acct_inc.get(name, 0)
-        exp = acct_exp.get(name, 0)
-        cnt = sum(1 for f in active if f.get("account_name") == name)
-        lines.append(f"| {name} | ¥{inc:,.2f} | ¥{exp:,.2f} | ¥{inc-exp:,.2f} | {cnt} |")
+    for name, d in sorted(by_acct.items()):
+        inc, exp = d["inflow"], d["outflow"]
+        lines.append(f"| {name} | ¥{inc:,.2f} | ¥{exp:,.2f} | ¥{inc-exp:,.2f} | {d['cnt']} |")
     lines.append("")
 
     # ── 贷款活动 ──
-    if loans:
+    if summary["loan_count"]:
         lines.append("## 六、贷款活动")
         lines.append("")
-        loan_totals = defaultdict(lambda: {"in": 0.0, "out": 0.0})
-        for f in loans:
-            name = f.get("account_name") or "?"
-            if f["direction"] == "inflow":
-                loan_totals[name]["in"] += f["amount"]  # 还款(负债减少)
-            else:
-                loan_totals[name]["out"] += f["amount"]  # 放款(负债增加)
+        # inflow = 还款(负债减少)，outflow = 放款(负债增加)
+        loan_totals = q.pivot("account", ym_from, ym_to, loans=True)
         lines.append("| 平台 | 放款(负债增加) | 还款(负债减少) | 净变化 |")
         lines.append("|------|------|------|------|")
         for name, d in sorted(loan_totals.items()):
-            net_change = d["out"] - d["in"]  # 正值 = 总负债增加
-            lines.append(f"| {name} | ¥{d['out']:,.2f} | ¥{d['in']:,.2f} | ¥{net_change:,.2f} |")
+            net_change = d["outflow"] - d["inflow"]  # 正值 = 总负债增加
+            lines.append(f"| {name} | ¥{d['outflow']:,.2f} | ¥{d['inflow']:,.2f} | ¥{net_change:,.2f} |")
         lines.append("")
 
     # ── 合规说明 ──
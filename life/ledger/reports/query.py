@@ -0,0 +1,151 @@
+# 报表查询层：在 SQLite 里 GROUP BY 聚合，Python 只拿分组结果
+# 不涉及商户的聚合读月度汇总表 flow_rollups，只有商户维度才回到 account_flows
+
+from typing import Optional
+
+from ..db import Database
+
+__all__ = ["ReportQuery", "LOAN_TX_TYPES"]
+
+LOAN_TX_TYPES = ("loan_disbursement", "loan_repayment")
+
+# 维度名 → SQL 表达式；账户/分类缺失时与旧报表的显示保持一致
+_DIMENSIONS = {
+    "ym": "af.ym",
+    "direction": "af.direction",
+    "tx_type": "af.tx_type",
+    "account_id": "af.account_id",
+    "account": "COALESCE(a.name, '?')",
+    "account_type": "a.type",
+    "category_id": "NULLIF(af.category_id, 0)",
+    "category": "COALESCE(c.name, '未分类')",
+    "merchant": "COALESCE(NULLIF(af.merchant, ''), '(未知)')",
+}
+
+_JOINS = (" LEFT JOIN accounts a ON af.account_id = a.id"
+          " LEFT JOIN categories c ON af.category_id = c.id")
+_FROM = " FROM account_flows af" + _JOINS
+
+# flow_rollups 覆盖的维度（汇总键及其关联的账户/分类属性）
+_ROLLUP_DIMENSIONS = {"ym", "direction", "tx_type", "account_id", "account", "account_type",
+                      "category_id", "category"}
+_ROLLUP_SOURCE = (" FROM flow_rollups af" + _JOINS, "SUM(af.total)", "SUM(af.cnt)")
+_FLOW_SOURCE = (_FROM, "SUM(af.amount)", "COUNT(*)")
+
+
+class ReportQuery:
+    """报表聚合查询。结果集大小只取决于分组数，与流水条数无关。
+
+    年月一律用 ym 整数（如 202403）表示闭区间 [ym_from, ym_to]。
+    use_rollups=False 时全部直接聚合 account_flows（用于与汇总表对照）。
+    """
+
+    def __init__(self, db: Database, use_rollups: bool = True):
+        self.db = db
+        self.use_rollups = use_rollups
+
+    def _source(self, by: tuple = (), has_merchant: bool = False) -> tuple:
+        """(FROM 子句, 金额合计表达式, 笔数表达式)：能由汇总表回答时读 flow_rollups。"""
+        if self.use_rollups and not has_merchant and set(by) <= _ROLLUP_DIMENSIONS:
+            return _ROLLUP_SOURCE
+        return _FLOW_SOURCE
+
+    @staticmethod
+    def month_ym(year: int, month: int) -> int:
+        return year * 100 + month
+
+    @staticmethod
+    def _where(ym_from: int = None, ym_to: int = None, loans: Optional[bool] = None,
+               direction: str = None, category: str = None, has_merchant: bool = False) -> tuple:
+        """WHERE 子句与参数。loans=True 只取贷款流水，False 排除贷款流水，None 不过滤。"""
+        clauses, params = [], []
+        if ym_from is not None:
+            clauses.append("af.ym >= ?")
+            params.append(ym_from)
+        if ym_to is not None:
+            clauses.append("af.ym <= ?")
+            params.append(ym_to)
+        if loans is not None:
+            marks = ",".join("?" * len(LOAN_TX_TYPES))
+            clauses.append(f"af.tx_type {'IN' if loans else 'NOT IN'} ({marks})")
+            params.extend(LOAN_TX_TYPES)
+        if direction:
+            clauses.append("af.direction = ?")
+            params.append(direction)
+        if category:
+            clauses.append(f"{_DIMENSIONS['category']} = ?")
+            params.append(category)
+        if has_merchant:
+            clauses.append("af.merchant IS NOT NULL AND af.merchant != ''")
+        return (" WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+    def aggregate(self, by: tuple, ym_from: int = None, ym_to: int = None,
+                  loans: Optional[bool] = None, direction: str = None, category: str = None,
+                  has_merchant: bool = False, ranked: bool = False, top: int = None) -> list:
+        """按维度分组求和。
+
+        by 取 _DIMENSIONS 中的维度名，返回 [{维度…, "total": 金额合计, "cnt": 笔数}]；
+        ranked 时按金额降序排列，top 给定时只取前 top 组（隐含 ranked），否则按维度排序。
+        """
+        unknown = [d for d in by if d not in _DIMENSIONS]
+        if unknown:
+            raise ValueError(f"未知的报表维度: {unknown}")
+        source, total_expr, cnt_expr = self._source(by, has_merchant)
+        select = [f"{_DIMENSIONS[d]} AS {d}" for d in by]
+        where, params = self._where(ym_from, ym_to, loans, direction, category, has_merchant)
+        sql = f"SELECT {', '.join(select + [f'{total_expr} AS total', f'{cnt_expr} AS cnt'])}{source}{where}"
+        # 分组/排序用列序号：别名可能与 categories 等表的同名列冲突
+        positions = [str(i) for i in range(1, len(by) + 1)]
+        if by:
+            sql += f" GROUP BY {', '.join(positions)}"
+        if ranked or top is not None:
+            sql += f" ORDER BY total DESC{''.join(f', {i}' for i in positions)}"
+            if top is not None:
+                sql += " LIMIT ?"
+                params.append(top)
+        elif by:
+            sql += f" ORDER BY {', '.join(positions)}"
+        rows = self.db.fetchall(sql, params)
+        for r in rows:
+            r["total"] = r["total"] or 0.0
+        return rows
+
+    def pivot(self, key: str, ym_from: int = None, ym_to: int = None, loans: Optional[bool] = None) -> dict:
+        """按 key 维度拆分流入/流出：{key值: {"inflow": 合计, "outflow": 合计, "cnt": 笔数}}。"""
+        result = {}
+        for r in self.aggregate((key, "direction"), ym_from, ym_to, loans=loans):
+            d = result.setdefault(r[key], {"inflow": 0.0, "outflow": 0.0, "cnt": 0})
+            d[r["direction"]] += r["total"]
+            d["cnt"] += r["cnt"]
+        return result
+
+    def summary(self, ym_from: int = None, ym_to: int = None) -> dict:
+        """收支概要：常规收入/支出/笔数，贷款流入/流出/笔数。"""
+        s = {"income": 0.0, "expense": 0.0, "count": 0, "loan_inflow": 0.0, "loan_outflow": 0.0, "loan_count": 0}
+        source, total_expr, cnt_expr = self._source()
+        where, params = self._where(ym_from, ym_to)
+        marks = ",".join("?" * len(LOAN_TX_TYPES))
+        rows = self.db.fetchall(
+            f"SELECT af.tx_type IN ({marks}) AS is_loan, af.direction, {total_expr} AS total, {cnt_expr} AS cnt"
+            f"{source}{where} GROUP BY 1, 2",
+            list(LOAN_TX_TYPES) + params,
+        )
+        for r in rows:
+            total = r["total"] or 0.0
+            if r["is_loan"]:
+                s["loan_inflow" if r["direction"] == "inflow" else "loan_outflow"] += total
+                s["loan_count"] += r["cnt"]
+            else:
+                s["income" if r["direction"] == "inflow" else "expense"] += total
+                s["count"] += r["cnt"]
+        return s
+
+    def largest(self, ym_from: int = None, ym_to: int = None, direction: str = "outflow",
+                loans: Optional[bool] = False) -> Optional[dict]:
+        """金额最大的一笔流水（同额取日期最新、id 最大的一笔）。"""
+        where, params = self._where(ym_from, ym_to, loans, direction)
+        return self.db.fetchone(
+            f"SELECT af.id, af.tx_date, af.amount, af.merchant, {_DIMENSIONS['account']} AS account"
+            f"{_FROM}{where} ORDER BY af.amount DESC, af.tx_date DESC, af.id DESC LIMIT 1",
+            params,
+        )
@@ -0,0 +1,92 @@
+# 个人财务系统 — 月度汇总表维护
+
+"""flow_rollups：(ym, account_id, category_id, direction, tx_type) → total / cnt。
+
+流水的每次写入、删除、改分类都按流水 id 在 SQLite 内算出分组增量并 upsert 到汇总表，
+调用方须在修改 account_flows 的同一事务里调用：
+
+    - 插入之后 add(ids)
+    - 删除之前 remove(ids)
+    - 改分类/金额/账户等汇总键：修改前 remove(ids)，修改后 add(ids)
+    - 清空 account_flows 时 clear()
+
+verify() 以 account_flows 现算结果比对汇总表，rebuild() 全量重建。
+"""
+
+from .db import Database
+from .schema import ROLLUP_REBUILD_SQL
+
+__all__ = ["FlowRollups"]
+
+_KEY_COLS = ("ym", "account_id", "category_id", "direction", "tx_type")
+_CHUNK = 500  # 单条 SQL 的 id 参数个数，低于 SQLite 变量上限
+_TOLERANCE = 0.005  # 增量加减的浮点误差容忍（金额精确到分）
+
+
+class FlowRollups:
+    """月度汇总表的增量维护与校验。"""
+
+    def __init__(self, db: Database):
+        self.db = db
+
+    def add(self, flow_ids: list):
+        """把这些流水计入汇总（插入之后调用）。"""
+        self._apply(flow_ids, 1)
+
+    def remove(self, flow_ids: list):
+        """把这些流水从汇总中扣除（删除或修改之前调用）。"""
+        self._apply(flow_ids, -1)
+
+    def _apply(self, flow_ids: list, sign: int):
+        ids = list(flow_ids)
+        if not ids:
+            return
+        with self.db.transaction():
+            for i in range(0, len(ids), _CHUNK):
+                chunk = ids[i:i + _CHUNK]
+                marks = ",".join("?" * len(chunk))
+                self.db.execute(
+                    f"""INSERT INTO flow_rollups ({', '.join(_KEY_COLS)}, total, cnt)
+                        SELECT ym, account_id, COALESCE(category_id, 0), direction, tx_type,
+                               ? * SUM(amount), ? * COUNT(*)
+                        FROM account_flows WHERE id IN ({marks}) GROUP BY 1, 2, 3, 4, 5
+                        ON CONFLICT({', '.join(_KEY_COLS)}) DO UPDATE SET
+                        total = total + excluded.total, cnt = cnt + excluded.cnt""",
+                    [sign, sign, *chunk],
+                )
+            if sign < 0:
+                self.db.execute("DELETE FROM flow_rollups WHERE cnt <= 0")
+
+    def clear(self):
+        self.db.execute("DELETE FROM flow_rollups")
+
+    def rebuild(self) -> int:
+        """由 account_flows 全量重建，返回汇总行数。"""
+        with self.db.transaction():
+            for stmt in filter(str.strip, ROLLUP_REBUILD_SQL.split(";")):
+                self.db.execute(stmt)
+        return self.db.fetchone("SELECT COUNT(*) AS n FROM flow_rollups")["n"]
+
+    def verify(self) -> list:
+        """比对汇总表与 account_flows 现算结果，返回不一致的分组列表（一致时为空）。
+
+        每项为 {键…, "expected_total", "expected_cnt", "total", "cnt"}，缺失一侧记为 0。
+        """
+        expected = {
+            tuple(r[c] for c in _KEY_COLS): r for r in self.db.fetchall(
+                """SELECT ym, account_id, COALESCE(category_id, 0) AS category_id, direction, tx_type,
+                          SUM(amount) AS total, COUNT(*) AS cnt
+                   FROM account_flows GROUP BY 1, 2, 3, 4, 5"""
+            )
+        }
+        actual = {tuple(r[c] for c in _KEY_COLS): r for r in self.db.fetchall("SELECT * FROM flow_rollups")}
+
+        mismatches = []
+        for key in sorted(set(expected) | set(actual)):
+            e, a = expected.get(key), actual.get(key)
+            e_total, e_cnt = (e["total"], e["cnt"]) if e else (0.0, 0)
+            a_total, a_cnt = (a["total"], a["cnt"]) if a else (0.0, 0)
+            if e_cnt != a_cnt or abs(e_total - a_total) > _TOLERANCE:
+                mismatches.append({**dict(zip(_KEY_COLS, key)), "expected_total": e_total,
+                                   "expected_cnt": e_cnt, "total": a_total, "cnt": a_cnt})
+        return mismatches
@@ -1,6 +1,14 @@
 # 个人财务系统 — 数据库 Schema
 
-SCHEMA_SQL = """
+# account_flows 的派生键：ym = 年*100+月（如 202403），tx_epoch = 交易时刻的秒数（按本地时间折算）
+# 均为 VIRTUAL 生成列，随 tx_date/tx_time 自动维护，老库由 init_db 迁移补列
+FLOW_YM_EXPR = "CAST(substr(tx_date, 1, 4) AS INTEGER) * 100 + CAST(substr(tx_date, 6, 2) AS INTEGER)"
+FLOW_EPOCH_EXPR = (
+    "CAST(strftime('%s', CASE WHEN length(tx_time) >= 19 THEN substr(tx_time, 1, 19)"
+    " ELSE tx_date END) AS INTEGER)"
+)
+
+SCHEMA_SQL = f"""
 
 -- 账户表
 CREATE TABLE IF NOT EXISTS accounts (
@@ -68,7 +76,9 @@ CREATE TABLE IF NOT EXISTS account_flows (
     is_reconciled   INTEGER DEFAULT 0,
     notes           TEXT,
     created_at      TEXT    DEFAULT (datetime('now','localtime')),
-    updated_at      TEXT    DEFAULT (datetime('now','localtime'))
+    updated_at      TEXT    DEFAULT (datetime('now','localtime')),
+    ym              INTEGER GENERATED ALWAYS AS ({FLOW_YM_EXPR}) VIRTUAL,
+    tx_epoch        INTEGER GENERATED ALWAYS AS ({FLOW_EPOCH_EXPR}) VIRTUAL
 );
 
 CREATE INDEX IF NOT EXISTS idx_flows_date       ON account_flows(tx_date);
@@ -112,6 +122,31 @@ CREATE TABLE IF NOT EXISTS merchant_category_map (
     created_at  TEXT    DEFAULT (datetime('now','localtime'))
 );
 
+-- 导入日志：每个 (来源, 月份) 最近一次导入的输入摘要，摘要不变则跳过该月
+CREATE TABLE IF NOT EXISTS import_journal (
+    source          TEXT    NOT NULL CHECK(source IN ('merged','wechat','sms')),
+    month           TEXT    NOT NULL,
+    digest          TEXT    NOT NULL,
+    input_count     INTEGER DEFAULT 0,
+    flow_count      INTEGER DEFAULT 0,
+    imported_at     TEXT    DEFAULT (datetime('now','localtime')),
+    PRIMARY KEY (source, month)
+);
+
+-- 月度汇总：(年月, 账户, 分类, 方向, 交易类型) → 金额合计/笔数
+-- 随流水写入、替换、重分类增量维护（见 rollups.py），报表与余额计算读它而不扫 account_flows
+-- category_id 为 0 表示未分类（主键列不用 NULL）
+CREATE TABLE IF NOT EXISTS flow_rollups (
+    ym              INTEGER NOT NULL,
+    account_id      INTEGER NOT NULL,
+    category_id     INTEGER NOT NULL DEFAULT 0,
+    direction       TEXT    NOT NULL,
+    tx_type         TEXT    NOT NULL,
+    total           REAL    NOT NULL DEFAULT 0,
+    cnt             INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (ym, account_id, category_id, direction, tx_type)
+) WITHOUT ROWID;
+
 -- 调整日志
 CREATE TABLE IF NOT EXISTS adjustment_log (
     id              INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -125,6 +160,22 @@ CREATE TABLE IF NOT EXISTS adjustment_log (
 
 """
 
+# 按月聚合的覆盖索引：单账户按 (账户, 月, 方向) 汇总金额、报表按 (分类, 月) 汇总，
+# 全账户按月区间汇总走 idx_flows_ym_acct，均不回表
+FLOW_KEY_INDEX_SQL = """
+CREATE INDEX IF NOT EXISTS idx_flows_acct_ym  ON account_flows(account_id, ym, direction, amount);
+CREATE INDEX IF NOT EXISTS idx_flows_cat_ym   ON account_flows(category_id, ym);
+CREATE INDEX IF NOT EXISTS idx_flows_ym_acct  ON account_flows(ym, account_id, direction, amount);
+"""
+
+# 由 account_flows 全量重建 flow_rollups（迁移与 rollup rebuild 共用）
+ROLLUP_REBUILD_SQL = """
+DELETE FROM flow_rollups;
+INSERT INTO flow_rollups (ym, account_id, category_id, direction, tx_type, total, cnt)
+    SELECT ym, account_id, COALESCE(category_id, 0), direction, tx_type, SUM(amount), COUNT(*)
+    FROM account_flows GROUP BY 1, 2, 3, 4, 5;
+"""
+
 SEED_CATEGORIES = [
     # 支出分类
     ("餐饮-外卖", "expense"), ("餐饮-正餐", "expense"), ("餐饮-饮品", "expense"),
@@ -161,9 +212,33 @@ SEED_LOAN_ACCOUNTS = [
 ]
 
 
+def _migrate_flow_keys(conn):
+    """老库 account_flows 补 ym/tx_epoch 生成列并建覆盖索引。
+
+    VIRTUAL 生成列由 SQLite 按表达式即时计算，补列即完成回填；索引建立时一次性物化。
+    """
+    cols = {r[1] for r in conn.execute("PRAGMA table_xinfo(account_flows)").fetchall()}
+    if "ym" not in cols:
+        conn.execute(f"ALTER TABLE account_flows ADD COLUMN ym INTEGER GENERATED ALWAYS AS ({FLOW_YM_EXPR}) VIRTUAL")
+    if "tx_epoch" not in cols:
+        conn.execute(
+            f"ALTER TABLE account_flows ADD COLUMN tx_epoch INTEGER GENERATED ALWAYS AS ({FLOW_EPOCH_EXPR}) VIRTUAL"
+        )
+    conn.executescript(FLOW_KEY_INDEX_SQL)
+
+
+def _migrate_rollups(conn):
+    """老库首次建出 flow_rollups 时为空，由已有流水一次性回填。"""
+    empty = conn.execute("SELECT NOT EXISTS (SELECT 1 FROM flow_rollups)").fetchone()[0]
+    if empty and conn.execute("SELECT EXISTS (SELECT 1 FROM account_flows)").fetchone()[0]:
+        conn.executescript(ROLLUP_REBUILD_SQL)
+
+
 def init_db(conn):
-    """初始化数据库：建表 + 种子数据。"""
+    """初始化数据库：建表 + 迁移 + 种子数据。"""
     conn.executescript(SCHEMA_SQL)
+    _migrate_flow_keys(conn)
+    _migrate_rollups(conn)
 
     # 种子分类
     existing = {r["name"] for r in conn.execute("SELECT name FROM categories").fetchall()}
@@ -1,8 +1,10 @@
 # 个人财务系统 — 交易管理与余额计算
 
+import hashlib
 import json
-from collections import defaultdict
+from collections import Counter, defaultdict
 from datetime import datetime
+from itertools import accumulate
 from typing import Optional
 
 import pathmagic
@@ -13,9 +15,19 @@ from .db import Database
 from .accounts import AccountManager
 from .importers.router import FlowRouter
 from .models import Account, AccountFlow, AccountBalance
+from .rollups import FlowRollups
 
 __all__ = ["TransactionManager"]
 
+# 导入日志来源 → 该来源导入产生的流水 source
+_JOURNAL_SOURCES = {"merged": ("wechat", "sms"), "wechat": ("wechat",), "sms": ("sms",)}
+
+# 比较新旧流水是否为同一笔的字段：均由源数据和路由决定
+_FLOW_SIG_COLS = ("tx_date", "tx_time", "amount", "account_id", "direction", "tx_type", "source",
+                  "merchant", "counterparty", "source_group_id", "raw_data")
+# 其余字段 description/notes/category_id 可手工修改，不参与比对：保留的流水 description/notes 原样不动，
+# category_id 在没有手工调整记录（adjustment_log）时按新路由结果就地更新
+
 
 class TransactionManager:
     """交易导入、余额计算、净资产快照。"""
@@ -24,6 +36,7 @@ class TransactionManager:
         self.db = db
         self.acct_mgr = acct_mgr or AccountManager(db)
         self.router = FlowRouter(db, self.acct_mgr)
+        self.rollups = FlowRollups(db)
 
     # ── 导入 ──
 
@@ -53,35 +66,149 @@ class TransactionManager:
             "accounts_involved": len(set(f.account_id for f in flows)),
         }
 
+    def import_month(self, wechat_events: list, sms_records: list, month_key: str,
+                     source: str = "merged", force: bool = False) -> dict:
+        """按导入日志幂等导入一个月。
+
+        输入摘要与 import_journal 记录相同、且库内该月流水条数与日志一致则直接跳过；否则重新路由，
+        与库内该月同来源的旧流水按 source_group_id 比对：源数据不变的组保留（保留 id 与备注等手工修改，分类未手工调整时按新路由更新），
+        变化或新增的组重写，消失的组删除。
+        返回 {"month", "changed", "inserted", "deleted", "kept", "recategorized", "total_flows", "by_source",
+        "accounts_involved"}；跳过的月份 by_source / accounts_involved 取自库内该月现有流水。
+        changed 为 True 的月份需由调用方从最早的一个起滚动余额（roll_balances_forward）。
+        """
+        sources = _JOURNAL_SOURCES[source]
+        digest = _input_digest(wechat_events, sms_records)
+        ym = int(month_key[:4]) * 100 + int(month_key[5:7])
+        row = self.db.fetchone("SELECT digest, flow_count FROM import_journal WHERE source=? AND month=?",
+                               (source, month_key))
+        unchanged = row is not None and row["digest"] == digest and not force
+        if unchanged:
+            marks = ",".join("?" * len(sources))
+            counts = self.db.fetchall(
+                f"SELECT source, account_id, COUNT(*) AS cnt FROM account_flows"
+                f" WHERE ym=? AND source IN ({marks}) GROUP BY 1, 2",
+                (ym, *sources),
+            )
+            # 摘要相同还要库内流水条数对得上：流水被外部清空/改写过（如只清流水不清日志的重导工具）时照常重导
+            unchanged = sum(r["cnt"] for r in counts) == row["flow_count"]
+        if unchanged:
+            by_source = defaultdict(int)
+            for r in counts:
+                by_source[r["source"]] += r["cnt"]
+            return {"month": month_key, "changed": False, "inserted": 0, "deleted": 0,
+                    "kept": row["flow_count"], "recategorized": 0, "total_flows": row["flow_count"], "by_source": dict(by_source),
+                    "accounts_involved": len({r["account_id"] for r in counts})}
+
+        flows = self.router.route_events(wechat_events, sms_records, replacing=(ym, sources))
+        with self.db.transaction():
+            stats = self._replace_month_flows(flows, ym, sources, month_key)
+            self.db.upsert("import_journal", {
+                "source": source, "month": month_key, "digest": digest,
+                "input_count": len(wechat_events) + len(sms_records),
+                "flow_count": len(flows),
+                "imported_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            }, conflict_cols=["source", "month"])
+
+        by_source = defaultdict(int)
+        for f in flows:
+            by_source[f.source] += 1
+        changed = row is None or bool(stats["inserted"] or stats["deleted"])
+        return {"month": month_key, "changed": changed, **stats,
+                "total_flows": len(flows), "by_source": dict(by_source),
+                "accounts_involved": len(set(f.account_id for f in flows))}
+
+    def _replace_month_flows(self, flows: list, ym: int, sources: tuple, month_key: str) -> dict:
+        """以 source_group_id 为单位，用新路由结果替换库内该月同来源的旧流水。
+
+        重写的组会覆盖其中流水的手工修改；保留的组只就地更新未手工调整过的 category_id。
+        """
+        marks = ",".join("?" * len(sources))
+        rows = self.db.fetchall(
+            f"SELECT id, {', '.join(_FLOW_SIG_COLS)}, category_id FROM account_flows"
+            f" WHERE ym=? AND source IN ({marks}) ORDER BY id",
+            (ym, *sources),
+        )
+        old = defaultdict(list)
+        for r in rows:
+            old[r["source_group_id"]].append(r)
+        new = defaultdict(list)
+        for f in flows:
+            new[f.source_group_id].append(f)
+        adjusted = {r["flow_id"] for r in self.db.fetchall(
+            f"""SELECT DISTINCT flow_id FROM adjustment_log WHERE field='category_id' AND flow_id IN (
+                    SELECT id FROM account_flows WHERE ym=? AND source IN ({marks}))""",
+            (ym, *sources),
+        )}
+
+        kept, delete_ids, insert, recategorize = 0, [], [], []
+        for gid, group in new.items():
+            old_group = old.get(gid, [])
+            if Counter(_flow_sig(self._flow_to_dict(f)) for f in group) != Counter(_flow_sig(r) for r in old_group):
+                delete_ids.extend(r["id"] for r in old_group)
+                insert.extend(group)
+                continue
+            kept += len(group)
+            # 签名一致的组按签名把新流水与旧行一一对应（同签名的按 id 顺序）
+            by_sig = defaultdict(list)
+            for r in old_group:
+                by_sig[_flow_sig(r)].append(r)
+            for f in group:
+                r = by_sig[_flow_sig(self._flow_to_dict(f))].pop(0)
+                cat_id = f.category_id or None
+                if (r["category_id"] or None) != cat_id and r["id"] not in adjusted:
+                    recategorize.append((cat_id, r["id"]))
+        for gid, old_group in old.items():
+            if gid not in new:
+                delete_ids.extend(r["id"] for r in old_group)
+
+        with self.db.transaction():
+            if delete_ids:
+                ids = [(i,) for i in delete_ids]
+                self.db.executemany("UPDATE account_flows SET linked_flow_id=NULL WHERE linked_flow_id=?", ids)
+                self.db.executemany("UPDATE adjustment_log SET flow_id=NULL WHERE flow_id=?", ids)
+                self.rollups.remove(delete_ids)
+                self.db.executemany("DELETE FROM account_flows WHERE id=?", ids)
+            if recategorize:
+                recat_ids = [i for _, i in recategorize]
+                self.rollups.remove(recat_ids)
+                self.db.executemany("UPDATE account_flows SET category_id=? WHERE id=?", recategorize)
+                self.rollups.add(recat_ids)
+            # 同组流水整组插入且保持路由顺序，贷款双条分录仍相邻，linked_flow_id 照常回填
+            self._save_flows(insert, month_key)
+        return {"inserted": len(insert), "deleted": len(delete_ids), "kept": kept,
+                "recategorized": len(recategorize)}
+
     def _save_flows(self, flows: list, month_key: str) -> int:
-        """批量写入 account_flows。"""
+        """批量写入 account_flows：一个事务内 executemany 插入，计入月度汇总，并回填 loan 双条分录的 linked_flow_id。"""
         if not flows:
             return 0
 
-        # 先写所有 flow，记录 id
-        inserted = []
-        for f in flows:
-            data = self._flow_to_dict(f)
-            fid = self.db.insert("account_flows", data)
-            inserted.append(fid)
-
-        # 更新 linked_flow_id：一对一对的 flow，相邻插入的互为 linked
-        i = 0
-        while i < len(flows):
-            if flows[i].tx_type in ("loan_disbursement", "loan_repayment") and i + 1 < len(flows):
-                t1 = flows[i].tx_type
-                t2 = flows[i + 1].tx_type
-                if t1 == t2:
-                    # 两个 flow 是同一笔 loan 交易的双条分录
-                    self.db.update("account_flows",
-                                   {"linked_flow_id": inserted[i + 1]},
-                                   {"id": inserted[i]})
-                    self.db.update("account_flows",
-                                   {"linked_flow_id": inserted[i]},
-                                   {"id": inserted[i + 1]})
-                    i += 2
-                    continue
-            i += 1
+        # 可选字段缺省均为 NULL，补齐成同一组列才能 executemany
+        rows = [self._flow_to_dict(f) for f in flows]
+        cols = list(dict.fromkeys(k for d in rows for k in d))
+        records = [{c: d.get(c) for c in cols} for d in rows]
+
+        with self.db.transaction():
+            inserted = self.db.insert_many("account_flows", records)
+            self.rollups.add(inserted)
+
+            # 更新 linked_flow_id：一对一对的 flow，相邻插入的互为 linked
+            links = []
+            i = 0
+            while i < len(flows):
+                if flows[i].tx_type in ("loan_disbursement", "loan_repayment") and i + 1 < len(flows):
+                    t1 = flows[i].tx_type
+                    t2 = flows[i + 1].tx_type
+                    if t1 == t2:
+                        # 两个 flow 是同一笔 loan 交易的双条分录
+                        links.append((inserted[i + 1], inserted[i]))
+                        links.append((inserted[i], inserted[i + 1]))
+                        i += 2
+                        continue
+                i += 1
+            if links:
+                self.db.executemany("UPDATE account_flows SET linked_flow_id=? WHERE id=?", links)
 
         log.info(f"已写入 {len(flows)} 条流水")
         return len(flows)
@@ -90,69 +217,107 @@ class TransactionManager:
 
     def calculate_monthly_balance(self, account_id: int, year: int, month: int) -> AccountBalance:
         """计算指定账户的月度余额。"""
-        prev = self._get_balance_record(account_id, year, month - 1)
-        opening = prev.closing_balance if prev else 0.0
-
-        flows = self.db.fetchall(
-            """SELECT direction, amount, tx_type FROM account_flows
-               WHERE account_id = ? AND strftime('%Y', tx_date) = ? AND strftime('%m', tx_date) = ?""",
-            (account_id, str(year), f"{month:02d}"),
-        )
-
         acct = self.acct_mgr.get_account(account_id)
         if acct is None:
             return AccountBalance(account_id, year, month, 0, 0, 0, 0, True)
-
-        is_liability = acct.type in ("bank_credit", "loan")
-
-        total_inflow = sum(f["amount"] for f in flows if f["direction"] == "inflow")
-        total_outflow = sum(f["amount"] for f in flows if f["direction"] == "outflow")
-
-        if is_liability:
-            # 负债类：outflow 增加负债，inflow 减少负债
-            closing = opening + total_outflow - total_inflow
-        else:
-            # 资产类：inflow 增加余额
-            closing = opening + total_inflow - total_outflow
-
-        self.db.upsert("account_balances", {
-            "account_id": account_id,
-            "year": year,
-            "month": month,
-            "opening_balance": opening,
-            "closing_balance": closing,
-            "total_inflow": total_inflow,
-            "total_outflow": total_outflow,
-            "is_estimated": 1 if prev is None or prev.is_estimated else 0,
-        }, conflict_cols=["account_id", "year", "month"])
-
-        return AccountBalance(account_id, year, month, opening, closing,
-                              total_inflow, total_outflow,
-                              is_estimated=(prev is None or prev.is_estimated))
+        return self.calculate_balances(year, month, accounts=[acct])[0]
 
     def calculate_all_balances(self, year: int, month: int) -> list:
         """为所有活跃账户计算月度余额。"""
-        accounts = self.acct_mgr.list_accounts()
+        return self.calculate_balances(year, month)
+
+    def calculate_balances(self, start_year: int, start_month: int,
+                           end_year: int = None, end_month: int = None,
+                           accounts: list = None) -> list:
+        """批量计算一段月份内多个账户的月度余额。
+
+        一次按 (账户, 年月, 方向) 分组聚合月度汇总表 flow_rollups（每月每账户只有几行，不扫流水），
+        再以起始月前一个月的余额记录为种子逐月累加滚动，所有 account_balances 行在一个事务里写入。
+        返回 AccountBalance 列表，按账户、月份排列。
+        """
+        if end_year is None:
+            end_year, end_month = start_year, start_month
+        if accounts is None:
+            accounts = self.acct_mgr.list_accounts()
+        months = _month_range(start_year, start_month, end_year, end_month)
+        if not accounts or not months:
+            return []
+
+        rows = self.db.fetchall(
+            """SELECT account_id, ym, direction, SUM(total) AS total
+               FROM flow_rollups WHERE ym BETWEEN ? AND ?
+               GROUP BY account_id, ym, direction""",
+            (start_year * 100 + start_month, end_year * 100 + end_month),
+        )
+        totals = defaultdict(float)
+        for r in rows:
+            totals[(r["account_id"], r["ym"], r["direction"])] = r["total"] or 0.0
+
+        prev_y, prev_m = _shift_month(start_year, start_month, -1)
+        seeds = {
+            r["account_id"]: r for r in self.db.fetchall(
+                "SELECT account_id, closing_balance, is_estimated FROM account_balances WHERE year=? AND month=?",
+                (prev_y, prev_m),
+            )
+        }
+
         results = []
         for acct in accounts:
-            bal = self.calculate_monthly_balance(acct.id, year, month)
-            results.append(bal)
+            is_liability = acct.type in ("bank_credit", "loan")
+            seed = seeds.get(acct.id)
+            opening = seed["closing_balance"] if seed else 0.0
+            is_estimated = seed is None or bool(seed["is_estimated"])
+            inflows = [totals[(acct.id, y * 100 + m, "inflow")] for y, m in months]
+            outflows = [totals[(acct.id, y * 100 + m, "outflow")] for y, m in months]
+            # 负债类：outflow 增加负债，inflow 减少负债；资产类相反
+            deltas = [(o - i) if is_liability else (i - o) for i, o in zip(inflows, outflows)]
+            closings = list(accumulate(deltas, initial=opening))
+            for k, (y, m) in enumerate(months):
+                results.append(AccountBalance(acct.id, y, m, closings[k], closings[k + 1],
+                                              inflows[k], outflows[k], is_estimated=is_estimated))
+
+        with self.db.transaction():
+            self.db.executemany(
+                """INSERT INTO account_balances
+                   (account_id, year, month, opening_balance, closing_balance, total_inflow, total_outflow, is_estimated)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                   ON CONFLICT(account_id, year, month) DO UPDATE SET
+                   opening_balance=excluded.opening_balance, closing_balance=excluded.closing_balance,
+                   total_inflow=excluded.total_inflow, total_outflow=excluded.total_outflow,
+                   is_estimated=excluded.is_estimated""",
+                [(b.account_id, b.year, b.month, b.opening_balance, b.closing_balance,
+                  b.total_inflow, b.total_outflow, 1 if b.is_estimated else 0) for b in results],
+            )
+
         return results
 
+    def roll_balances_forward(self, year: int, month: int) -> list:
+        """从 (year, month) 起重算余额，直到库内流水或余额记录的最后一个月。
+
+        增量导入后只需从最早变化的月份滚动，之前月份的余额记录作为种子保持不变。
+        """
+        row = self.db.fetchone(
+            """SELECT MAX(last) AS last FROM (
+                   SELECT MAX(ym) AS last FROM flow_rollups
+                   UNION ALL SELECT MAX(year * 100 + month) FROM account_balances)"""
+        )
+        last = max((row or {}).get("last") or 0, year * 100 + month)
+        return self.calculate_balances(year, month, last // 100, last % 100)
+
     # ── 净资产快照 ──
 
     def snapshot_net_worth(self, date: str) -> dict:
         """计算指定日期的净资产快照。"""
         year, month = int(date[:4]), int(date[5:7])
         accounts = self.acct_mgr.list_accounts()
+        balances = {b.account_id: b for b in self.calculate_balances(year, month, accounts=accounts)}
 
         details = {}
         total_assets = 0.0
         total_liabilities = 0.0
 
         for acct in accounts:
-            bal = self.calculate_monthly_balance(acct.id, year, month)
-            balance = bal.closing_balance
+            balance = balances[acct.id].closing_balance
             is_liability = acct.type in ("bank_credit", "loan")
 
             if is_liability:
@@ -212,12 +377,15 @@ class TransactionManager:
         if account_id:
             sql += " AND af.account_id=?"
             params.append(account_id)
-        if year:
-            sql += " AND strftime('%Y', af.tx_date)=?"
-            params.append(str(year))
-        if month:
-            sql += " AND strftime('%m', af.tx_date)=?"
-            params.append(f"{month:02d}")
+        if year and month:
+            sql += " AND af.ym=?"
+            params.append(year * 100 + month)
+        elif year:
+            sql += " AND af.ym BETWEEN ? AND ?"
+            params.extend([year * 100 + 1, year * 100 + 12])
+        elif month:
+            sql += " AND af.ym % 100=?"
+            params.append(month)
         if source:
             sql += " AND af.source=?"
             params.append(source)
@@ -288,3 +456,27 @@ class TransactionManager:
         if f.notes:
             d["notes"] = f.notes
         return d
+
+
+def _input_digest(wechat_events: list, sms_records: list) -> str:
+    """导入输入的内容摘要（规范化 JSON 的 sha256）。"""
+    raw = json.dumps([wechat_events, sms_records], ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def _flow_sig(d: dict) -> tuple:
+    """流水比对签名：_flow_to_dict 的结果或库内行，缺省字段按 NULL 处理。"""
+    return tuple(d.get(c) for c in _FLOW_SIG_COLS)
+
+
+def _shift_month(year: int, month: int, delta: int) -> tuple:
+    """年月平移 delta 个月。"""
+    idx = year * 12 + (month - 1) + delta
+    return idx // 12, idx % 12 + 1
+
+
+def _month_range(start_year: int, start_month: int, end_year: int, end_month: int) -> list:
+    """[起始月, 结束月] 闭区间内的 (year, month) 列表。"""
+    start = start_year * 12 + start_month - 1
+    end = end_year * 12 + end_month - 1
+    return [(i // 12, i % 12 + 1) for i in range(start, end + 1)]
@@ -22,8 +22,9 @@
 """
 银行短信专用解析器。
 
-每个银行一个 _parse_xxx() 函数，注册到 _PARSERS 列表。
-dispatch() 遍历 _PARSERS，匹配 number 前缀后调用对应 parser。
+每个银行一个 _parse_xxx() 函数，按号码前缀注册到前缀 trie。
+dispatch() 沿 number 在 trie 中下行（长前缀优先，路由结果按号码缓存），调用命中的 parser；
+各银行的交易模板放在 RuleTable 中预编译，一遍 anchor 扫描后按优先级只试可能命中的模板。
 
 用法：
     from life.sms_bank_parsers import dispatch
@@ -32,11 +33,14 @@ dispatch() 遍历 _PARSERS，匹配 number 前缀后调用对应 parser。
         # result.amount, result.direction, result.card_suffix, ...
 
 扩展：
-    新增银行只需写一个 _parse_xxx() 函数并在 `_register_bank()` 中注册。
+    新增银行只需写一个 _parse_xxx() 函数并用 `@register_bank()` 注册；
+    模板类格式用 `RuleTable.rule()` 追加，rule_hits() 可查看各模板命中次数。
 """
 
 import re
+from collections import Counter
 from dataclasses import dataclass, field
+from functools import lru_cache
 from typing import Optional
 
 import pathmagic
@@ -46,7 +50,11 @@ with pathmagic.context():
 
 logger = log
 
-__all__ = ["ParsedSMS", "dispatch", "register_bank", "register_fallback"]
+__all__ = [
+    "ParsedSMS", "RuleTable", "dispatch", "dispatch_batch",
+    "register_bank", "register_fallback", "rule_hits", "reset_rule_hits",
+    "merge_rule_hits",
+]
 
 # ── 返回数据结构 ──
 
@@ -70,7 +78,11 @@ class ParsedSMS:
 
 # ── 解析器注册 ──
 
-# 每个元素: (number_prefix_regex, parser_fn(body, number) -> ParsedSMS | None)
+# 号码前缀 trie：每个节点是 {"children": {字符: 子节点}, "parsers": [已注册在此前缀上的 parser]}
+_PREFIX_TRIE = {"children": {}, "parsers": []}
+# 兜底解析器（按注册顺序），所有前缀 parser 都不匹配时调用
+_FALLBACKS = []
+# 注册记录 (number_prefix, parser_fn)，兜底解析器前缀为空串；仅供查看，分派走 _PREFIX_TRIE
 _PARSERS = []
 
 
@@ -78,7 +90,7 @@ def register_bank(number_prefix: str):
     """装饰器：注册银行解析器，按 number 前缀匹配。
 
     匹配规则：number 以 number_prefix 开头。
-    长前缀优先匹配，注册时已按长度降序排序。
+    前缀存入 trie，分派时沿 number 逐字符下行，长前缀优先匹配。
 
     用法：
         @register_bank("95555")
@@ -86,19 +98,124 @@ def register_bank(number_prefix: str):
             ...
     """
     def decorator(fn):
+        node = _PREFIX_TRIE
+        for ch in number_prefix:
+            node = node["children"].setdefault(ch, {"children": {}, "parsers": []})
+        node["parsers"].append((number_prefix, fn))
         _PARSERS.append((number_prefix, fn))
-        # 按前缀长度降序排列，长前缀优先匹配
-        _PARSERS.sort(key=lambda x: -len(x[0]))
+        _route.cache_clear()
         return fn
     return decorator
 
 
 def register_fallback(fn):
     """注册兜底解析器（所有前面 parser 都不匹配时调用）。"""
+    _FALLBACKS.append(fn)
     _PARSERS.append(("", fn))
     return fn
 
 
+@lru_cache(maxsize=4096)
+def _route(number: str) -> tuple:
+    """返回 number 命中的 (prefix, parser) 列表，长前缀在前；发件号码有限，结果缓存。"""
+    node = _PREFIX_TRIE
+    matched = []
+    for ch in number:
+        node = node["children"].get(ch)
+        if node is None:
+            break
+        matched.append(node["parsers"])
+    return tuple(p for parsers in reversed(matched) for p in parsers)
+
+
+# ── 模板规则表 ──
+
+# 模板命中计数："银行名/模板名" → 次数；dispatch/dispatch_batch 均会累加
+_RULE_HITS = Counter()
+
+
+class RuleTable:
+    r"""单个银行的有序模板规则表。
+
+    每条规则 = (模板名, 编译好的正则, 必含字面量 anchor, 构造函数)，按声明顺序即优先级。
+    所有 anchor 合并成一个长词优先的多选正则，一遍扫描正文得到在场的 anchor，
+    只有 anchor 在场的规则才执行自身正则（缺少必含字面量的正则不可能匹配），
+    结果与逐条顺序 re.search 完全一致。
+
+    用法：
+        _CMB_RULES = RuleTable("招商银行")
+
+        @_CMB_RULES.rule("atm", r"本行ATM无卡取款人民币(\d+\.?\d*)", anchor="本行ATM无卡取款")
+        def _cmb_atm(m, body, card_suffix):
+            return ParsedSMS(...)
+    """
+
+    def __init__(self, bank_name: str) -> None:
+        """建立 bank_name 的空规则表，扫描器在首次匹配时再编译。"""
+        self.bank_name = bank_name
+        self.rules = []  # [(name, pattern, anchor, build)]
+        self._scanner = None
+        self._closure = {}
+
+    def rule(self, name: str, pattern: str, anchor: str):
+        """装饰器：追加一条规则，build(m, body, card_suffix) -> ParsedSMS。"""
+        if anchor not in pattern:
+            # 用 raise 而非 assert：python -O 下断言被去掉，错的 anchor 会让这条规则永远不被执行
+            raise ValueError(f"anchor {anchor!r} 必须是正则中的字面量")
+
+        def decorator(build):
+            self.rules.append((name, re.compile(pattern), anchor, build))
+            self._scanner = None
+            return build
+        return decorator
+
+    def _compile(self):
+        anchors = {anchor for _, _, anchor, _ in self.rules}
+        # anchor 命中时连带其中包含的更短 anchor，同一起点被长词遮住的短词不会漏
+        self._closure = {a: frozenset(b for b in anchors if b in a) for a in anchors}
+        alternation = "|".join(re.escape(a) for a in sorted(anchors, key=len, reverse=True))
+        self._scanner = re.compile(alternation)
+
+    def scan(self, body: str) -> frozenset:
+        """一遍扫描正文，返回在场的 anchor 集合。"""
+        if self._scanner is None:
+            self._compile()
+        present = frozenset()
+        m = self._scanner.search(body)
+        while m:
+            present |= self._closure[m.group()]
+            m = self._scanner.search(body, m.start() + 1)
+        return present
+
+    def apply(self, body: str, card_suffix: str = "") -> Optional[ParsedSMS]:
+        """按优先级返回第一条命中规则构造的结果，无命中返回 None。"""
+        present = self.scan(body)
+        if not present:
+            return None
+        for name, pattern, anchor, build in self.rules:
+            if anchor not in present:
+                continue
+            m = pattern.search(body)
+            if m:
+                _RULE_HITS[f"{self.bank_name}/{name}"] += 1
+                return build(m, body, card_suffix)
+        return None
+
+
+def rule_hits() -> dict:
+    """各模板命中次数，按次数降序。"""
+    return dict(_RULE_HITS.most_common())
+
+
+def reset_rule_hits():
+    _RULE_HITS.clear()
+
+
+def merge_rule_hits(hits: dict):
+    """累加其他进程（进程池 worker）回传的模板命中次数。"""
+    _RULE_HITS.update(hits)
+
+
 # ── 金额工具 ──
 
 _RE_CNY = re.compile(r"人民币?(\d+\.?\d*)")
@@ -227,164 +344,167 @@ def _parse_cmb(body: str, number: str) -> Optional[ParsedSMS]:
     if m:
         card_suffix = m.group(1)
 
-    # ══════════════ 收入类 ══════════════
+    result = _CMB_RULES.apply(body, card_suffix)
+    if result is not None:
+        return result
 
-    # 格式4 + 格式6：他行实时转入 / 本行转入 → 收入
-    m_in = re.search(r"他行实时转入人民币(\d+\.?\d*).*?付方(.+?)(?:[。.，\s]|关闭|收益|砸|领|$)", body)
-    if not m_in:
-        m_in = re.search(r"收到本行转入人民币(\d+\.?\d*).*?付方(.+?)(?:[。.，\s]|备注|$)", body)
-    if m_in:
-        amount = float(m_in.group(1))
-        counterparty = _strip_trailing(m_in.group(2))
+    # 兜底：匹配任意金额，带收入关键词检测
+    amount = _extract_amount(body)
+    if amount > 0:
+        if "转至他行" in body or "转出" in body:
+            direction, td = "支出", "transfer_out"
+        elif "收款" in body or "入账" in body or "转入" in body:
+            direction, td = "收入", "transfer_in"
+        else:
+            direction, td = "支出", "consumption"
         return ParsedSMS(
-            amount=amount, direction="收入", card_suffix=card_suffix,
-            merchant="他行转入" if "他行" in m_in.group(0) else "本行转入",
-            counterparty=counterparty, bank_name="招商银行",
-            category="收入-转账", tx_type_detail="transfer_in",
+            amount=amount, direction=direction, card_suffix=card_suffix,
+            merchant="", counterparty="", bank_name="招商银行",
+            tx_type_detail=td,
         )
 
-    # 格式7：收款XXX.XX元，备注：XXX → 收入（微信零钱提现/支付宝转账）
-    m_recv = re.search(r"收款(\d+\.?\d*)元.*?备注[：:]\s*(.+?)$", body)
-    if m_recv:
-        return ParsedSMS(
-            amount=float(m_recv.group(1)), direction="收入", card_suffix=card_suffix,
-            merchant=m_recv.group(2).strip(), counterparty="", bank_name="招商银行",
-            category="收入-转账", tx_type_detail="transfer_in",
-        )
+    return None
 
-    # 格式8：银联入账人民币X.XX元（XXX）→ 收入
-    m_union = re.search(r"银联入账人民币(\d+\.?\d*)元（(.+?)）", body)
-    if m_union:
-        return ParsedSMS(
-            amount=float(m_union.group(1)), direction="收入", card_suffix=card_suffix,
-            merchant=m_union.group(2).strip(), counterparty="", bank_name="招商银行",
-            category="收入-转账", tx_type_detail="transfer_in",
-        )
 
-    # 格式9：入账XXX.XX元（XXX）→ 收入
-    m_in2 = re.search(r"入账(\d+\.?\d*)元（(.+?)）", body)
-    if m_in2:
-        return ParsedSMS(
-            amount=float(m_in2.group(1)), direction="收入", card_suffix=card_suffix,
-            merchant=m_in2.group(2).strip(), counterparty="", bank_name="招商银行",
-            category="收入-转账", tx_type_detail="transfer_in",
-        )
+_CMB_RULES = RuleTable("招商银行")
 
-    # ══════════════ 贷款还款 ══════════════
+# ══════════════ 收入类 ══════════════
 
-    # 格式5：扣款归还个贷 → 贷款还款
-    if "扣款归还个贷" in body:
-        amount = _extract_cny(body) or 0.0
-        return ParsedSMS(
-            amount=amount, direction="支出", card_suffix=card_suffix,
-            merchant="个贷还款", counterparty="招商银行", bank_name="招商银行",
-            is_loan=True, category="借贷-还款", tx_type_detail="loan_repayment",
-        )
 
-    # 格式11：信用卡还款交易 → 内部转账（储蓄卡→信用卡），非实际支出
-    if "信用卡还款交易" in body:
-        amount = _extract_cny(body) or _extract_yuan(body) or 0.0
-        return ParsedSMS(
-            amount=amount, direction="支出", card_suffix=card_suffix,
-            merchant="信用卡还款", counterparty="招商银行信用卡", bank_name="招商银行",
-            category="内部-转账", tx_type_detail="transfer",
-        )
+# 格式4 + 格式6：他行实时转入 / 本行转入 → 收入
+@_CMB_RULES.rule("他行实时转入",
+                 r"他行实时转入人民币(\d+\.?\d*).*?付方(.+?)(?:[。.，\s]|关闭|收益|砸|领|$)",
+                 anchor="他行实时转入人民币")
+def _cmb_transfer_in(m, body, card_suffix):
+    return ParsedSMS(
+        amount=float(m.group(1)), direction="收入", card_suffix=card_suffix,
+        merchant="他行转入" if "他行" in m.group(0) else "本行转入",
+        counterparty=_strip_trailing(m.group(2)), bank_name="招商银行",
+        category="收入-转账", tx_type_detail="transfer_in",
+    )
 
-    # ══════════════ 支出类 ══════════════
 
-    # 格式12：在【XXX】发生XX扣款 → 贷款还款或消费
-    m_deduct_merchant = re.search(r"在【(.+?)】发生.*?扣款人民币(\d+\.?\d*)", body)
-    if m_deduct_merchant:
-        amount = float(m_deduct_merchant.group(2))
-        merchant = m_deduct_merchant.group(1)
-        is_loan = any(kw in merchant for kw in ("金融", "消金", "贷款", "借呗", "还"))
-        return ParsedSMS(
-            amount=amount, direction="支出", card_suffix=card_suffix,
-            merchant=merchant, counterparty=merchant, bank_name="招商银行",
-            is_loan=is_loan,
-            category="借贷-还款" if is_loan else "未分类-其他",
-            tx_type_detail="loan_repayment" if is_loan else "consumption",
-        )
+_CMB_RULES.rule("本行转入", r"收到本行转入人民币(\d+\.?\d*).*?付方(.+?)(?:[。.，\s]|备注|$)",
+                anchor="收到本行转入人民币")(_cmb_transfer_in)
 
-    # 格式1：实时转至他行 → 转账支出
-    m_transfer = re.search(r"实时转至他行人民币(\d+\.?\d*).*?收款人(.+?)$", body)
-    if m_transfer:
-        amount = float(m_transfer.group(1))
-        counterparty = _strip_trailing(m_transfer.group(2))
-        return ParsedSMS(
-            amount=amount, direction="支出", card_suffix=card_suffix,
-            merchant="跨行转账", counterparty=counterparty, bank_name="招商银行",
-            category="未分类-其他", tx_type_detail="transfer_out",
-        )
 
-    # 格式10：转账汇款人民币X.XX，收款人：XXX → 转账支出
-    m_transfer2 = re.search(r"转账汇款人民币(\d+\.?\d*).*?收款人[：:]\s*(.+?)$", body)
-    if m_transfer2:
-        return ParsedSMS(
-            amount=float(m_transfer2.group(1)), direction="支出", card_suffix=card_suffix,
-            merchant="转账汇款", counterparty=_strip_trailing(m_transfer2.group(2)),
-            bank_name="招商银行", tx_type_detail="transfer_out",
-        )
+# 格式7：收款XXX.XX元，备注：XXX → 收入（微信零钱提现/支付宝转账）
+@_CMB_RULES.rule("收款备注", r"收款(\d+\.?\d*)元.*?备注[：:]\s*(.+?)$", anchor="备注")
+def _cmb_income(m, body, card_suffix):
+    return ParsedSMS(
+        amount=float(m.group(1)), direction="收入", card_suffix=card_suffix,
+        merchant=m.group(2).strip(), counterparty="", bank_name="招商银行",
+        category="收入-转账", tx_type_detail="transfer_in",
+    )
 
-    # 格式2：扣款人民币，商户：XXX → 保险/其他支出
-    m_deduct = re.search(r"扣款人民币(\d+\.?\d*).*?商户[：:]\s*(.+?)$", body)
-    if m_deduct:
-        amount = float(m_deduct.group(1))
-        merchant = _strip_trailing(m_deduct.group(2))
-        is_loan = "个贷" in body or "贷款" in body
-        return ParsedSMS(
-            amount=amount, direction="支出", card_suffix=card_suffix,
-            merchant=merchant, counterparty=merchant, bank_name="招商银行",
-            is_loan=is_loan,
-            category="借贷-还款" if is_loan else "未分类-其他",
-            tx_type_detail="deduction",
-        )
 
-    # 扣收 → 支出（短信费/账户管理费）
-    m_deduct2 = re.search(r"扣收.*?人民币(\d+\.?\d*)", body)
-    if m_deduct2:
-        return ParsedSMS(
-            amount=float(m_deduct2.group(1)), direction="支出", card_suffix=card_suffix,
-            merchant="账户费用", counterparty="招商银行", bank_name="招商银行",
-            tx_type_detail="fee",
-        )
+# 格式8：银联入账人民币X.XX元（XXX）→ 收入
+_CMB_RULES.rule("银联入账", r"银联入账人民币(\d+\.?\d*)元（(.+?)）", anchor="银联入账人民币")(_cmb_income)
+# 格式9：入账XXX.XX元（XXX）→ 收入
+_CMB_RULES.rule("入账", r"入账(\d+\.?\d*)元（(.+?)）", anchor="入账")(_cmb_income)
 
-    # 格式3：在【XX】快捷支付 → 消费支出
-    m_quick = re.search(r"在【(.+?)】快捷支付(\d+\.?\d*)元", body)
-    if m_quick:
-        amount = float(m_quick.group(2))
-        merchant = m_quick.group(1)
-        return ParsedSMS(
-            amount=amount, direction="支出", card_suffix=card_suffix,
-            merchant=merchant, counterparty=merchant, bank_name="招商银行",
-            category="未分类-其他", tx_type_detail="consumption",
-        )
 
-    # 格式13：本行ATM无卡取款
-    m_atm = re.search(r"本行ATM无卡取款人民币(\d+\.?\d*)", body)
-    if m_atm:
-        return ParsedSMS(
-            amount=float(m_atm.group(1)), direction="支出", card_suffix=card_suffix,
-            merchant="ATM取款", counterparty="", bank_name="招商银行",
-            tx_type_detail="withdrawal",
-        )
+# ══════════════ 贷款还款 ══════════════
 
-    # 兜底：匹配任意金额，带收入关键词检测
-    amount = _extract_amount(body)
-    if amount > 0:
-        if "转至他行" in body or "转出" in body:
-            direction, td = "支出", "transfer_out"
-        elif "收款" in body or "入账" in body or "转入" in body:
-            direction, td = "收入", "transfer_in"
-        else:
-            direction, td = "支出", "consumption"
-        return ParsedSMS(
-            amount=amount, direction=direction, card_suffix=card_suffix,
-            merchant="", counterparty="", bank_name="招商银行",
-            tx_type_detail=td,
-        )
+# 格式5：扣款归还个贷 → 贷款还款
+@_CMB_RULES.rule("扣款归还个贷", r"扣款归还个贷", anchor="扣款归还个贷")
+def _cmb_loan_repay(m, body, card_suffix):
+    return ParsedSMS(
+        amount=_extract_cny(body) or 0.0, direction="支出", card_suffix=card_suffix,
+        merchant="个贷还款", counterparty="招商银行", bank_name="招商银行",
+        is_loan=True, category="借贷-还款", tx_type_detail="loan_repayment",
+    )
+
+
+# 格式11：信用卡还款交易 → 内部转账（储蓄卡→信用卡），非实际支出
+@_CMB_RULES.rule("信用卡还款交易", r"信用卡还款交易", anchor="信用卡还款交易")
+def _cmb_card_repay(m, body, card_suffix):
+    return ParsedSMS(
+        amount=_extract_cny(body) or _extract_yuan(body) or 0.0, direction="支出", card_suffix=card_suffix,
+        merchant="信用卡还款", counterparty="招商银行信用卡", bank_name="招商银行",
+        category="内部-转账", tx_type_detail="transfer",
+    )
 
-    return None
+
+# ══════════════ 支出类 ══════════════
+
+# 格式12：在【XXX】发生XX扣款 → 贷款还款或消费
+@_CMB_RULES.rule("发生扣款", r"在【(.+?)】发生.*?扣款人民币(\d+\.?\d*)", anchor="扣款人民币")
+def _cmb_deduct_merchant(m, body, card_suffix):
+    merchant = m.group(1)
+    is_loan = any(kw in merchant for kw in ("金融", "消金", "贷款", "借呗", "还"))
+    return ParsedSMS(
+        amount=float(m.group(2)), direction="支出", card_suffix=card_suffix,
+        merchant=merchant, counterparty=merchant, bank_name="招商银行",
+        is_loan=is_loan,
+        category="借贷-还款" if is_loan else "未分类-其他",
+        tx_type_detail="loan_repayment" if is_loan else "consumption",
+    )
+
+
+# 格式1：实时转至他行 → 转账支出
+@_CMB_RULES.rule("实时转至他行", r"实时转至他行人民币(\d+\.?\d*).*?收款人(.+?)$", anchor="实时转至他行人民币")
+def _cmb_transfer_out(m, body, card_suffix):
+    return ParsedSMS(
+        amount=float(m.group(1)), direction="支出", card_suffix=card_suffix,
+        merchant="跨行转账", counterparty=_strip_trailing(m.group(2)), bank_name="招商银行",
+        category="未分类-其他", tx_type_detail="transfer_out",
+    )
+
+
+# 格式10：转账汇款人民币X.XX，收款人：XXX → 转账支出
+@_CMB_RULES.rule("转账汇款", r"转账汇款人民币(\d+\.?\d*).*?收款人[：:]\s*(.+?)$", anchor="转账汇款人民币")
+def _cmb_remit(m, body, card_suffix):
+    return ParsedSMS(
+        amount=float(m.group(1)), direction="支出", card_suffix=card_suffix,
+        merchant="转账汇款", counterparty=_strip_trailing(m.group(2)),
+        bank_name="招商银行", tx_type_detail="transfer_out",
+    )
+
+
+# 格式2：扣款人民币，商户：XXX → 保险/其他支出
+@_CMB_RULES.rule("扣款商户", r"扣款人民币(\d+\.?\d*).*?商户[：:]\s*(.+?)$", anchor="扣款人民币")
+def _cmb_deduct(m, body, card_suffix):
+    merchant = _strip_trailing(m.group(2))
+    is_loan = "个贷" in body or "贷款" in body
+    return ParsedSMS(
+        amount=float(m.group(1)), direction="支出", card_suffix=card_suffix,
+        merchant=merchant, counterparty=merchant, bank_name="招商银行",
+        is_loan=is_loan,
+        category="借贷-还款" if is_loan else "未分类-其他",
+        tx_type_detail="deduction",
+    )
+
+
+# 扣收 → 支出（短信费/账户管理费）
+@_CMB_RULES.rule("扣收", r"扣收.*?人民币(\d+\.?\d*)", anchor="扣收")
+def _cmb_fee(m, body, card_suffix):
+    return ParsedSMS(
+        amount=float(m.group(1)), direction="支出", card_suffix=card_suffix,
+        merchant="账户费用", counterparty="招商银行", bank_name="招商银行",
+        tx_type_detail="fee",
+    )
+
+
+# 格式3：在【XX】快捷支付 → 消费支出
+@_CMB_RULES.rule("快捷支付", r"在【(.+?)】快捷支付(\d+\.?\d*)元", anchor="快捷支付")
+def _cmb_quick_pay(m, body, card_suffix):
+    merchant = m.group(1)
+    return ParsedSMS(
+        amount=float(m.group(2)), direction="支出", card_suffix=card_suffix,
+        merchant=merchant, counterparty=merchant, bank_name="招商银行",
+        category="未分类-其他", tx_type_detail="consumption",
+    )
+
+
+# 格式13：本行ATM无卡取款
+@_CMB_RULES.rule("ATM无卡取款", r"本行ATM无卡取款人民币(\d+\.?\d*)", anchor="本行ATM无卡取款人民币")
+def _cmb_atm(m, body, card_suffix):
+    return ParsedSMS(
+        amount=float(m.group(1)), direction="支出", card_suffix=card_suffix,
+        merchant="ATM取款", counterparty="", bank_name="招商银行",
+        tx_type_detail="withdrawal",
+    )
 
 
 # ══════════════════════════════════════════
@@ -420,74 +540,9 @@ def _parse_comm(body: str, number: str) -> Optional[ParsedSMS]:
                          merchant="", counterparty="", bank_name="交通银行",
                          _skip=True)
 
-    # --- 信用卡消费：您尾号2349交行信用卡DD日HH时MM分成功消费人民币X.XX元 ---
-    m_cc_consume = re.search(r"您尾号(\d{4})交行信用卡.*?成功消费人民币(\d+\.?\d*)元", body)
-    if m_cc_consume:
-        return ParsedSMS(
-            amount=float(m_cc_consume.group(2)), direction="支出",
-            card_suffix=m_cc_consume.group(1),
-            merchant="信用卡消费", counterparty="", bank_name="交通银行",
-            category="未分类-其他", tx_type_detail="consumption",
-        )
-
-    # --- 格式4：网络支付转入 → 收入 ---
-    m_net_in = re.search(r"您尾号\*?(\d{4})的卡于.*?网络支付转入(\d+\.?\d*)元", body)
-    if m_net_in:
-        return ParsedSMS(
-            amount=float(m_net_in.group(2)), direction="收入",
-            card_suffix=m_net_in.group(1),
-            merchant="网络支付转入", counterparty="", bank_name="交通银行",
-            category="收入-转账", tx_type_detail="transfer_in",
-        )
-
-    # --- 格式1：跨行汇款转入 → 收入 ---
-    m_cross_in = re.search(r"贵账户\*?(\d{4})于.*?跨行汇款转入资金(\d+\.?\d*)元.*?对方户名[：:]?(.*?)(?:，|$)", body)
-    if m_cross_in:
-        return ParsedSMS(
-            amount=float(m_cross_in.group(2)), direction="收入",
-            card_suffix=m_cross_in.group(1),
-            merchant="跨行汇款转入", counterparty=_strip_trailing(m_cross_in.group(3)),
-            bank_name="交通银行",
-            category="收入-转账", tx_type_detail="transfer_in",
-        )
-
-    # --- 格式5：手机银行跨行汇款转出 / 转出 → 支出 ---
-    m_out = re.search(r"您尾号\*?(\d{4})的卡于.*?(?:手机银行跨行汇款转出|转出)(\d+\.?\d*)元", body)
-    if m_out:
-        return ParsedSMS(
-            amount=float(m_out.group(2)), direction="支出",
-            card_suffix=m_out.group(1),
-            merchant="跨行汇款转出", counterparty="", bank_name="交通银行",
-            tx_type_detail="transfer_out",
-        )
-
-    # --- 格式2：贵账户转出 → 支出 ---
-    m_cross_out = re.search(r"贵账户\*?(\d{4})于.*?转出(\d+\.?\d*)元.*?摘要[：:]?\s*(.*?)(?:。|$)", body)
-    if m_cross_out:
-        amt = float(m_cross_out.group(2))
-        summary = _strip_trailing(m_cross_out.group(3))
-        is_loan_repay = any(kw in summary for kw in ("金融还款", "还款"))
-        return ParsedSMS(
-            amount=amt, direction="支出",
-            card_suffix=m_cross_out.group(1),
-            merchant=summary or "转出",
-            counterparty=summary, bank_name="交通银行",
-            is_loan=is_loan_repay,
-            category="借贷-还款" if is_loan_repay else "未分类-其他",
-            tx_type_detail="loan_repayment" if is_loan_repay else "transfer_out",
-        )
-
-    # --- 格式6：网上支付 → 支出 ---
-    m_online = re.search(r"您尾号\*?(\d{4})的卡于.*?在(.+?)网上支付(\d+\.?\d*)元", body)
-    if m_online:
-        return ParsedSMS(
-            amount=float(m_online.group(3)), direction="支出",
-            card_suffix=m_online.group(1),
-            merchant=_strip_trailing(m_online.group(2)),
-            counterparty=_strip_trailing(m_online.group(2)),
-            bank_name="交通银行",
-            tx_type_detail="consumption",
-        )
+    result = _COMM_RULES.apply(body)
+    if result is not None:
+        return result
 
     # 兜底
     amount = _extract_amount(body)
@@ -512,6 +567,85 @@ def _parse_comm(body: str, number: str) -> Optional[ParsedSMS]:
     return None
 
 
+_COMM_RULES = RuleTable("交通银行")
+
+
+# 信用卡消费：您尾号2349交行信用卡DD日HH时MM分成功消费人民币X.XX元
+@_COMM_RULES.rule("信用卡消费", r"您尾号(\d{4})交行信用卡.*?成功消费人民币(\d+\.?\d*)元", anchor="成功消费人民币")
+def _comm_card_consume(m, body, card_suffix):
+    return ParsedSMS(
+        amount=float(m.group(2)), direction="支出",
+        card_suffix=m.group(1),
+        merchant="信用卡消费", counterparty="", bank_name="交通银行",
+        category="未分类-其他", tx_type_detail="consumption",
+    )
+
+
+# 格式4：网络支付转入 → 收入
+@_COMM_RULES.rule("网络支付转入", r"您尾号\*?(\d{4})的卡于.*?网络支付转入(\d+\.?\d*)元", anchor="网络支付转入")
+def _comm_net_in(m, body, card_suffix):
+    return ParsedSMS(
+        amount=float(m.group(2)), direction="收入",
+        card_suffix=m.group(1),
+        merchant="网络支付转入", counterparty="", bank_name="交通银行",
+        category="收入-转账", tx_type_detail="transfer_in",
+    )
+
+
+# 格式1：跨行汇款转入 → 收入
+@_COMM_RULES.rule("跨行汇款转入",
+                  r"贵账户\*?(\d{4})于.*?跨行汇款转入资金(\d+\.?\d*)元.*?对方户名[：:]?(.*?)(?:，|$)",
+                  anchor="跨行汇款转入资金")
+def _comm_cross_in(m, body, card_suffix):
+    return ParsedSMS(
+        amount=float(m.group(2)), direction="收入",
+        card_suffix=m.group(1),
+        merchant="跨行汇款转入", counterparty=_strip_trailing(m.group(3)),
+        bank_name="交通银行",
+        category="收入-转账", tx_type_detail="transfer_in",
+    )
+
+
+# 格式5：手机银行跨行汇款转出 / 转出 → 支出
+@_COMM_RULES.rule("卡转出", r"您尾号\*?(\d{4})的卡于.*?(?:手机银行跨行汇款转出|转出)(\d+\.?\d*)元", anchor="转出")
+def _comm_card_out(m, body, card_suffix):
+    return ParsedSMS(
+        amount=float(m.group(2)), direction="支出",
+        card_suffix=m.group(1),
+        merchant="跨行汇款转出", counterparty="", bank_name="交通银行",
+        tx_type_detail="transfer_out",
+    )
+
+
+# 格式2：贵账户转出 → 支出
+@_COMM_RULES.rule("账户转出", r"贵账户\*?(\d{4})于.*?转出(\d+\.?\d*)元.*?摘要[：:]?\s*(.*?)(?:。|$)", anchor="摘要")
+def _comm_account_out(m, body, card_suffix):
+    summary = _strip_trailing(m.group(3))
+    is_loan_repay = any(kw in summary for kw in ("金融还款", "还款"))
+    return ParsedSMS(
+        amount=float(m.group(2)), direction="支出",
+        card_suffix=m.group(1),
+        merchant=summary or "转出",
+        counterparty=summary, bank_name="交通银行",
+        is_loan=is_loan_repay,
+        category="借贷-还款" if is_loan_repay else "未分类-其他",
+        tx_type_detail="loan_repayment" if is_loan_repay else "transfer_out",
+    )
+
+
+# 格式6：网上支付 → 支出
+@_COMM_RULES.rule("网上支付", r"您尾号\*?(\d{4})的卡于.*?在(.+?)网上支付(\d+\.?\d*)元", anchor="网上支付")
+def _comm_online_pay(m, body, card_suffix):
+    return ParsedSMS(
+        amount=float(m.group(3)), direction="支出",
+        card_suffix=m.group(1),
+        merchant=_strip_trailing(m.group(2)),
+        counterparty=_strip_trailing(m.group(2)),
+        bank_name="交通银行",
+        tx_type_detail="consumption",
+    )
+
+
 # ══════════════════════════════════════════
 #  建设银行 (106980095533 等含 95533 前缀的号码)
 # ══════════════════════════════════════════
@@ -556,101 +690,7 @@ def _parse_ccb(body: str, number: str) -> Optional[ParsedSMS]:
                              merchant="", counterparty="", bank_name="建设银行",
                              _skip=True)
 
-    # --- 格式8：借记卡 → 信用卡还款 ---
-    m_card_repay = re.search(r"您尾号(\d{4})的储蓄卡.*?向白晔峰信用卡卡号还款支出人民币(\d+\.?\d*)元", body)
-    if m_card_repay:
-        return ParsedSMS(
-            amount=float(m_card_repay.group(2)), direction="支出",
-            card_suffix=m_card_repay.group(1),
-            merchant="信用卡还款", counterparty="建设银行", bank_name="建设银行",
-            tx_type_detail="transfer",  # 储蓄卡→信用卡，内部转账
-        )
-
-    # --- 格式3：存入 → 借记卡收入 ---
-    m_deposit = re.search(r"向您尾号(\d{4})的储蓄卡存入人民币(\d+\.?\d*)元", body)
-    if m_deposit:
-        # 提取存款人
-        depositor_m = re.search(r"^(.+?)\d+", body)
-        depositor = ""
-        if depositor_m:
-            depositor = _strip_trailing(depositor_m.group(1).strip())
-        return ParsedSMS(
-            amount=float(m_deposit.group(2)), direction="收入",
-            card_suffix=m_deposit.group(1),
-            merchant="存入", counterparty=depositor or "", bank_name="建设银行",
-            category="收入-转账", tx_type_detail="deposit",
-        )
-
-    # --- 格式4：现金/ATM存入 → 借记卡收入 ---
-    m_cash_in = re.search(r"您尾号(\d{4})的储蓄卡.*?(?:ATM存款收入|现金存入收入)人民币(\d+\.?\d*)元", body)
-    if m_cash_in:
-        return ParsedSMS(
-            amount=float(m_cash_in.group(2)), direction="收入",
-            card_suffix=m_cash_in.group(1),
-            merchant="现金存入", counterparty="", bank_name="建设银行",
-            category="收入-其他", tx_type_detail="cash_deposit",
-        )
-
-    # --- 格式1：跨行转出 → 借记卡支出 ---
-    m_transfer_out = re.search(r"您尾号(\d{4})的储蓄卡.*?向(.+?)跨行转出支出人民币(\d+\.?\d*)元", body)
-    if m_transfer_out:
-        return ParsedSMS(
-            amount=float(m_transfer_out.group(3)), direction="支出",
-            card_suffix=m_transfer_out.group(1),
-            merchant="跨行转账",
-            counterparty=_strip_trailing(m_transfer_out.group(2)),
-            bank_name="建设银行",
-            tx_type_detail="transfer_out",
-        )
-
-    # --- 格式2 + 格式5：消费支出 / 支出 ---
-    m_expense = re.search(r"您尾号(\d{4})的储蓄卡.*?(?:消费支出|支出)人民币(\d+\.?\d*)元", body)
-    if m_expense:
-        amt = float(m_expense.group(2))
-        # 判断是否贷款相关
-        has_loan_kw = any(kw in body for kw in ("金融还款", "中邮", "消金", "消费金融", "宜享花"))
-        return ParsedSMS(
-            amount=amt, direction="支出",
-            card_suffix=m_expense.group(1),
-            merchant=_extract_merchant_from_ccb(body), counterparty="",
-            bank_name="建设银行",
-            is_loan=has_loan_kw,
-            category="借贷-还款" if has_loan_kw else "未分类-其他",
-            tx_type_detail="loan_repayment" if has_loan_kw else "consumption",
-        )
-
-    # --- 格式7：信用卡存入（还款入账） ---
-    m_cc_in = re.search(r"您尾号(\d{4})(?:龙卡信用卡|信用卡).*?存入(\d+\.?\d*)元", body)
-    if m_cc_in:
-        return ParsedSMS(
-            amount=float(m_cc_in.group(2)), direction="收入",
-            card_suffix=m_cc_in.group(1),
-            merchant="信用卡还款入账", counterparty="", bank_name="建设银行",
-            tx_type_detail="repayment_in",
-        )
-
-    # --- 格式6：信用卡消费 ---
-    m_cc_consume = re.search(r"您尾号(\d{4})(?:的)?(?:龙卡信用卡|信用卡).*?消费(\d+\.?\d*)元", body)
-    if m_cc_consume:
-        return ParsedSMS(
-            amount=float(m_cc_consume.group(2)), direction="支出",
-            card_suffix=m_cc_consume.group(1),
-            merchant="信用卡消费", counterparty="", bank_name="建设银行",
-            category="未分类-其他", tx_type_detail="consumption",
-        )
-
-    # 刷脸取款
-    m_withdraw = re.search(r"您尾号(\d{4})的储蓄卡.*?刷脸取款支出人民币(\d+\.?\d*)元", body)
-    if m_withdraw:
-        return ParsedSMS(
-            amount=float(m_withdraw.group(2)), direction="支出",
-            card_suffix=m_withdraw.group(1),
-            merchant="取款", counterparty="", bank_name="建设银行",
-            category="未分类-其他", tx_type_detail="withdrawal",
-        )
-
-    return None
-
+    return _CCB_RULES.apply(body)
 
 def _extract_merchant_from_ccb(body: str) -> str:
     """提取建设银行借记卡支出中的商户/用途。"""
@@ -665,6 +705,113 @@ def _extract_merchant_from_ccb(body: str) -> str:
     return ""
 
 
+_CCB_RULES = RuleTable("建设银行")
+
+
+# 格式8：借记卡 → 信用卡还款
+@_CCB_RULES.rule("储蓄卡还信用卡",
+                 r"您尾号(\d{4})的储蓄卡.*?向白晔峰信用卡卡号还款支出人民币(\d+\.?\d*)元",
+                 anchor="信用卡卡号还款支出人民币")
+def _ccb_card_repay(m, body, card_suffix):
+    return ParsedSMS(
+        amount=float(m.group(2)), direction="支出",
+        card_suffix=m.group(1),
+        merchant="信用卡还款", counterparty="建设银行", bank_name="建设银行",
+        tx_type_detail="transfer",  # 储蓄卡→信用卡，内部转账
+    )
+
+
+# 格式3：存入 → 借记卡收入
+@_CCB_RULES.rule("存入", r"向您尾号(\d{4})的储蓄卡存入人民币(\d+\.?\d*)元", anchor="的储蓄卡存入人民币")
+def _ccb_deposit(m, body, card_suffix):
+    # 提取存款人
+    depositor_m = re.search(r"^(.+?)\d+", body)
+    depositor = ""
+    if depositor_m:
+        depositor = _strip_trailing(depositor_m.group(1).strip())
+    return ParsedSMS(
+        amount=float(m.group(2)), direction="收入",
+        card_suffix=m.group(1),
+        merchant="存入", counterparty=depositor or "", bank_name="建设银行",
+        category="收入-转账", tx_type_detail="deposit",
+    )
+
+
+# 格式4：现金/ATM存入 → 借记卡收入
+@_CCB_RULES.rule("现金存入",
+                 r"您尾号(\d{4})的储蓄卡.*?(?:ATM存款|现金存入)收入人民币(\d+\.?\d*)元",
+                 anchor="收入人民币")
+def _ccb_cash_in(m, body, card_suffix):
+    return ParsedSMS(
+        amount=float(m.group(2)), direction="收入",
+        card_suffix=m.group(1),
+        merchant="现金存入", counterparty="", bank_name="建设银行",
+        category="收入-其他", tx_type_detail="cash_deposit",
+    )
+
+
+# 格式1：跨行转出 → 借记卡支出
+@_CCB_RULES.rule("跨行转出", r"您尾号(\d{4})的储蓄卡.*?向(.+?)跨行转出支出人民币(\d+\.?\d*)元", anchor="跨行转出支出人民币")
+def _ccb_transfer_out(m, body, card_suffix):
+    return ParsedSMS(
+        amount=float(m.group(3)), direction="支出",
+        card_suffix=m.group(1),
+        merchant="跨行转账",
+        counterparty=_strip_trailing(m.group(2)),
+        bank_name="建设银行",
+        tx_type_detail="transfer_out",
+    )
+
+
+# 格式2 + 格式5：消费支出 / 支出
+@_CCB_RULES.rule("储蓄卡支出", r"您尾号(\d{4})的储蓄卡.*?(?:消费)?支出人民币(\d+\.?\d*)元", anchor="支出人民币")
+def _ccb_expense(m, body, card_suffix):
+    # 判断是否贷款相关
+    has_loan_kw = any(kw in body for kw in ("金融还款", "中邮", "消金", "消费金融", "宜享花"))
+    return ParsedSMS(
+        amount=float(m.group(2)), direction="支出",
+        card_suffix=m.group(1),
+        merchant=_extract_merchant_from_ccb(body), counterparty="",
+        bank_name="建设银行",
+        is_loan=has_loan_kw,
+        category="借贷-还款" if has_loan_kw else "未分类-其他",
+        tx_type_detail="loan_repayment" if has_loan_kw else "consumption",
+    )
+
+
+# 格式7：信用卡存入（还款入账）
+@_CCB_RULES.rule("信用卡存入", r"您尾号(\d{4})(?:龙卡信用卡|信用卡).*?存入(\d+\.?\d*)元", anchor="存入")
+def _ccb_card_in(m, body, card_suffix):
+    return ParsedSMS(
+        amount=float(m.group(2)), direction="收入",
+        card_suffix=m.group(1),
+        merchant="信用卡还款入账", counterparty="", bank_name="建设银行",
+        tx_type_detail="repayment_in",
+    )
+
+
+# 格式6：信用卡消费
+@_CCB_RULES.rule("信用卡消费", r"您尾号(\d{4})(?:的)?(?:龙卡信用卡|信用卡).*?消费(\d+\.?\d*)元", anchor="消费")
+def _ccb_card_consume(m, body, card_suffix):
+    return ParsedSMS(
+        amount=float(m.group(2)), direction="支出",
+        card_suffix=m.group(1),
+        merchant="信用卡消费", counterparty="", bank_name="建设银行",
+        category="未分类-其他", tx_type_detail="consumption",
+    )
+
+
+# 刷脸取款
+@_CCB_RULES.rule("刷脸取款", r"您尾号(\d{4})的储蓄卡.*?刷脸取款支出人民币(\d+\.?\d*)元", anchor="刷脸取款支出人民币")
+def _ccb_withdraw(m, body, card_suffix):
+    return ParsedSMS(
+        amount=float(m.group(2)), direction="支出",
+        card_suffix=m.group(1),
+        merchant="取款", counterparty="", bank_name="建设银行",
+        category="未分类-其他", tx_type_detail="withdrawal",
+    )
+
+
 # ══════════════════════════════════════════
 #  农业银行 (95599)
 # ══════════════════════════════════════════
@@ -704,56 +851,9 @@ def _parse_abc(body: str, number: str) -> Optional[ParsedSMS]:
                          merchant="", counterparty="", bank_name="农业银行",
                          _skip=True)
 
-    # --- 格式4 + 5：转存 / 代付 → 收入 ---
-    m_in = re.search(r"向您尾号(\d{4})账户完成(?:转存|代付|代收)交易人民币(-?\d+\.?\d*)", body)
-    if m_in:
-        # 提取对方名
-        counterparty_m = re.search(r"^(.+?)(?:于|向)", body)
-        counterparty = _strip_trailing(counterparty_m.group(1)) if counterparty_m else ""
-        return ParsedSMS(
-            amount=abs(float(m_in.group(2))), direction="收入",
-            card_suffix=m_in.group(1),
-            merchant="代付入账" if "代付" in body else "转存入账",
-            counterparty=counterparty, bank_name="农业银行",
-            category="收入-转账", tx_type_detail="transfer_in",
-        )
-
-    # --- 格式1：银联入账/入账/奖金/代付 → 收入/支出 ---
-    m_income = re.search(r"您尾号(\d{4})账户.*?完成(.+?)交易人民币(-?\d+\.?\d*)", body)
-    if m_income:
-        amt = abs(float(m_income.group(3)))
-        txn_type = m_income.group(2)
-        # 判断方向：含"向XXX完成"表示为转出
-        if "向" in body and "完成" in body:
-            direction = "支出"
-            detail_type = "transfer_out"
-        else:
-            direction = "收入"
-            detail_type = "salary" if "奖金" in txn_type else "income"
-        return ParsedSMS(
-            amount=amt, direction=direction,
-            card_suffix=m_income.group(1),
-            merchant=txn_type, counterparty="", bank_name="农业银行",
-            category="收入-工资" if detail_type == "salary" else "未分类-其他",
-            tx_type_detail=detail_type,
-        )
-
-    # --- 格式2 + 6：转支 / 支出 ---
-    m_out = re.search(r"您尾号(\d{4})账户.*?向(.+?)完成(.+?)交易人民币(-?\d+\.?\d*)", body)
-    if m_out:
-        amt = abs(float(m_out.group(4)))
-        counterparty = _strip_trailing(m_out.group(2))
-        txn_type = m_out.group(3)
-        has_loan_kw = any(kw in counterparty for kw in ("宜享花", "金融", "消金", "美团金融"))
-        return ParsedSMS(
-            amount=amt, direction="支出",
-            card_suffix=m_out.group(1),
-            merchant=txn_type, counterparty=counterparty,
-            bank_name="农业银行",
-            is_loan=has_loan_kw,
-            category="借贷-还款" if has_loan_kw else "未分类-其他",
-            tx_type_detail="loan_repayment" if has_loan_kw else "transfer_out",
-        )
+    result = _ABC_RULES.apply(body, card_suffix)
+    if result is not None:
+        return result
 
     # 兜底
     amount = _extract_amount(body)
@@ -768,6 +868,60 @@ def _parse_abc(body: str, number: str) -> Optional[ParsedSMS]:
     return None
 
 
+_ABC_RULES = RuleTable("农业银行")
+
+
+# 格式4 + 5：转存 / 代付 → 收入
+@_ABC_RULES.rule("转存代付", r"向您尾号(\d{4})账户完成(?:转存|代付|代收)交易人民币(-?\d+\.?\d*)", anchor="账户完成")
+def _abc_transfer_in(m, body, card_suffix):
+    # 提取对方名
+    counterparty_m = re.search(r"^(.+?)(?:于|向)", body)
+    counterparty = _strip_trailing(counterparty_m.group(1)) if counterparty_m else ""
+    return ParsedSMS(
+        amount=abs(float(m.group(2))), direction="收入",
+        card_suffix=m.group(1),
+        merchant="代付入账" if "代付" in body else "转存入账",
+        counterparty=counterparty, bank_name="农业银行",
+        category="收入-转账", tx_type_detail="transfer_in",
+    )
+
+
+# 格式1：银联入账/入账/奖金/代付 → 收入/支出
+@_ABC_RULES.rule("完成交易", r"您尾号(\d{4})账户.*?完成(.+?)交易人民币(-?\d+\.?\d*)", anchor="交易人民币")
+def _abc_income(m, body, card_suffix):
+    txn_type = m.group(2)
+    # 判断方向：含"向XXX完成"表示为转出
+    if "向" in body and "完成" in body:
+        direction = "支出"
+        detail_type = "transfer_out"
+    else:
+        direction = "收入"
+        detail_type = "salary" if "奖金" in txn_type else "income"
+    return ParsedSMS(
+        amount=abs(float(m.group(3))), direction=direction,
+        card_suffix=m.group(1),
+        merchant=txn_type, counterparty="", bank_name="农业银行",
+        category="收入-工资" if detail_type == "salary" else "未分类-其他",
+        tx_type_detail=detail_type,
+    )
+
+
+# 格式2 + 6：转支 / 支出
+@_ABC_RULES.rule("向他人完成交易", r"您尾号(\d{4})账户.*?向(.+?)完成(.+?)交易人民币(-?\d+\.?\d*)", anchor="交易人民币")
+def _abc_out(m, body, card_suffix):
+    counterparty = _strip_trailing(m.group(2))
+    has_loan_kw = any(kw in counterparty for kw in ("宜享花", "金融", "消金", "美团金融"))
+    return ParsedSMS(
+        amount=abs(float(m.group(4))), direction="支出",
+        card_suffix=m.group(1),
+        merchant=m.group(3), counterparty=counterparty,
+        bank_name="农业银行",
+        is_loan=has_loan_kw,
+        category="借贷-还款" if has_loan_kw else "未分类-其他",
+        tx_type_detail="loan_repayment" if has_loan_kw else "transfer_out",
+    )
+
+
 # ══════════════════════════════════════════
 #  广发银行 (106980095508 / 95508)
 # ══════════════════════════════════════════
@@ -803,32 +957,36 @@ def _parse_cgb(body: str, number: str) -> Optional[ParsedSMS]:
                          merchant="", counterparty="", bank_name="广发银行",
                          _skip=True)
 
-    # --- 格式1：还款入账 ---
-    m_repay = re.search(r"您尾号(\d{4})信用卡.*?还款人民币(\d+\.?\d*)元", body)
-    if m_repay:
-        return ParsedSMS(
-            amount=float(m_repay.group(2)), direction="收入",
-            card_suffix=m_repay.group(1),
-            merchant="信用卡还款入账", counterparty="", bank_name="广发银行",
-            tx_type_detail="repayment_in",
-        )
+    return _CGB_RULES.apply(body)
 
-    # --- 格式2+3：消费 ---
-    m_consume = re.search(r"您尾号(\d{4})(?:广发卡|信用卡).*?消费人民币(\d+\.?\d*)元", body)
-    if m_consume:
-        merchant = ""
-        m_merchant = re.search(r"交易商户[：:](.+?)$", body)
-        if m_merchant:
-            merchant = _strip_trailing(m_merchant.group(1))
-        return ParsedSMS(
-            amount=float(m_consume.group(2)), direction="支出",
-            card_suffix=m_consume.group(1),
-            merchant=merchant or "广发卡消费",
-            counterparty=merchant or "", bank_name="广发银行",
-            category="未分类-其他", tx_type_detail="consumption",
-        )
+_CGB_RULES = RuleTable("广发银行")
 
-    return None
+
+# 格式1：还款入账
+@_CGB_RULES.rule("还款入账", r"您尾号(\d{4})信用卡.*?还款人民币(\d+\.?\d*)元", anchor="还款人民币")
+def _cgb_repay(m, body, card_suffix):
+    return ParsedSMS(
+        amount=float(m.group(2)), direction="收入",
+        card_suffix=m.group(1),
+        merchant="信用卡还款入账", counterparty="", bank_name="广发银行",
+        tx_type_detail="repayment_in",
+    )
+
+
+# 格式2+3：消费
+@_CGB_RULES.rule("消费", r"您尾号(\d{4})(?:广发卡|信用卡).*?消费人民币(\d+\.?\d*)元", anchor="消费人民币")
+def _cgb_consume(m, body, card_suffix):
+    merchant = ""
+    m_merchant = re.search(r"交易商户[：:](.+?)$", body)
+    if m_merchant:
+        merchant = _strip_trailing(m_merchant.group(1))
+    return ParsedSMS(
+        amount=float(m.group(2)), direction="支出",
+        card_suffix=m.group(1),
+        merchant=merchant or "广发卡消费",
+        counterparty=merchant or "", bank_name="广发银行",
+        category="未分类-其他", tx_type_detail="consumption",
+    )
 
 
 # ── 956098? No, 106980095508 also comes from 广发 but different prefix ---
@@ -864,28 +1022,32 @@ def _parse_ceb(body: str, number: str) -> Optional[ParsedSMS]:
                          merchant="", counterparty="", bank_name="光大银行",
                          _skip=True)
 
-    # 格式1：境外网上支付
-    m_foreign = re.search(r"您尾号(\d{4})[^\d]*在(.+?)境外网上支付交易(\d+\.?\d*)(?:美元|港币)", body)
-    if m_foreign:
-        return ParsedSMS(
-            amount=float(m_foreign.group(3)), direction="支出",
-            card_suffix=m_foreign.group(1),
-            merchant=_strip_trailing(m_foreign.group(2)),
-            counterparty="", bank_name="光大银行",
-            tx_type_detail="consumption",
-        )
+    return _CEB_RULES.apply(body)
 
-    # 格式2：消费
-    m_consume = re.search(r"您光大尾号(\d{4})的卡于.*?消费(\d+)元", body)
-    if m_consume:
-        return ParsedSMS(
-            amount=float(m_consume.group(2)), direction="支出",
-            card_suffix=m_consume.group(1),
-            merchant="光大信用卡消费", counterparty="", bank_name="光大银行",
-            tx_type_detail="consumption",
-        )
+_CEB_RULES = RuleTable("光大银行")
 
-    return None
+
+# 格式1：境外网上支付
+@_CEB_RULES.rule("境外网上支付", r"您尾号(\d{4})[^\d]*在(.+?)境外网上支付交易(\d+\.?\d*)(?:美元|港币)", anchor="境外网上支付交易")
+def _ceb_foreign(m, body, card_suffix):
+    return ParsedSMS(
+        amount=float(m.group(3)), direction="支出",
+        card_suffix=m.group(1),
+        merchant=_strip_trailing(m.group(2)),
+        counterparty="", bank_name="光大银行",
+        tx_type_detail="consumption",
+    )
+
+
+# 格式2：消费
+@_CEB_RULES.rule("消费", r"您光大尾号(\d{4})的卡于.*?消费(\d+)元", anchor="您光大尾号")
+def _ceb_consume(m, body, card_suffix):
+    return ParsedSMS(
+        amount=float(m.group(2)), direction="支出",
+        card_suffix=m.group(1),
+        merchant="光大信用卡消费", counterparty="", bank_name="光大银行",
+        tx_type_detail="consumption",
+    )
 
 
 # ══════════════════════════════════════════
@@ -957,35 +1119,47 @@ def dispatch(number: str, body: str, received: str = "") -> Optional[ParsedSMS]:
     返回：
         ParsedSMS | None（无法解析时）
     """
-    for prefix, parser in _PARSERS:
-        if not prefix:
-            continue  # skip fallback in first pass
-        if number.startswith(prefix):
-            try:
-                result = parser(body, number)
-                if result is not None:
-                    result.tx_time = received
-                    result.source_text = body[:120]
-                    return result
-            except Exception as e:
-                logger.warning(f"[{prefix}] 解析失败: {e}")
-                continue
+    for prefix, parser in _route(number):
+        try:
+            result = parser(body, number)
+            if result is not None:
+                result.tx_time = received
+                result.source_text = body[:120]
+                return result
+        except Exception as e:
+            logger.warning(f"[{prefix}] 解析失败: {e}")
+            continue
 
     # 所有注册 parser 都不匹配，尝试 fallback
-    for prefix, parser in _PARSERS:
-        if not prefix:
-            try:
-                result = parser(body, number)
-                if result is not None:
-                    result.tx_time = received
-                    result.source_text = body[:120]
-                    return result
-            except Exception:
-                pass
+    for parser in _FALLBACKS:
+        try:
+            result = parser(body, number)
+            if result is not None:
+                result.tx_time = received
+                result.source_text = body[:120]
+                return result
+        except Exception:
+            pass
 
     return None
 
 
+def dispatch_batch(items) -> list:
+    """批量分派，结果与输入一一对应、顺序一致。
+
+    items 中每项为 (number, body, received) 元组，或含 number/body/received 键的 dict。
+    同一号码的前缀路由只算一次（_route 缓存），适合整月短信一次性解析。
+    """
+    results = []
+    for item in items:
+        if isinstance(item, dict):
+            number, body, received = item.get("number", ""), item.get("body", ""), item.get("received", "")
+        else:
+            number, body, received = item
+        results.append(dispatch(number or "", body or "", received or ""))
+    return results
+
+
 def parse_to_dict(result: ParsedSMS) -> dict:
     """将 ParsedSMS 转为 sms_finance 兼容的 dict 格式。"""
     if result is None:
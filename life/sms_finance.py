@@ -33,7 +33,8 @@ import argparse
 import logging
 import re
 import sys
-from collections import defaultdict
+from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime, timedelta
 from pathlib import Path
 
@@ -46,8 +47,12 @@ with pathmagic.context():
         get_bank_short_codes, get_bank_number_prefixes,
         get_loan_platforms,
         get_loan_disbursement_keywords, get_loan_repayment_keywords,
+        export_config, install_config,
+    )
+    from life.ledger.fetchcache import MonthCache
+    from life.sms_bank_parsers import (
+        dispatch as bank_parser_dispatch, parse_to_dict, rule_hits, merge_rule_hits,
     )
-    from life.sms_bank_parsers import dispatch as bank_parser_dispatch, parse_to_dict
 
 log = logging.getLogger("sms_finance")
 
@@ -338,24 +343,6 @@ def _parse_record(msg: dict) -> dict:
 # ── API 加载 ──
 
 
-def _fetch_sms_api(date_from: str, date_to: str) -> list:
-    """通过 Message API 获取短信数据。"""
-    import urllib.request, json, ssl
-
-    url = f"{SMS_API_URL}?date_from={date_from}&date_to={date_to}&limit=50000"
-    ctx = ssl.create_default_context()
-    ctx.check_hostname = False
-    ctx.verify_mode = ssl.CERT_NONE
-
-    try:
-        resp = urllib.request.urlopen(url, timeout=30, context=ctx)
-        data = json.loads(resp.read().decode())
-        return data.get("records", [])
-    except Exception as e:
-        log.warning(f"SMS API 调用失败: {e}")
-        return []
-
-
 def _fetch_wechat_api(account: str, date_from: str, date_to: str) -> list:
     """通过 Message API 获取微信聊天记录。"""
     import urllib.request, json, ssl
@@ -378,18 +365,74 @@ def _fetch_wechat_api(account: str, date_from: str, date_to: str) -> list:
 # ── 解析入口 ──
 
 
-def parse_sms_records(sms_list: list) -> list:
-    """解析短信列表为财务记录。"""
-    records = []
-    for msg in sms_list:
+_CHUNK_ERROR_SAMPLES = 3  # 每批错误报告里附带的样例条数
+
+
+def _parse_chunk(chunk: list, start: int = 0) -> tuple:
+    """解析一批短信，返回 (records, errors, hits)。
+
+    errors 为 [(全局序号, number, 异常描述)]，由调用方按批汇总上报；
+    hits 为本批新增的模板命中次数，进程池模式下回传父进程累加。
+    """
+    before = Counter(rule_hits())
+    records, errors = [], []
+    for offset, msg in enumerate(chunk):
         try:
             rec = _parse_record(msg)
             if rec["amount"] <= 0:
                 continue
             records.append(rec)
         except Exception as e:
-            log.warning(f"解析短信失败: {e}")
-            continue
+            number = msg.get("number", "") if isinstance(msg, dict) else ""
+            errors.append((start + offset, str(number), f"{type(e).__name__}: {e}"))
+    hits = Counter(rule_hits())
+    hits.subtract(before)
+    return records, errors, {k: v for k, v in hits.items() if v > 0}
+
+
+def _parse_chunk_star(args: tuple) -> tuple:
+    return _parse_chunk(*args)
+
+
+def _report_chunk_errors(k: int, start: int, size: int, errors: list):
+    """每批一条汇总日志，代替逐条 warning。"""
+    if not errors:
+        return
+    samples = "；".join(f"#{i} {number} {err}" for i, number, err in errors[:_CHUNK_ERROR_SAMPLES])
+    log.warning(f"第{k + 1}批短信 [{start}, {start + size}) 解析失败 {len(errors)} 条，例：{samples}")
+
+
+def parse_sms_records(sms_list: list, workers: int = 1, chunksize: int = 5000) -> list:
+    """解析短信列表为财务记录。
+
+    按 chunksize 分批解析，每批解析失败的短信汇总成一条日志。
+    workers > 1 且多于一批时交给进程池：各 worker 以父进程已加载的云端配置快照初始化（不再各自读云端），
+    结果按批次顺序拼接后再按时间稳定排序，输出与串行完全一致；
+    无法创建进程池（如 Termux 缺少 sem_open）时退化为串行。
+    """
+    chunks = [(sms_list[i:i + chunksize], i) for i in range(0, len(sms_list), chunksize)]
+    executor = None
+    if workers > 1 and len(chunks) > 1:
+        try:
+            executor = ProcessPoolExecutor(
+                max_workers=min(workers, len(chunks)),
+                initializer=install_config, initargs=(export_config(),),
+            )
+        except (ImportError, OSError, NotImplementedError) as e:
+            log.warning(f"无法创建进程池，退化为串行解析。{e}")
+            executor = None
+    if executor is not None:
+        with executor:
+            parts = list(executor.map(_parse_chunk_star, chunks))
+        for _, _, hits in parts:
+            merge_rule_hits(hits)
+    else:
+        parts = [_parse_chunk(chunk, start) for chunk, start in chunks]
+
+    records = []
+    for k, ((chunk, start), (part, errors, _)) in enumerate(zip(chunks, parts)):
+        _report_chunk_errors(k, start, len(chunk), errors)
+        records.extend(part)
     records.sort(key=lambda r: r.get("time") or "")
     return records
 
@@ -616,7 +659,7 @@ def generate_combined_report(
 def _load_wechat_records(account: str, year: int, month: int) -> list:
     """通过 API 加载微信端财务记录。"""
     try:
-        from life.wechat_finance import parse_finance_messages, classify_merchant, load_category_map
+        from life.wechat_finance import parse_finance_messages, MerchantClassifier, load_category_map
     except ImportError:
         log.warning("无法导入 wechat_finance")
         return []
@@ -630,10 +673,10 @@ def _load_wechat_records(account: str, year: int, month: int) -> list:
         return []
 
     records = parse_finance_messages(msgs)
-    cat_map = load_category_map()
+    classifier = MerchantClassifier(load_category_map())
     for r in records:
         if r.get("category", "") == "未分类-其他":
-            r["category"] = classify_merchant(r["merchant"], cat_map)
+            r["category"] = classifier.classify(r["merchant"])
         r["is_loan"] = False
 
     log.info(f"微信端: {len(msgs)}条消息 → {len(records)}条财务记录")
@@ -646,10 +689,11 @@ def process_sms_month(
     account: str = "白晔峰",
 ) -> str:
     """处理指定月份的短信数据。"""
-    date_from = f"{year}-{month:02d}-01"
-    date_to = f"{year}-{month+1:02d}-01" if month < 12 else f"{year+1}-01-01"
-
-    sms_list = _fetch_sms_api(date_from, date_to)
+    # 已封月的短信读本地缓存，当月才访问 API
+    try:
+        sms_list = MonthCache().sms_month(year, month)
+    except Exception as e:
+        return f"# SMS 月报 — {year}年{month}月\n\n短信获取失败：{e}\n"
     if not sms_list:
         return f"# SMS 月报 — {year}年{month}月\n\n该月无短信记录。\n"
 
@@ -16,20 +16,25 @@
 
 # %% [markdown]
 # - 文本文件：跑程序生成的txt存储的记录原始文件
-# - 资源文件：提取并排序后按月拆分的记录存储文件，excel表格
+# - 资源文件：提取并排序后按月拆分的记录存储分片，xlsx或parquet/feather（见wcshard）
 # - 笔记：记录了分月统计和更新信息的云端笔记，附件为相应的资源文件
 
 # %% [markdown]
 # ## 库导入
 
 # %%
+import mmap
 import os
 import re
 import sqlite3 as lite
+import threading
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
 from datetime import datetime
 from pathlib import Path
+from typing import Iterator
 
 # import arrow
+import numpy as np
 import pandas as pd
 
 # import xlsxwriter
@@ -52,46 +57,174 @@ with pathmagic.context():
         searchnotes,
         updatenote_body,
     )
-    from func.litetools import ifnotcreate
     from func.logme import log
     from func.sysfunc import execcmd, not_IPython
     from func.wrapfuncs import timethis
+    from life.wcshard import (
+        MonthShardStore,
+        diff_days,
+        format_day_digests,
+        get_shard_store,
+        items_digest,
+        parse_day_digests,
+        shard_title,
+    )
 
 
 # %% [markdown]
 # ## 功能函数集
 
 # %% [markdown]
-# ### items_to_df(fl: Path) -> pd.DataFrame
+# ### iter_item_batches(fl: Path, start: int = 0, batchsize: int = 20000, hold_tail: bool = False) -> Iterator
+
+
+# %%
+# 记录头（时间戳+发送标记+发送者+类型），在内存映射的字节流上直接扫描
+# 类型字段在字节模式下放宽匹配，解码后再用 \w+ 校验，保持与原文本正则等价
+ptn_item_head = re.compile(rb"^(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2})\t(True|False)\t([^\t]+)\t([^\t\r\n]+)\t", re.M)
+ptn_item_type = re.compile(r"\w+")
+
+
+def iter_item_batches(
+    fl: Path, start: int = 0, batchsize: int = 20000, hold_tail: bool = False
+) -> Iterator[tuple[list, int]]:
+    """以内存映射方式流式读取txt记录文件，从字节偏移start开始分批产出记录
+
+    每批产出(records, offset)，records为[time, send, sender, type, content]字符串列表，
+    offset为已完整解析部分的结束字节位置，可直接作为下次运行的检查点。
+    hold_tail为真（增量解析）且文件末尾不以换行结束时，最后一条记录视为尚在写入，
+    不产出且检查点停在其记录头处；全量解析照常产出最后一条记录。
+
+    Args:
+        fl: txt记录文件
+        start: 起始字节偏移
+        batchsize: 每批记录数量
+        hold_tail: 是否扣下末尾未以换行结束的记录，留待下次增量解析
+
+    Yields:
+        tuple[list, int]: (记录列表, 检查点偏移)
+    """
+    with open(fl, "rb") as fh:
+        size = os.fstat(fh.fileno()).st_size
+        if size <= start:
+            return
+        with mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            complete = mm[size - 1 : size] == b"\n"
+            batch = list()
+            head = None
+            for m in ptn_item_head.finditer(mm, start):
+                itemtype = m.group(4).decode("utf-8", errors="replace")
+                if not ptn_item_type.fullmatch(itemtype):
+                    # 消息正文里恰好出现形似记录头的行，归入上一条正文
+                    continue
+                if head is not None:
+                    content = mm[head.end() : m.start()].decode("utf-8", errors="replace").strip()
+                    batch.append(head_fields(head) + [content])
+                    if len(batch) >= batchsize:
+                        yield batch, m.start()
+                        batch = list()
+                head = m
+            if head is None:
+                return
+            if complete or not hold_tail:
+                content = mm[head.end() : size].decode("utf-8", errors="replace").strip()
+                batch.append(head_fields(head) + [content])
+                yield batch, size
+            else:
+                yield batch, head.start()
+
+
+def head_fields(m: re.Match) -> list:
+    """把字节记录头匹配结果解码为[time, send, sender, type]列表"""
+    return [g.decode("utf-8", errors="replace") for g in m.groups()]
+
+
+# %% [markdown]
+# ### records_to_df(records: list) -> pd.DataFrame
+
+
+# %%
+def records_to_df(records: list) -> pd.DataFrame:
+    """把[time, send, sender, type, content]记录列表格式化为DataFrame，正文清理全部向量化处理"""
+    df2 = pd.DataFrame(records, columns=["time", "send", "sender", "type", "content"])
+    df2["send"] = df2["send"] == "True"
+    df2["time"] = pd.to_datetime(df2["time"])
+    df2["content"] = df2["content"].str.replace(r"(\[\w+前\]|\[刚才\])?", "", regex=True)
+    # 处理成相对路径，逻辑是准备把所有音频等文件集中到主运行环境
+    df2["content"] = df2["content"].str.replace(r"^/.+happyjoplin/", "", regex=True)
+
+    return df2
+
+
+# %% [markdown]
+# ### get_txt_checkpoint(fl: Path) -> int
+
+
+# %%
+def get_txt_checkpoint(fl: Path) -> int:
+    """读取txt记录文件在ini中登记的解析检查点，文件被轮转（inode变化）或截短时返回0"""
+    try:
+        stat = os.stat(fl)
+    except OSError:
+        return 0
+    offset = getcfpoptionvalue("happyjpwcitems", fl.name, "txtoffset")
+    inode = getcfpoptionvalue("happyjpwcitems", fl.name, "txtinode")
+    if offset is None or inode is None:
+        return 0
+    if int(inode) != stat.st_ino or int(offset) > stat.st_size:
+        log.info(f"记录文件《{fl.name}》已被轮转或截短（inode：{inode}->{stat.st_ino}），从头解析")
+        return 0
+
+    return int(offset)
+
+
+# %% [markdown]
+# ### set_txt_checkpoint(fl: Path, offset: int) -> None
+
+
+# %%
+def set_txt_checkpoint(fl: Path, offset: int) -> None:
+    """在ini中登记txt记录文件的解析检查点（字节偏移和inode）"""
+    setcfpoptionvalue("happyjpwcitems", fl.name, "txtoffset", str(offset))
+    setcfpoptionvalue("happyjpwcitems", fl.name, "txtinode", str(os.stat(fl).st_ino))
+
+
+# %% [markdown]
+# ### items_to_df(fl: Path, start: int = 0, checkpoints: dict = None, incremental: bool = False) -> pd.DataFrame
 
 
 # %%
-def items_to_df(fl: Path) -> pd.DataFrame:
-    """读取txt记录文件，格式化拆分并存储至DataFrame返回"""
+def items_to_df(fl: Path, start: int = 0, checkpoints: dict = None, incremental: bool = False) -> pd.DataFrame:
+    """流式读取txt记录文件（从字节偏移start开始），格式化拆分并存储至DataFrame返回
+
+    Args:
+        fl: txt记录文件
+        start: 起始字节偏移，增量解析时传入上次的检查点
+        checkpoints: 若传入字典，则把本次解析结束的偏移登记进去（key为文件路径），由调用方在数据落地后提交
+        incremental: 增量解析时末尾尚未写完（不以换行结束）的记录留待下次，全量解析则一并读入
+
+    Returns:
+        pd.DataFrame: 去重并按时间排序的记录
+    """
+    dflst = list()
+    offset = start
     try:
-        content = open(fl, "r").read()
+        for records, offset in iter_item_batches(fl, start=start, hold_tail=incremental):
+            if records:
+                dflst.append(records_to_df(records))
     except Exception as e:
         log.critical(f"文件{fl}读取时出现错误，返回空的pd.DataFrame.{e}")
         return pd.DataFrame()
+    if checkpoints is not None:
+        checkpoints[fl] = offset
+    if not dflst:
+        return pd.DataFrame(columns=["time", "send", "sender", "type", "content"])
 
-    # 用正则按记录头（时间戳+发送标记+发送者+类型）切分，天然处理多行消息内容中的 \n
-    # 不能用 splitlines() —— 消息正文含换行时会把一条记录拆成多行导致解析崩溃
-    ptn = re.compile(r"(^\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2})\t(True|False)\t([^\t]+)\t(\w+)\t", re.M)
-    itemlst = re.split(ptn, content)
-    itemlst = [im.strip() for im in itemlst if len(im) > 0]
-    step = 5
-    itemlst4pd1 = [itemlst[i : i + step] for i in range(0, len(itemlst), step)]
-    df2 = pd.DataFrame(itemlst4pd1, columns=["time", "send", "sender", "type", "content"])
-    df2["send"] = df2["send"].apply(lambda x: True if x == "True" else False)
-    df2["time"] = pd.to_datetime(df2["time"])
-    df2["content"] = df2["content"].apply(lambda x: re.sub(r"(\[\w+前\]|\[刚才\])?", "", x))
-    # 处理成相对路径，逻辑是准备把所有音频等文件集中到主运行环境
-    ptn = re.compile(r"^/.+happyjoplin/")
-    df2.loc[:, "content"] = df2["content"].apply(lambda x: re.sub(ptn, "", x) if ptn.match(x) else x)
-    df_out = df2.drop_duplicates().sort_values("time")
+    df_out = pd.concat(dflst, ignore_index=True).drop_duplicates().sort_values("time")
 
     return df_out
 
+
 # %% [markdown]
 # ### get_owner_from_filename(fn: str) -> str
 
@@ -119,17 +252,33 @@ def get_owner_from_filename(fn: str) -> str:
 
 
 # %% [markdown]
-# ### txtfiles_to_dfdict(dpath: Path, newfileonly: bool=False) -> dict
+# ### parse_txt_file(fl: Path, start: int=0, incremental: bool=False) -> tuple[pd.DataFrame, int]
+
+
+# %%
+def parse_txt_file(fl: Path, start: int = 0, incremental: bool = False) -> tuple[pd.DataFrame, int]:
+    """解析单个txt记录文件，返回(记录df, 解析结束的字节偏移)，供进程池调用"""
+    checkpoints = dict()
+    df = items_to_df(fl, start=start, checkpoints=checkpoints, incremental=incremental)
+
+    return df, checkpoints.get(fl, start)
+
+
+# %% [markdown]
+# ### txtfiles_to_dfdict(dpath: Path, newfileonly: bool=False, checkpoints: dict=None, workers: int=1) -> dict
 
 
 # %%
 @timethis
-def txtfiles_to_dfdict(dpath: Path, newfileonly: bool = False) -> dict:
+def txtfiles_to_dfdict(dpath: Path, newfileonly: bool = False, checkpoints: dict = None, workers: int = 1) -> dict:
     """读取传入目录下符合标准（固定格式文件名）的文本文件并提取融合分账号的df，
 
     Args:
         dpath: 文本文件所在目录
         newfileonly: 是否只处理最新两个文本文件，默认为False
+        checkpoints: 传入字典时为增量模式，每个文件只解析上次检查点之后追加的字节，
+            并把新的检查点登记进该字典，待数据落地后由set_txt_checkpoint提交
+        workers: 解析文本文件的进程数，各文件并行解析后仍按原顺序融合
 
     Returns:
         dfdict: 字典，key为账号名，value为DataFrame，包含该账号的所有聊天记录
@@ -146,14 +295,22 @@ def txtfiles_to_dfdict(dpath: Path, newfileonly: bool = False) -> dict:
             fllstout.extend(fllstout4name[-2:])
         file_list = [item[1] for item in fllstout]
 
+    file_list = file_list[::-1]
+    for file_path in [fp for fp in file_list if re.search(r"\((\w*)\)", fp) is None]:
+        log.critical(f"记录文件《{file_path}》的文件名不符合规范，跳过")
+    file_list = [fp for fp in file_list if re.search(r"\((\w*)\)", fp) is not None]
+    startlst = [0 if checkpoints is None else get_txt_checkpoint(dpath / fp) for fp in file_list]
+    incremental = checkpoints is not None
+    parsed = pool_map(
+        parse_txt_file, [(dpath / fp, start, incremental) for fp, start in zip(file_list, startlst)], workers
+    )
+
     dfdict = dict()
-    for file_path in file_list[::-1]:
-        rs1 = re.search(r"\((\w*)\)", file_path)
-        if rs1 is None:
-            log.critical(f"记录文件《{file_path}》的文件名不符合规范，跳过")
-            continue
+    for file_path, start, (df_in, offset) in zip(file_list, startlst, parsed):
         account = get_owner_from_filename(file_path)
-        df_in = items_to_df(dpath / file_path)
+        if checkpoints is not None:
+            checkpoints[dpath / file_path] = offset
+            log.debug(f"{file_path}\t增量解析自字节偏移{start}至{offset}")
         if account in dfdict.keys():
             df_all = pd.concat([dfdict[account], df_in])
             df_all = df_all.drop_duplicates().sort_values(["time"])
@@ -199,21 +356,32 @@ def get_date_range(start: datetime, end: datetime) -> list:
 
 
 # %% [markdown]
-# ### split_df_to_xlsx(name: str, df: pd.DataFrame, dpath: Path, newfileonly: bool=False) -> None
+# ### split_df_to_xlsx(name: str, df: pd.DataFrame, dpath: Path, newfileonly: bool=False, incremental: bool=False) -> None
 
 
 # %%
-def split_df_to_xlsx(name: str, df: pd.DataFrame, dpath: Path, newfileonly: bool = False) -> None:
-    """按月份拆分指定账号的数据记录df，如果尚不存在本地相应资源文件，直接写入并更新ini中登记数量；如果存在相应本地资源文件，则读取并融合df中的记录，存入对应格式化名称的excel表格中，相应更新ini中登记数量
+def split_df_to_xlsx(
+    name: str,
+    df: pd.DataFrame,
+    dpath: Path,
+    newfileonly: bool = False,
+    incremental: bool = False,
+    store: MonthShardStore = None,
+) -> None:
+    """按月份拆分指定账号的数据记录df，如果尚不存在本地相应资源分片，直接写入并更新ini中登记的内容摘要；如果存在相应本地资源分片且内容摘要有变化，则把df中的记录追加融合进分片，相应更新ini中登记的内容摘要
 
     Args:
         name: 账号名称
         df: 待处理的数据记录df
         dpath: 本地资源文件路径
         newfileonly: 是否只处理最新两个月的数据，默认为False
+        incremental: df是否仅为文本文件新追加的记录，是则总是和本地资源文件融合，不比对内容摘要
+        store: 分片存储后端，默认按云端配置获取
     Returns:
         None
     """
+    if store is None:
+        store = get_shard_store(dpath)
     try:
         dftimestart = df["time"].min()
         dftimeend = df["time"].max()
@@ -225,36 +393,35 @@ def split_df_to_xlsx(name: str, df: pd.DataFrame, dpath: Path, newfileonly: bool
         for i in range(len(dr) - 1):
             log.info(f"{'-' * 15}\t{name}\t【{i + 1}/{len(dr) - 1}】\tBegin\t{'-' * 15}")
             log.info(f"宣称的处理时间范围：{dr[i]} - {dr[i + 1]}")
-            dfp = df[(df.time >= dr[i]) & (df.time < dr[i + 1])]
+            # 最后一段的上界是记录的最大时间本身，须包含在内，否则增量解析时末条记录会被跳过
+            upper = (df.time <= dr[i + 1]) if i == len(dr) - 2 else (df.time < dr[i + 1])
+            dfp = df[(df.time >= dr[i]) & upper]
             log.info(f"数据实际时间跨度范围：{dfp.time.min()} - {dfp.time.max()}，共{len(dfp)}条记录")
             if not dfp.empty:
                 ny = dfp["time"].iloc[0].strftime("%y%m")
-                fn = f"wcitems_{name}_{ny}.xlsx"  # 纯文件名称
-                fn_all = touchfilepath2depth(dpath / fn)
-                fna = os.path.abspath(fn_all)  # 全路径文件名（绝对路径）
+                fn = shard_title(name, ny)  # 分片逻辑名称
+                touchfilepath2depth(dpath / fn)
 
-                if not os.path.exists(fna):
-                    logstr = f"创建文件{fn}，记录共有{len(dfp)}条。"
+                if not store.exists(name, ny):
+                    logstr = f"创建分片{fn}，记录共有{len(dfp)}条。"
                     log.info(logstr)
-                    dfp.to_excel(fna, engine="xlsxwriter", index=False)
-                    setcfpoptionvalue("happyjpwcitems", fn, "itemsnumfromtxt", str(len(dfp)))
+                    store.write(name, ny, dfp)
+                    setcfpoptionvalue("happyjpwcitems", fn, "digestfromtxt", items_digest(dfp)[0])
                 else:
-                    oldnum = getcfpoptionvalue("happyjpwcitems", fn, "itemsnumfromtxt")
-                    if oldnum != len(dfp):
-                        dftmp = pd.read_excel(fna)
-                        dfpall = pd.concat([dfp, dftmp]).drop_duplicates().sort_values(["time"])
-                        # 去除时间范围外的记录
-                        dfpall = dfpall[dfpall.time < dr[i + 1]]
+                    olddigest = getcfpoptionvalue("happyjpwcitems", fn, "digestfromtxt")
+                    newdigest = items_digest(dfp)[0]
+                    if incremental or str(olddigest) != newdigest:
+                        # 分片只按月归属，追加时无需再裁剪时间范围，重复记录由后端去除
                         logstr = (
-                            f"{fn}\t本地（文本文件）登记的记录数量为（{oldnum}），但新文本文件中"
-                            f"记录数量（{len(dfp)}）条记录，"
-                            f"融合本地excel文件后记录数量为({len(dfpall)})。覆盖写入所有新数据！"
+                            f"{fn}\t本地（文本文件）登记的内容摘要为（{olddigest}），但新文本文件中"
+                            f"{len(dfp)}条记录的内容摘要为（{newdigest}），追加融合进本地分片！"
                         )
                         log.info(logstr)
-                        dfpall.to_excel(fna, engine="xlsxwriter", index=False)
-                        setcfpoptionvalue("happyjpwcitems", fn, "itemsnumfromtxt", str(len(dfp)))
+                        store.append(name, ny, dfp)
+                        if not incremental:
+                            setcfpoptionvalue("happyjpwcitems", fn, "digestfromtxt", newdigest)
                     else:
-                        log.debug(f"{fn}已经存在，且文本文件中记录数量没有变化。")
+                        log.debug(f"{fn}已经存在，且文本文件中记录内容没有变化。")
                 log.debug(f"{i} {ny} {dr[i]} {dr[i + 1]} {len(dfp)}")
             log.debug(f"{'-' * 15}\t{name}\t【{i + 1}/{len(dr) - 1}】\tDone!\t{'-' * 15}")
 
@@ -264,66 +431,250 @@ def split_df_to_xlsx(name: str, df: pd.DataFrame, dpath: Path, newfileonly: bool
 
 
 # %% [markdown]
-# ### df_to_db(name: str, df4name: pd.DataFrame, wc_path: Path) -> None
+# ### WcitemsIni
 
 
 # %%
-def df_to_db(name: str, df4name: pd.DataFrame, wc_path: Path) -> None:
-    """把指定微信账号的记录df写入db相应表中"""
+class WcitemsIni:
+    """happyjpwcitems这个ini的读写代理
+
+    direct为True时直接读写；否则写入先缓冲在内存中，由flush按登记顺序落盘，读取时优先读缓冲。
+    并行处理各月时每个月一份缓冲，主线程按月份顺序flush，ini的写入顺序因此与串行时一致。
+    """
+
+    lock = threading.Lock()
+
+    def __init__(self, direct: bool = True) -> None:
+        """创建读写代理，direct为False时启用写入缓冲"""
+        self.direct = direct
+        self.pending = dict()
+
+    def get(self, section: str, option: str):
+        """读取选项，缓冲中有则取缓冲值"""
+        if (section, option) in self.pending:
+            return self.pending[(section, option)]
+        with WcitemsIni.lock:
+            return getcfpoptionvalue("happyjpwcitems", section, option)
+
+    def set(self, section: str, option: str, value: str) -> None:
+        """写入选项，缓冲模式下只记入缓冲"""
+        if self.direct:
+            with WcitemsIni.lock:
+                setcfpoptionvalue("happyjpwcitems", section, option, value)
+        else:
+            self.pending[(section, option)] = value
+
+    def flush(self) -> None:
+        """把缓冲按登记顺序写入ini并清空缓冲"""
+        with WcitemsIni.lock:
+            for (section, option), value in self.pending.items():
+                setcfpoptionvalue("happyjpwcitems", section, option, value)
+        self.pending.clear()
+
+
+# %% [markdown]
+# ### pool_map(func, argslist: list, workers: int, kind: str="process") -> list
+
+
+# %%
+def pool_map(func, argslist: list, workers: int, kind: str = "process") -> list:
+    """用进程池（kind="process"）或线程池（kind="thread"）并行执行func(*args)，结果按argslist的顺序返回
+
+    workers不大于1、任务不足两个或者无法创建进程池（例如Termux下缺少sem_open）时退化为串行执行。
+    """
+    if workers <= 1 or len(argslist) <= 1:
+        return [func(*args) for args in argslist]
+    executor_cls = ProcessPoolExecutor if kind == "process" else ThreadPoolExecutor
+    try:
+        executor = executor_cls(max_workers=min(workers, len(argslist)))
+    except (ImportError, OSError, NotImplementedError) as e:
+        log.warning(f"无法创建{kind}池，退化为串行执行。{e}")
+        return [func(*args) for args in argslist]
+    with executor:
+        return list(executor.map(func, *zip(*argslist)))
+
+
+# %% [markdown]
+# ### get_workers(option: str, default: int) -> int
+
+
+# %%
+def get_workers(option: str, default: int) -> int:
+    """从云端配置wcitems节读取并行度，未配置时用default"""
+    if (workers := getinivaluefromcloud("wcitems", option)) is None:
+        workers = default
+    return max(1, int(workers))
+
+
+# %% [markdown]
+# ### ensure_wcitems_table(conn: lite.Connection, tablename: str) -> None
+
+
+# %%
+def ensure_wcitems_table(conn: lite.Connection, tablename: str) -> None:
+    """确保记录表存在并带有自然键
+
+    自然键为(epoch, sender, type, chash)：epoch是记录时间（本地时间按UTC折算）的秒数，chash是正文的64位哈希。
+    旧表补列、回填、去重后建唯一索引，索引以epoch打头，按时间范围查询也走索引。
+    唯一索引在迁移的最后一步创建，已存在即说明迁移完成，直接返回，日常写入不再扫表。
+    """
+    if conn.execute(
+        "select 1 from sqlite_master where type = 'index' and name = ?", (f"ux_{tablename}_key",)
+    ).fetchone():
+        return
+    conn.execute(
+        f"create table if not exists {tablename} "
+        "(id INTEGER PRIMARY KEY AUTOINCREMENT, time DATETIME, send BOOLEAN, sender TEXT, type TEXT, content TEXT, "
+        "epoch INTEGER, chash INTEGER)"
+    )
+    cols = [row[1] for row in conn.execute(f"pragma table_info({tablename})")]
+    for col in ("epoch", "chash"):
+        if col not in cols:
+            conn.execute(f"alter table {tablename} add column {col} INTEGER")
+    # 早年的数据time存的是unix时间戳，后来是文本，两种都折算成本地时间的秒数
+    conn.execute(
+        f"update {tablename} set epoch = case when typeof(time) in ('integer', 'real') "
+        "then cast(strftime('%s', datetime(time, 'unixepoch', 'localtime')) as integer) "
+        "else cast(strftime('%s', time) as integer) end where epoch is null"
+    )
+    dfhash = pd.read_sql(f"select id, content from {tablename} where chash is null", conn)
+    if not dfhash.empty:
+        dfhash["chash"] = content_hash(dfhash["content"])
+        conn.executemany(
+            f"update {tablename} set chash = ? where id = ?",
+            zip(dfhash["chash"].tolist(), dfhash["id"].tolist()),
+        )
+        cursor = conn.execute(
+            f"delete from {tablename} where id not in "
+            f"(select min(id) from {tablename} group by epoch, sender, type, chash)"
+        )
+        log.info(f"表《{tablename}》回填{dfhash.shape[0]}条记录的自然键，去除重复记录{cursor.rowcount}条")
+    conn.execute(f"create unique index if not exists ux_{tablename}_key on {tablename} (epoch, sender, type, chash)")
+    conn.commit()
+
+
+# %% [markdown]
+# ### content_hash(content: pd.Series) -> np.ndarray
+
+
+# %%
+def content_hash(content: pd.Series) -> np.ndarray:
+    """正文的64位哈希（有符号，可直接存入sqlite的INTEGER列）"""
+    return pd.util.hash_pandas_object(content.fillna("").astype(str), index=False).values.view("int64")
+
+
+# %% [markdown]
+# ### items_to_rows(df: pd.DataFrame) -> pd.DataFrame
+
+
+# %%
+def items_to_rows(df: pd.DataFrame) -> pd.DataFrame:
+    """把记录df转换为记录表的行格式，补上自然键列epoch和chash"""
+    rows = pd.DataFrame(
+        {
+            "time": df["time"].dt.strftime("%F %T"),
+            "send": df["send"].astype(bool).astype(int),
+            "sender": df["sender"].fillna("").astype(str),
+            "type": df["type"].fillna("").astype(str),
+            "content": df["content"].where(df["content"].notna(), None),
+            "epoch": (df["time"] - pd.Timestamp("1970-01-01")) // pd.Timedelta(seconds=1),
+            "chash": content_hash(df["content"]),
+        }
+    )
+
+    return rows.drop_duplicates(subset=["epoch", "sender", "type", "chash"])
+
+
+# %% [markdown]
+# ### df_to_db(name: str, df4name: pd.DataFrame, wc_path: Path, ini: WcitemsIni=None) -> None
+
+
+# %%
+# 并行处理各月时，对同一个db文件的写事务串行进行
+wcdb_lock = threading.Lock()
+
+
+def df_to_db(name: str, df4name: pd.DataFrame, wc_path: Path, ini: WcitemsIni = None) -> None:
+    """把指定微信账号的记录df写入db相应表中，内容摘要和ini中登记的相同则跳过
+
+    按自然键增量写入：只删除时间范围内已不存在的记录，只插入新增的记录（ON CONFLICT DO NOTHING），全部在一个事务里完成。
+    """
+    if ini is None:
+        ini = WcitemsIni()
     ny = df4name["time"].iloc[0].strftime("%y%m")
-    xlsx_name = f"wcitems_{name}_{ny}.xlsx"
-    if (itemsnum_db := getcfpoptionvalue("happyjpwcitems", xlsx_name, "itemsnum_db")) is None:
-        itemsnum_db = 0
+    xlsx_name = shard_title(name, ny)
+    digest_db = ini.get(xlsx_name, "digest_db")
     itemnum = df4name.shape[0]
-    if itemnum != itemsnum_db:
-        df4name = df4name.sort_values("time")
-        starttime = df4name["time"].min().strftime("%F %T")
-        endtime = df4name["time"].max().strftime("%F %T")
-        loginstr = "" if (whoami := execcmd("whoami")) and (len(whoami) == 0) else f"{whoami}"
-        dbfilename = f"wcitemsall_({getdevicename()})_({loginstr}).db".replace(" ", "_")
-        dbname = str((wc_path / dbfilename).resolve())
-        with lite.connect(dbname) as conn:
-            tablename = f"wc_{name}"
-            csql = (
-                f"create table if not exists {tablename} "
-                + "(id INTEGER PRIMARY KEY AUTOINCREMENT, time DATETIME, send BOOLEAN, sender TEXT, type TEXT, content TEXT)"
-            )
-            ifnotcreate(tablename, csql, dbname)
-            cursor = conn.cursor()
-            sql = f"select * from {tablename} where datetime(time, 'unixepoch', 'localtime') between '{starttime}' and '{endtime}';"
-            tb = cursor.execute(sql).fetchall()
-            if len(tb) != itemnum:
-                sqldel = f"delete from {tablename} where datetime(time, 'unixepoch', 'localtime') between '{starttime}' and '{endtime}';"
-                cursor.execute(sqldel)
-                df4name.to_sql(tablename, conn, if_exists="append", index=False)
-                conn.commit()
-                if cursor.rowcount != 0:
-                    log.info(f"SQL: {sqldel}")
-                    log.info(f"从数据库文件《{dbname}》的表《{tablename}》中删除{cursor.rowcount}条记录")
-                setcfpoptionvalue("happyjpwcitems", xlsx_name, "itemsnum_db", str(itemnum))
-                log.info(
-                    f"{xlsx_name}的数据写入数据库文件（{dbname}）的（{tablename}）表中，并在ini登记数量（{itemnum}）"
-                )
+    digest = items_digest(df4name)[0]
+    if str(digest_db) == digest:
+        return
+
+    loginstr = "" if (whoami := execcmd("whoami")) and (len(whoami) == 0) else f"{whoami}"
+    dbfilename = f"wcitemsall_({getdevicename()})_({loginstr}).db".replace(" ", "_")
+    dbname = str((wc_path / dbfilename).resolve())
+    keycols = ["epoch", "sender", "type", "chash"]
+    rows = items_to_rows(df4name)
+    with wcdb_lock, lite.connect(dbname) as conn:
+        tablename = f"wc_{name}"
+        ensure_wcitems_table(conn, tablename)
+        dfexist = pd.read_sql(
+            f"select id, epoch, sender, type, chash from {tablename} where epoch between ? and ?",
+            conn,
+            params=(int(rows["epoch"].min()), int(rows["epoch"].max())),
+        )
+        dfexist["sender"] = dfexist["sender"].fillna("")
+        dfexist["type"] = dfexist["type"].fillna("")
+        dfmerge = dfexist.merge(rows, on=keycols, how="outer", indicator=True)
+        staleids = dfmerge.loc[dfmerge["_merge"] == "left_only", "id"].astype(int).tolist()
+        dfnew = rows.merge(dfexist[keycols], on=keycols, how="left", indicator=True)
+        dfnew = dfnew.loc[dfnew["_merge"] == "left_only", rows.columns]
+        conn.executemany(f"delete from {tablename} where id = ?", [(i,) for i in staleids])
+        conn.executemany(
+            f"insert into {tablename} (time, send, sender, type, content, epoch, chash) "
+            f"values (?, ?, ?, ?, ?, ?, ?) on conflict({', '.join(keycols)}) do nothing",
+            dfnew.astype(object).itertuples(index=False, name=None),
+        )
+        conn.commit()
+    ini.set(xlsx_name, "digest_db", digest)
+    log.info(
+        f"{xlsx_name}的数据（{itemnum}条）写入数据库文件（{dbname}）的（{tablename}）表中，"
+        f"删除{len(staleids)}条、新增{dfnew.shape[0]}条，并在ini登记内容摘要（{digest}）"
+    )
 
 
 # %% [markdown]
-# ### update_wcitems_to_note(name: str, df4name: pd.DataFrame, wc_path: Path, notebook_id: str) -> None
+# ### update_wcitems_to_note(name: str, df4name: pd.DataFrame, wc_path: Path, notebook_id: str, store: MonthShardStore=None, ini: WcitemsIni=None, serializer: Executor=None) -> None
 
 
 # %%
-def update_wcitems_to_note(name: str, df4name: pd.DataFrame, wc_path: Path, notebook_id: str) -> None:
-    """处理从本地资源文件读取生成的df，如果和ini登记数量相同，则返回；如果不同，则从笔记端读取相应登记数量再次对比，相同，则跳过，如果不同，则拉取笔记资源文件和本地资源文件融合，更新笔记端资源文件并更新ini登记数量（用融合后的记录数量）"""
+def update_wcitems_to_note(
+    name: str,
+    df4name: pd.DataFrame,
+    wc_path: Path,
+    notebook_id: str,
+    store: MonthShardStore = None,
+    ini: WcitemsIni = None,
+    serializer: Executor = None,
+) -> None:
+    """把本地资源分片读取生成的df融合进笔记端资源文件
+
+    如果内容摘要和ini登记的相同，则返回；如果不同，则读取笔记头登记的摘要再次对比，相同，则跳过；
+    如果不同，则比对日摘要，只有笔记中存在本地未涵盖的日期时才拉取笔记资源文件和本地资源分片融合，然后更新笔记端资源文件和摘要并更新ini登记
+
+    ini为ini读写代理，并行时传入缓冲模式的实例；serializer为执行xlsx导出的进程池，默认在当前线程导出。
+    """
+    if store is None:
+        store = get_shard_store(wc_path)
+    if ini is None:
+        ini = WcitemsIni()
     forcerefresh = getinivaluefromcloud("wcitems", "forcerefresh")
     ny = df4name["time"].iloc[0].strftime("%y%m")
-    xlsx_name = f"wcitems_{name}_{ny}.xlsx"
-    xlsx_path = wc_path / xlsx_name
-    xlsx_abs_path = os.path.abspath(xlsx_path)
-    log.debug(xlsx_abs_path)
+    xlsx_name = shard_title(name, ny)
     loginstr = "" if (whoami := execcmd("whoami")) and (len(whoami) == 0) else f"，登录用户：{whoami}"
     timenowstr = pd.to_datetime(datetime.now()).strftime("%F %T")
     first_note_tail = f"\n本笔记创建于{timenowstr}，来自于主机：{getdevicename()}{loginstr}"
 
-    if (xlsx_note_id := getcfpoptionvalue("happyjpwcitems", xlsx_name, "guid")) is None:
+    if (xlsx_note_id := ini.get(xlsx_name, "guid")) is None:
         findnotelst = searchnotes(f"{xlsx_name}", parent_id=notebook_id)
         if len(findnotelst) == 1:
             xlsx_note_id = findnotelst[0].id
@@ -332,46 +683,58 @@ def update_wcitems_to_note(name: str, df4name: pd.DataFrame, wc_path: Path, note
             first_note_desc = f"### 账号\t{None}\n### 记录数量\t-1"
             first_note_body = "\n\n---\n".join([first_note_desc, first_note_tail])
             xlsx_note_id = createnote(title=xlsx_name, body=first_note_body, parent_id=notebook_id)
-        setcfpoptionvalue("happyjpwcitems", xlsx_name, "guid", str(xlsx_note_id))
+        ini.set(xlsx_name, "guid", str(xlsx_note_id))
 
-    df_to_db(name, df4name, wc_path)
-    if (itemsnum_old := getcfpoptionvalue("happyjpwcitems", xlsx_name, "itemsnum")) is None:
-        itemsnum_old = 0
+    df_to_db(name, df4name, wc_path, ini=ini)
+    localdigest, localdays = items_digest(df4name)
     itemnum = df4name.shape[0]
-    if itemnum == itemsnum_old:
+    if str(ini.get(xlsx_name, "digest")) == localdigest:
         if forcerefresh:
-            log.info(f"笔记《{xlsx_name}》的记录数量（{itemnum}）和本地登记数量相同，但是强制更新！！！")
+            log.info(f"笔记《{xlsx_name}》的内容摘要（{localdigest}）和本地登记相同，但是强制更新！！！")
         else:
-            log.info(f"笔记《{xlsx_name}》的记录数量（{itemnum}）和本地登记数量相同，跳过")
+            log.info(f"笔记《{xlsx_name}》的内容摘要（{localdigest}）和本地登记相同，跳过")
             return
 
-    if (itemsnum4net := getcfpoptionvalue("happyjpwcitems", xlsx_name, "itemsnum4net")) is None:
-        itemsnum4net = 0
+    digest4net = str(ini.get(xlsx_name, "digest4net"))
     if oldnotecontent := getnote(xlsx_note_id).body:
         note_parts = oldnotecontent.split("\n\n---\n")
         itemsnumfromnet = int(re.search(r"记录数量\t(-?\d+)", note_parts[0]).groups()[0])
+        digestfromnet = m.group(1) if (m := re.search(r"内容摘要\t(\w+)", note_parts[0])) else ""
+        # 旧格式笔记没有日摘要，记为None，只能下载资源融合
+        daysfromnet = parse_day_digests(m.group(1)) if (m := re.search(r"日摘要\t(\S*)", note_parts[0])) else None
     else:
         note_parts = list()
         itemsnumfromnet = 0
-    if itemsnum4net == itemsnumfromnet == itemnum:
+        digestfromnet = ""
+        daysfromnet = dict()
+    if digest4net == digestfromnet == localdigest:
+        ini.set(xlsx_name, "digest", localdigest)
         if forcerefresh:
             log.info(
-                f"本地资源的记录数量（{itemnum}），本地登记的记录数量（{itemsnum4net}）"
-                f"和笔记中登记的记录数量（{itemsnumfromnet}）相同，但是要强制更新！！！"
+                f"本地资源的内容摘要（{localdigest}），本地登记的云端摘要（{digest4net}）"
+                f"和笔记中登记的内容摘要（{digestfromnet}）相同，但是要强制更新！！！"
             )
         else:
             log.info(
-                f"本地资源的记录数量（{itemnum}），本地登记的记录数量（{itemsnum4net}）"
-                f"和笔记中登记的记录数量（{itemsnumfromnet}）相同，跳过"
+                f"本地资源的内容摘要（{localdigest}），本地登记的云端摘要（{digest4net}）"
+                f"和笔记中登记的内容摘要（{digestfromnet}）相同，跳过"
             )
             return
+    if daysfromnet is None:
+        needmerge = itemsnumfromnet > 0
+        log.info(f"笔记《{xlsx_name}》（记录数量{itemsnumfromnet}）尚无日摘要，从笔记端拉取融合")
     else:
-        log.info(
-            f"本地资源的记录数量（{itemnum}），登记的记录数量（{itemsnum4net}）"
-            f"和笔记中登记的记录数量（{itemsnumfromnet}）三不相同，从笔记端拉取融合"
-        )
-    resources = getreslst(xlsx_note_id)
-    if len(resources) != 0:
+        diffdays = diff_days(localdays, daysfromnet)
+        needmerge = len(diffdays) > 0
+        if needmerge:
+            log.info(f"笔记《{xlsx_name}》中有{len(diffdays)}天的内容本地没有涵盖（{diffdays}），从笔记端拉取融合")
+        else:
+            log.info(f"本地资源（{itemnum}条）已涵盖笔记《{xlsx_name}》的全部内容，无需拉取，直接更新笔记")
+    if needmerge:
+        resources = getreslst(xlsx_note_id)
+    else:
+        resources = [{"id": res.id, "title": res.title} for res in jpapi.get_resources(xlsx_note_id).items]
+    if needmerge and len(resources) != 0:
         dfromnote = pd.DataFrame()
         filetmp = wc_path / "wccitems_from_net.xlsx"
         for res in resources:
@@ -389,27 +752,34 @@ def update_wcitems_to_note(name: str, df4name: pd.DataFrame, wc_path: Path, note
             log.info(
                 f"云端笔记《{getnote(xlsx_note_id).title}》资源文件存在重复记录，从{dfcombine.shape[0]}去重后降至{dfcombinedone.shape[0]}"
             )
-        if dfcombinedone.shape[0] == itemsnumfromnet:
-            setcfpoptionvalue("happyjpwcitems", xlsx_name, "itemsnum", str(itemsnumfromnet))
-            setcfpoptionvalue("happyjpwcitems", xlsx_name, "itemsnum4net", str(itemsnumfromnet))
+        os.remove(str(filetmp))
+        combinedigest = items_digest(dfcombinedone)[0]
+        if combinedigest == digestfromnet:
+            # 云端已涵盖本地全部内容，本地分片补齐即可，无需回传
+            store.write(name, ny, dfcombinedone)
+            ini.set(xlsx_name, "digest", digestfromnet)
+            ini.set(xlsx_name, "digest4net", digestfromnet)
             if forcerefresh:
                 log.info(
-                    f"本地数据文件记录有{itemnum}条，笔记中资源文件记录数为{itemsnumfromnet}条，合并后总记录数量{dfcombinedone.shape[0]}没变化，但是要强制更新！！！"
+                    f"本地数据文件记录有{itemnum}条，笔记中资源文件记录数为{itemsnumfromnet}条，合并后内容摘要（{combinedigest}）和笔记相同，但是要强制更新！！！"
                 )
             else:
                 log.info(
-                    f"本地数据文件记录有{itemnum}条，笔记中资源文件记录数为{itemsnumfromnet}条，合并后总记录数量{dfcombinedone.shape[0]}没变化，跳过"
+                    f"本地数据文件记录有{itemnum}条，笔记中资源文件记录数为{itemsnumfromnet}条，合并后内容摘要（{combinedigest}）和笔记相同，跳过"
                 )
-                os.remove(str(filetmp))
+                df_to_db(name, dfcombinedone, wc_path, ini=ini)
                 return
         log.info(
             f"本地数据文件记录数有{itemnum}条，笔记资源文件记录数为{itemsnumfromnet}条"
             f"，合并后记录总数为：\t{dfcombinedone.shape[0]}"
         )
         df4name = dfcombinedone
-        os.remove(str(filetmp))
-    df_to_db(name, df4name, wc_path)
-    note_desc = f"### 账号\t{name}\n### 记录数量\t{df4name.shape[0]}"
+    df_to_db(name, df4name, wc_path, ini=ini)
+    digest, daydict = items_digest(df4name)
+    note_desc = (
+        f"### 账号\t{name}\n### 记录数量\t{df4name.shape[0]}\n"
+        f"### 内容摘要\t{digest}\n### 日摘要\t{format_day_digests(daydict)}"
+    )
     df4name_desc = (
         f"更新时间：{timenowstr}\t"
         f"记录时间自{df4name['time'].min()}至{df4name['time'].max()}，"
@@ -421,28 +791,36 @@ def update_wcitems_to_note(name: str, df4name: pd.DataFrame, wc_path: Path, note
     else:
         note_parts = [note_desc, first_note_tail]
     resultstr = "\n\n---\n".join(note_parts)
-    df4name.to_excel(xlsx_abs_path, engine="xlsxwriter", index=False)
+    # xlsx只在挂到笔记时按需导出，同时用融合后的记录覆盖本地分片
+    if serializer is None:
+        xlsx_path = store.export_xlsx(name, ny, df4name)
+    else:
+        xlsx_path = serializer.submit(store.export_xlsx, name, ny, df4name).result()
+    xlsx_abs_path = os.path.abspath(xlsx_path)
     for res in resources:
         jpapi.delete_resource(res.get("id"))
         log.critical(f"资源文件《{res.get('title')}》（id：{res.get('id')}）被从系统中删除！")
 
     res_id = jpapi.add_resource(xlsx_abs_path)
+    store.discard_export(xlsx_path)
     link_desc = f"[{xlsx_abs_path}](:/{res_id})\n\n"
     resultstr = link_desc + resultstr
 
     updatenote_body(noteid=xlsx_note_id, bodystr=resultstr)
-    setcfpoptionvalue("happyjpwcitems", xlsx_name, "itemsnum", str(df4name.shape[0]))
-    setcfpoptionvalue("happyjpwcitems", xlsx_name, "itemsnum4net", str(df4name.shape[0]))
+    ini.set(xlsx_name, "digest", digest)
+    ini.set(xlsx_name, "digest4net", digest)
 
 
 # %% [markdown]
-# ### get_note_list(name: str, wc_path: Path, notebook_id: str) -> list
+# ### get_note_list(name: str, wc_path: Path, notebook_id: str, store: MonthShardStore=None) -> list
 
 
 # %%
 @timethis
-def get_note_list(name: str, wc_path: Path, notebook_id: str) -> list:
+def get_note_list(name: str, wc_path: Path, notebook_id: str, store: MonthShardStore = None) -> list:
     """根据传入的微信账号名称获得云端记录笔记列表"""
+    if store is None:
+        store = get_shard_store(wc_path)
     notelisttitle = f"微信账号（{name}）记录笔记列表"
     loginstr = "" if (whoami := execcmd("whoami")) and (len(whoami) == 0) else f"，登录用户：{whoami}"
     timenowstr = pd.to_datetime(datetime.now()).strftime("%F %T")
@@ -462,9 +840,7 @@ def get_note_list(name: str, wc_path: Path, notebook_id: str) -> list:
             log.info(f"文件列表《{notelisttitle}》被首次创建！")
         setcfpoptionvalue("happyjpwcitems", "common", f"{name}_notelist_guid", str(note_list_id))
 
-    ptn = f"wcitems_{name}_" + r"\d{4}.xlsx"
-    xlsxfllstfromlocal = [fl for fl in os.listdir(wc_path) if re.search(ptn, fl)]
-    numatlocal_actual = len(xlsxfllstfromlocal)
+    numatlocal_actual = len(store.months(name))
     if (numatlocal := getcfpoptionvalue("happyjpwcitems", "common", f"{name}_num_at_local")) is None:
         numatlocal = numatlocal_actual
         setcfpoptionvalue("happyjpwcitems", "common", f"{name}_num_at_local", str(numatlocal))
@@ -513,16 +889,55 @@ def get_note_list(name: str, wc_path: Path, notebook_id: str) -> list:
 
 
 # %% [markdown]
-# ### merge_to_note(dfdict: dict, wc_path: Path, notebook_id: str, newfileonly: bool=False) -> None
+# ### sync_month(name: str, ny: str, wc_path: Path, notebook_id: str, store: MonthShardStore, serializer: Executor=None) -> tuple
 
 
 # %%
-def merge_to_note(dfdict: dict, wc_path: Path, notebook_id: str, newfileonly: bool = False) -> None:
-    """处理从文本文件读取生成的dfdict，分账户读取本地资源文件和笔记进行对照，并做相应更新或跳过"""
+def sync_month(
+    name: str, ny: str, wc_path: Path, notebook_id: str, store: MonthShardStore, serializer: Executor = None
+) -> tuple:
+    """同步单个账号单个月的分片到笔记，作为线程池中的工作单元
+
+    ini写入缓冲在返回的WcitemsIni中，由调用方按月份顺序flush；出错时不抛出，随结果返回。
+
+    Returns:
+        tuple: (WcitemsIni, Exception | None)
+    """
+    ini = WcitemsIni(direct=False)
+    try:
+        update_wcitems_to_note(name, store.read(name, ny), wc_path, notebook_id, store=store, ini=ini, serializer=serializer)
+    except Exception as e:
+        log.error(f"同步《{shard_title(name, ny)}》时出错：{e}")
+        return ini, e
+
+    return ini, None
+
+
+# %% [markdown]
+# ### merge_to_note(dfdict: dict, wc_path: Path, notebook_id: str, newfileonly: bool=False, store: MonthShardStore=None, jpworkers: int=1, serialworkers: int=1) -> None
+
+
+# %%
+def merge_to_note(
+    dfdict: dict,
+    wc_path: Path,
+    notebook_id: str,
+    newfileonly: bool = False,
+    store: MonthShardStore = None,
+    jpworkers: int = 1,
+    serialworkers: int = 1,
+) -> None:
+    """处理从文本文件读取生成的dfdict，分账户读取本地资源分片和笔记进行对照，并做相应更新或跳过
+
+    各账号各月的同步单元在jpworkers个线程中并发进行（以Joplin API往返为主），xlsx导出交给serialworkers个进程；
+    ini写入按账号、月份的固定顺序落盘，与串行执行一致。
+    """
+    if store is None:
+        store = get_shard_store(wc_path)
+    units = list()
     for name in dfdict.keys():
-        fllstfromnote = get_note_list(name, wc_path, notebook_id=notebook_id)
-        ptn = f"wcitems_{name}_" + r"\d{4}.xlsx"
-        xlsxfllstfromlocal = [fl for fl in os.listdir(wc_path) if re.search(ptn, fl)]
+        fllstfromnote = get_note_list(name, wc_path, notebook_id=notebook_id, store=store)
+        xlsxfllstfromlocal = [shard_title(name, ny) for ny in store.months(name)]
         if len(fllstfromnote) != len(xlsxfllstfromlocal):
             log.warning(
                 f"{name}的数据文件本地数量\t{len(xlsxfllstfromlocal)}，云端笔记列表中为\t{len(fllstfromnote)}，"
@@ -533,26 +948,49 @@ def merge_to_note(dfdict: dict, wc_path: Path, notebook_id: str, newfileonly: bo
                 resources = getreslst(guid)
                 if len(resources) != 0:
                     for res in resources:
-                        flfull = wc_path / fl
+                        flfull = wc_path / "wccitems_from_net.xlsx"
                         fh = open(flfull, "wb")
                         fh.write(res["contentb"])
                         fh.close()
                         dftest = pd.read_excel(flfull)
+                        os.remove(str(flfull))
+                        store.write(name, re.search(r"_(\d{4})\.xlsx$", fl).group(1), dftest)
+                        digest = items_digest(dftest)[0]
                         setcfpoptionvalue("happyjpwcitems", fl, "guid", guid)
-                        setcfpoptionvalue("happyjpwcitems", fl, "itemsnum", str(dftest.shape[0]))
-                        setcfpoptionvalue("happyjpwcitems", fl, "itemsnum4net", str(dftest.shape[0]))
+                        setcfpoptionvalue("happyjpwcitems", fl, "digest", digest)
+                        setcfpoptionvalue("happyjpwcitems", fl, "digest4net", digest)
                         log.info(f"文件《{fl}》在本地不存在，从云端获取存入并更新ini（section：{fl}，guid：{guid}）")
 
-        xlsxfllst = sorted([fl for fl in os.listdir(wc_path) if re.search(ptn, fl)])
+        nylst = store.months(name)
         if newfileonly:
-            xlsxfllst = xlsxfllst[-2:]
-        xflen = len(xlsxfllst)
-        log.info(f"{name}的数据文件数量\t{len(xlsxfllst)}，本次处理的数量为\t{xflen}")
-        for xfl in xlsxfllst:
-            log.info(f"{'-' * 15}\t{name}\t【{xlsxfllst.index(xfl) + 1}/{xflen}】\tBegin\t{'-' * 15}")
-            dftest = pd.read_excel(wc_path / xfl, engine="openpyxl").drop_duplicates()
-            update_wcitems_to_note(name, dftest, wc_path, notebook_id)
-            log.info(f"{'-' * 15}\t{name}\t【{xlsxfllst.index(xfl) + 1}/{xflen}】\tDone!\t{'-' * 15}")
+            nylst = nylst[-2:]
+        log.info(f"{name}的数据分片数量\t{len(store.months(name))}，本次处理的数量为\t{len(nylst)}")
+        units.extend((name, ny) for ny in nylst)
+
+    serializer = None
+    if serialworkers > 1 and len(units) > 1:
+        try:
+            serializer = ProcessPoolExecutor(max_workers=serialworkers)
+        except (ImportError, OSError, NotImplementedError) as e:
+            log.warning(f"无法创建xlsx导出进程池，改在同步线程中导出。{e}")
+    errors = list()
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, jpworkers)) as executor:
+            futures = [
+                executor.submit(sync_month, name, ny, wc_path, notebook_id, store, serializer) for name, ny in units
+            ]
+            # 按提交顺序等待并落盘ini，写入顺序不受完成先后影响
+            for idx, ((name, ny), fut) in enumerate(zip(units, futures)):
+                ini, err = fut.result()
+                ini.flush()
+                if err is not None:
+                    errors.append(err)
+                log.info(f"{'-' * 15}\t{name}\t【{idx + 1}/{len(units)}】\t{shard_title(name, ny)}\tDone!\t{'-' * 15}")
+    finally:
+        if serializer is not None:
+            serializer.shutdown()
+    if errors:
+        raise errors[0]
 
 
 # %% [markdown]
@@ -567,13 +1005,30 @@ def refresh_resources(wc_path: Path) -> None:
     if (new := getinivaluefromcloud("wcitems", "txtfilesonlynew")) is None:
         new = False
     log.info(f"是否只处理新的文本文件：\t{new}")
-    dfdict = txtfiles_to_dfdict(wc_path, newfileonly=new)
+    if (incremental := getinivaluefromcloud("wcitems", "txtfilesincremental")) is None:
+        incremental = False
+    log.info(f"是否只解析文本文件新追加的内容：\t{incremental}")
+    # 解析和xlsx导出是CPU密集的，按核数开进程；Joplin API往返是IO密集的，线程数单独配置
+    parseworkers = get_workers("parseworkers", os.cpu_count() or 1)
+    jpworkers = get_workers("jpworkers", 4)
+    log.info(f"解析进程数：\t{parseworkers}，笔记同步线程数：\t{jpworkers}")
+    checkpoints = dict() if incremental else None
+    store = get_shard_store(wc_path)
+    store.prepare()
+    dfdict = txtfiles_to_dfdict(wc_path, newfileonly=new, checkpoints=checkpoints, workers=parseworkers)
     for k in dfdict:
         dfinner = dfdict[k]
         log.info(f"{k}\t{dfinner.shape[0]}")
-        split_df_to_xlsx(k, dfinner, wc_path, newfileonly=new)
+        if dfinner.empty:
+            continue
+        split_df_to_xlsx(k, dfinner, wc_path, newfileonly=new, incremental=incremental, store=store)
+    # 资源文件落地后再提交检查点，中途出错则下次从原检查点重新解析
+    for fl, offset in (checkpoints or dict()).items():
+        set_txt_checkpoint(fl, offset)
 
-    merge_to_note(dfdict, wc_path, notebook_id, newfileonly=new)
+    merge_to_note(
+        dfdict, wc_path, notebook_id, newfileonly=new, store=store, jpworkers=jpworkers, serialworkers=parseworkers
+    )
 
 
 # %% [markdown]
@@ -584,8 +1039,7 @@ def refresh_resources(wc_path: Path) -> None:
 @timethis
 def all_df_desc_to_note(wc_path: Path) -> dict:
     """读取本地所有资源文件的聊天记录到DataFrame中，输出描述性信息到相应笔记中"""
-    ptn4name = r"wcitems_(\w+)_(\d{4}.xlsx)"
-    names = list(set([re.search(ptn4name, fl).groups()[0] for fl in os.listdir(wc_path) if re.search(ptn4name, fl)]))
+    names = get_shard_store(wc_path).accounts()
     log.info(f"all_df_desc_to_note账号列表：{names}")
     loginstr = "" if (whoami := execcmd("whoami")) and (len(whoami) == 0) else f"{whoami}"
     dbfilename = f"wcitemsall_({getdevicename()})_({loginstr}).db".replace(" ", "_")
@@ -594,12 +1048,8 @@ def all_df_desc_to_note(wc_path: Path) -> dict:
     for name in names[:]:
         with lite.connect(dbname) as conn:
             tbname = f"wc_{name}"
-            csql = (
-                f"create table if not exists {tbname} "
-                + "(id INTEGER PRIMARY KEY AUTOINCREMENT, time DATETIME, send BOOLEAN, sender TEXT, type TEXT, content TEXT)"
-            )
-            ifnotcreate(tbname, csql, dbname)
-            sql = f"select * from {tbname}"
+            ensure_wcitems_table(conn, tbname)
+            sql = f"select id, time, send, sender, type, content from {tbname}"
             final_df = pd.read_sql(
                 sql,
                 conn,
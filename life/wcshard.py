@@ -0,0 +1,368 @@
+# -*- coding: utf-8 -*-
+# ---
+# jupyter:
+#   jupytext:
+#     cell_metadata_filter: -all
+#     formats: ipynb,py:percent
+#     notebook_metadata_filter: jupytext,-kernelspec,-jupytext.text_representation.jupytext_version
+#     text_representation:
+#       extension: .py
+#       format_name: percent
+#       format_version: '1.3'
+# ---
+
+# %% [markdown]
+# # 微信聊天记录按月分片存储
+
+# %% [markdown]
+# - 分片：某账号某月（ny，形如2405）的全部记录
+# - xlsx后端：沿用原来的wcitems_{账号}_{ny}.xlsx，每次追加都要整体读写
+# - 列式后端（parquet/feather）：一个基础文件加若干只追加的增量文件，增量积累到阈值后压实为基础文件；
+#   xlsx只在挂到Joplin笔记时按需导出
+
+# %% [markdown]
+# ## 库导入
+
+# %%
+import hashlib
+import os
+import re
+import time
+from abc import ABC, abstractmethod
+from pathlib import Path
+
+import pandas as pd
+
+# %%
+import pathmagic
+
+with pathmagic.context():
+    from func.jpfuncs import getinivaluefromcloud
+    from func.logme import log
+
+
+# %% [markdown]
+# ## 功能函数集
+
+# %% [markdown]
+# ### shard_title(name: str, ny: str) -> str
+
+
+# %%
+def shard_title(name: str, ny: str) -> str:
+    """分片的逻辑名称，同时用作ini的section、云端笔记标题和附件文件名"""
+    return f"wcitems_{name}_{ny}.xlsx"
+
+
+# %% [markdown]
+# ### normalize_items(df: pd.DataFrame) -> pd.DataFrame
+
+
+# %%
+def normalize_items(df: pd.DataFrame) -> pd.DataFrame:
+    """统一记录df的列类型，去重并按时间排序，保证不同后端读出的结果一致"""
+    if df.empty:
+        return pd.DataFrame(columns=["time", "send", "sender", "type", "content"])
+    dfout = df.copy()
+    dfout["time"] = pd.to_datetime(dfout["time"])
+    dfout["send"] = dfout["send"].astype(bool)
+    for col in ["sender", "type", "content"]:
+        dfout[col] = dfout[col].astype("object").where(dfout[col].notna(), None)
+
+    return dfout.drop_duplicates().sort_values("time").reset_index(drop=True)
+
+
+# %% [markdown]
+# ### items_digest(df: pd.DataFrame) -> tuple[str, dict]
+
+
+# %%
+def items_digest(df: pd.DataFrame) -> tuple[str, dict]:
+    """计算记录df的内容摘要（按日两层的Merkle结构）
+
+    每条记录按全部字段算64位哈希；同一天的哈希排序后拼接再取sha1作为日摘要；
+    各日摘要按日期排序后再取sha1作为月摘要。与记录顺序、重复无关，任何字段变化（例如语音转写补全）都会改变摘要。
+
+    Returns:
+        tuple[str, dict]: (月摘要, {"dd": 日摘要})
+    """
+    dfn = normalize_items(df)
+    if dfn.empty:
+        return "", dict()
+    rowstr = (
+        dfn["time"].dt.strftime("%F %T")
+        + "\t"
+        + dfn["send"].astype(str)
+        + "\t"
+        + dfn["sender"].fillna("").astype(str)
+        + "\t"
+        + dfn["type"].fillna("").astype(str)
+        + "\t"
+        + dfn["content"].fillna("").astype(str)
+    )
+    rowhash = pd.DataFrame(
+        {"day": dfn["time"].dt.strftime("%d"), "h": pd.util.hash_pandas_object(rowstr, index=False).values}
+    )
+    daydict = dict()
+    for day, grp in rowhash.groupby("day", sort=True):
+        daydict[day] = hashlib.sha1(grp["h"].sort_values().values.tobytes()).hexdigest()[:16]
+    monthdigest = hashlib.sha1(format_day_digests(daydict).encode()).hexdigest()[:16]
+
+    return monthdigest, daydict
+
+
+# %% [markdown]
+# ### format_day_digests(daydict: dict) -> str
+
+
+# %%
+def format_day_digests(daydict: dict) -> str:
+    """把日摘要字典格式化为笔记头里的一行文本，形如 01:ab12...,02:cd34..."""
+    return ",".join(f"{day}:{dg}" for day, dg in sorted(daydict.items()))
+
+
+# %% [markdown]
+# ### parse_day_digests(daystr: str) -> dict
+
+
+# %%
+def parse_day_digests(daystr: str) -> dict:
+    """format_day_digests的逆操作，无法解析的片段忽略"""
+    return dict(re.findall(r"(\d{2}):([0-9a-f]+)", daystr or ""))
+
+
+# %% [markdown]
+# ### diff_days(local: dict, remote: dict) -> list
+
+
+# %%
+def diff_days(local: dict, remote: dict) -> list:
+    """返回云端有、但本地没有或摘要不同的日期列表；为空说明本地已涵盖云端全部内容，无需下载资源融合"""
+    return sorted(day for day, dg in remote.items() if local.get(day) != dg)
+
+
+# %% [markdown]
+# ## 存储后端
+
+# %% [markdown]
+# ### MonthShardStore
+
+
+# %%
+class MonthShardStore(ABC):
+    """按月分片存储的接口，子类实现具体的文件格式"""
+
+    ext = ""
+
+    def __init__(self, dpath: Path) -> None:
+        """dpath为分片文件所在目录"""
+        self.dpath = Path(dpath)
+
+    def shard_path(self, name: str, ny: str) -> Path:
+        """分片（基础）文件的路径"""
+        return self.dpath / f"wcitems_{name}_{ny}.{self.ext}"
+
+    def months(self, name: str) -> list:
+        """返回账号在本地已有分片的ny列表，升序"""
+        ptn = re.compile(rf"^wcitems_{re.escape(name)}_(\d{{4}})(\.d\d+)?\.{self.ext}$")
+        found = {m.group(1) for fl in os.listdir(self.dpath) if (m := ptn.match(fl))}
+        return sorted(found)
+
+    def accounts(self) -> list:
+        """返回本地已有分片的账号列表"""
+        ptn = re.compile(rf"^wcitems_(\w+)_(\d{{4}})(\.d\d+)?\.{self.ext}$")
+        return sorted({m.group(1) for fl in os.listdir(self.dpath) if (m := ptn.match(fl))})
+
+    def exists(self, name: str, ny: str) -> bool:
+        """本地是否已有该分片"""
+        return ny in self.months(name)
+
+    def prepare(self) -> None:
+        """一次运行开始时的准备工作（如转存旧格式分片），由调用方在运行入口处调用一次"""
+        pass
+
+    @abstractmethod
+    def read(self, name: str, ny: str) -> pd.DataFrame:
+        """读取分片的全部记录（已去重）"""
+
+    @abstractmethod
+    def write(self, name: str, ny: str, df: pd.DataFrame) -> None:
+        """整体覆盖写入分片"""
+
+    @abstractmethod
+    def append(self, name: str, ny: str, df: pd.DataFrame) -> None:
+        """把新记录追加进分片，重复记录在读取时去除"""
+
+    def compact(self, name: str, ny: str) -> None:
+        """把分片的增量文件压实进基础文件，无增量的后端什么也不做"""
+        pass
+
+    def compact_all(self, name: str) -> None:
+        """压实账号的全部分片"""
+        for ny in self.months(name):
+            self.compact(name, ny)
+
+    @abstractmethod
+    def export_xlsx(self, name: str, ny: str, df: pd.DataFrame = None) -> Path:
+        """导出用于挂到笔记的xlsx文件并返回其路径，传入df时先用其覆盖分片；用完由discard_export清理"""
+
+    def discard_export(self, xlsx_path: Path) -> None:
+        """清理export_xlsx导出的临时文件，分片本身即为xlsx的后端什么也不做"""
+        pass
+
+
+# %% [markdown]
+# ### XlsxShardStore
+
+
+# %%
+class XlsxShardStore(MonthShardStore):
+    """原有的xlsx分片，分片文件本身就是附件"""
+
+    ext = "xlsx"
+
+    def read(self, name: str, ny: str) -> pd.DataFrame:
+        """读取xlsx分片并去重"""
+        return pd.read_excel(self.shard_path(name, ny), engine="openpyxl").drop_duplicates()
+
+    def write(self, name: str, ny: str, df: pd.DataFrame) -> None:
+        """整体覆盖写入xlsx分片"""
+        df.to_excel(self.shard_path(name, ny), engine="xlsxwriter", index=False)
+
+    def append(self, name: str, ny: str, df: pd.DataFrame) -> None:
+        """与已有分片合并去重后整体重写（xlsx无法只追加）"""
+        if self.exists(name, ny):
+            df = pd.concat([df, self.read(name, ny)]).drop_duplicates().sort_values(["time"])
+        self.write(name, ny, df)
+
+    def export_xlsx(self, name: str, ny: str, df: pd.DataFrame = None) -> Path:
+        """分片文件本身就是附件，传入df时先覆盖写入"""
+        if df is not None:
+            self.write(name, ny, df)
+        return self.shard_path(name, ny)
+
+
+# %% [markdown]
+# ### ArrowShardStore
+
+
+# %%
+class ArrowShardStore(MonthShardStore):
+    """列式分片（parquet或feather），基础文件+只追加的增量文件，定期压实
+
+    增量文件命名为wcitems_{账号}_{ny}.d{纳秒时间戳}.{ext}，按名称排序即写入顺序。
+    """
+
+    def __init__(self, dpath: Path, fmt: str = "parquet", compact_threshold: int = 8) -> None:
+        """fmt为parquet或feather，增量文件数达到compact_threshold时自动压实"""
+        super().__init__(dpath)
+        if fmt not in ("parquet", "feather"):
+            raise ValueError(f"不支持的分片格式：{fmt}")
+        self.ext = fmt
+        self.compact_threshold = compact_threshold
+
+    def delta_paths(self, name: str, ny: str) -> list:
+        """分片的增量文件路径列表，按写入顺序"""
+        ptn = re.compile(rf"^wcitems_{re.escape(name)}_{ny}\.d\d+\.{self.ext}$")
+        return sorted(self.dpath / fl for fl in os.listdir(self.dpath) if ptn.match(fl))
+
+    def _read_file(self, fl: Path) -> pd.DataFrame:
+        if self.ext == "parquet":
+            return pd.read_parquet(fl)
+        return pd.read_feather(fl)
+
+    def _write_file(self, df: pd.DataFrame, fl: Path) -> None:
+        """先写临时文件再原子替换，中途出错不会留下半截分片"""
+        fltmp = fl.with_name(f".{fl.name}.tmp")
+        dfout = normalize_items(df)
+        if self.ext == "parquet":
+            dfout.to_parquet(fltmp, index=False)
+        else:
+            dfout.to_feather(fltmp)
+        os.replace(fltmp, fl)
+
+    def read(self, name: str, ny: str) -> pd.DataFrame:
+        """读取基础文件和全部增量文件，合并去重"""
+        fllst = [self.shard_path(name, ny)] if self.shard_path(name, ny).exists() else []
+        fllst.extend(self.delta_paths(name, ny))
+        if not fllst:
+            return normalize_items(pd.DataFrame())
+        return normalize_items(pd.concat([self._read_file(fl) for fl in fllst]))
+
+    def write(self, name: str, ny: str, df: pd.DataFrame) -> None:
+        """覆盖写入基础文件并删除增量文件"""
+        self._write_file(df, self.shard_path(name, ny))
+        for fl in self.delta_paths(name, ny):
+            os.remove(fl)
+
+    def append(self, name: str, ny: str, df: pd.DataFrame) -> None:
+        """新记录写成一个增量文件，增量文件数达到阈值时压实"""
+        if not self.shard_path(name, ny).exists():
+            self.write(name, ny, df)
+            return
+        self._write_file(df, self.dpath / f"wcitems_{name}_{ny}.d{time.time_ns()}.{self.ext}")
+        if len(self.delta_paths(name, ny)) >= self.compact_threshold:
+            self.compact(name, ny)
+
+    def compact(self, name: str, ny: str) -> None:
+        """把增量文件合并进基础文件"""
+        if not (deltas := self.delta_paths(name, ny)):
+            return
+        df = self.read(name, ny)
+        self.write(name, ny, df)
+        log.info(f"分片《{shard_title(name, ny)}》压实{len(deltas)}个增量文件，共{df.shape[0]}条记录")
+
+    def export_xlsx(self, name: str, ny: str, df: pd.DataFrame = None) -> Path:
+        """在xlsxexport子目录导出临时xlsx附件，传入df时先用其覆盖分片"""
+        if df is None:
+            df = self.read(name, ny)
+        else:
+            self.write(name, ny, df)
+        xlsx_path = self.dpath / "xlsxexport" / shard_title(name, ny)
+        xlsx_path.parent.mkdir(parents=True, exist_ok=True)
+        df.to_excel(xlsx_path, engine="xlsxwriter", index=False)
+        return xlsx_path
+
+    def discard_export(self, xlsx_path: Path) -> None:
+        """删除导出的临时xlsx"""
+        if os.path.exists(xlsx_path):
+            os.remove(xlsx_path)
+
+    def prepare(self) -> None:
+        """运行开始时转存旧xlsx分片"""
+        self.import_legacy_xlsx()
+
+    def import_legacy_xlsx(self) -> None:
+        """把尚无列式分片的旧xlsx分片转存过来，原xlsx文件保留不动"""
+        legacy = XlsxShardStore(self.dpath)
+        for name in legacy.accounts():
+            mine = set(self.months(name))
+            for ny in legacy.months(name):
+                if ny not in mine:
+                    self.write(name, ny, legacy.read(name, ny))
+                    log.info(f"旧分片《{shard_title(name, ny)}》转存为{self.ext}格式")
+
+
+# %% [markdown]
+# ### get_shard_store(dpath: Path) -> MonthShardStore
+
+
+# %%
+def get_shard_store(dpath: Path) -> MonthShardStore:
+    """根据云端配置（wcitems/shardbackend：xlsx|parquet|feather）返回分片存储后端，缺少pyarrow时降级为xlsx
+
+    旧xlsx分片的转存不在这里做（各函数store缺省时都会调用本函数），由运行入口调用store.prepare()一次。
+    """
+    if (backend := getinivaluefromcloud("wcitems", "shardbackend")) is None:
+        backend = "xlsx"
+    if (threshold := getinivaluefromcloud("wcitems", "shardcompactdeltas")) is None:
+        threshold = 8
+    if backend in ("parquet", "feather"):
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError as ie:
+            log.critical(f"未安装pyarrow库，无法使用{backend}分片存储，降级为xlsx。{ie}")
+            return XlsxShardStore(dpath)
+        return ArrowShardStore(dpath, fmt=backend, compact_threshold=int(threshold))
+
+    return XlsxShardStore(dpath)
@@ -31,10 +31,14 @@ import json
 import logging
 import re
 import sys
-from collections import defaultdict
+from collections import defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime, timedelta
+from functools import lru_cache
 from pathlib import Path
 
+import numpy as np
+
 import pathmagic
 
 with pathmagic.context():
@@ -50,6 +54,7 @@ log = logging.getLogger("wechat_finance")
 __all__ = [
     "parse_finance_messages",
     "classify_merchant",
+    "MerchantClassifier",
     "load_category_map",
     "save_category_map",
     "generate_finance_report",
@@ -174,6 +179,127 @@ def classify_merchant(merchant: str, category_map: dict = None) -> str:
     return "未分类-其他"
 
 
+class MerchantClassifier:
+    """预编译的商户分类器，结果与 classify_merchant 逐条一致。
+
+    classify_merchant 每次调用都要把整张映射表按键长排序再线性扫描；
+    本类在构造时一次性完成：
+    - 按 classify_merchant 的遍历顺序（键长降序，同长保持插入顺序）给每个键编号 rank
+    - Aho-Corasick 自动机：一遍扫描商户名，找出其中出现的全部键（"键 in 商户"）
+    - 二元组倒排：bigram → 含该二元组的键 rank 升序列表，用于"商户 in 键"
+    两路候选取最小 rank 即原函数的首个命中；再加 LRU 缓存已解析的商户名。
+    """
+
+    UNKNOWN = "未分类-其他"
+
+    def __init__(self, category_map: dict = None, cache_size: int = 65536) -> None:
+        """按 category_map（默认内置映射）建索引，cache_size 为已解析商户名的 LRU 容量。"""
+        if category_map is None:
+            category_map = _DEFAULT_CATEGORY_MAP
+        self.category_map = dict(category_map)
+        ordered = sorted(self.category_map.items(), key=lambda x: -len(x[0]))
+        self._keys = [k for k, _ in ordered]
+        self._cats = [c for _, c in ordered]
+        self._build_automaton()
+        self._build_reverse_index()
+        self.classify = lru_cache(maxsize=cache_size)(self._classify)
+
+    def __call__(self, merchant: str) -> str:
+        """同 classify：商户名 → 分类，无命中返回 UNKNOWN。"""
+        return self.classify(merchant)
+
+    def _build_automaton(self):
+        """goto/fail/out 三表的 Aho-Corasick；out[state] 为在该状态结束的键的最小 rank。"""
+        goto = [{}]
+        out = [None]
+        for rank, key in enumerate(self._keys):
+            state = 0
+            for ch in key:
+                nxt = goto[state].get(ch)
+                if nxt is None:
+                    nxt = len(goto)
+                    goto[state][ch] = nxt
+                    goto.append({})
+                    out.append(None)
+                state = nxt
+            if out[state] is None:
+                out[state] = rank
+
+        fail = [0] * len(goto)
+        # best[state]：沿 fail 链可达的所有结束键中的最小 rank
+        best = list(out)
+        queue = deque()
+        for nxt in goto[0].values():
+            queue.append(nxt)
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in goto[state].items():
+                f = fail[state]
+                while f and ch not in goto[f]:
+                    f = fail[f]
+                fail[nxt] = goto[f].get(ch, 0)
+                inherited = best[fail[nxt]]
+                if inherited is not None and (best[nxt] is None or inherited < best[nxt]):
+                    best[nxt] = inherited
+                queue.append(nxt)
+        self._goto, self._fail, self._best = goto, fail, best
+
+    def _build_reverse_index(self):
+        """bigram/单字 → 含它的键的 rank 升序列表。"""
+        index = defaultdict(list)
+        for rank, key in enumerate(self._keys):
+            grams = {key[i:i + 2] for i in range(len(key) - 1)} | set(key)
+            for g in grams:
+                index[g].append(rank)
+        self._grams = index
+
+    def _min_rank_in(self, merchant: str):
+        """商户名中出现的键的最小 rank（"键 in 商户"）。"""
+        goto, fail, best = self._goto, self._fail, self._best
+        found = best[0]  # 空键恒匹配
+        state = 0
+        for ch in merchant:
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            b = best[state]
+            if b is not None and (found is None or b < found):
+                found = b
+        return found
+
+    def _min_rank_containing(self, merchant: str, limit):
+        """包含商户名的键中 rank 最小者（"商户 in 键"），只需找比 limit 更小的。"""
+        if len(merchant) >= 2:
+            grams = [merchant[i:i + 2] for i in range(len(merchant) - 1)]
+        else:
+            grams = [merchant]
+        postings = min((self._grams.get(g, ()) for g in grams), key=len)
+        keys = self._keys
+        for rank in postings:
+            if limit is not None and rank >= limit:
+                break
+            if merchant in keys[rank]:
+                return rank
+        return None
+
+    def _classify(self, merchant: str) -> str:
+        """商户名 → 分类（与 classify_merchant 结果一致），构造时包上 LRU 缓存作为 classify。"""
+        if not merchant:
+            return self.UNKNOWN
+        merchant = merchant.strip()
+        # 完全匹配
+        if merchant in self.category_map:
+            return self.category_map[merchant]
+        if not merchant:
+            # 空串被任何键包含，原函数取遍历顺序第一个键
+            return self._cats[0] if self._cats else self.UNKNOWN
+        rank = self._min_rank_in(merchant)
+        other = self._min_rank_containing(merchant, rank)
+        if other is not None:
+            rank = other
+        return self._cats[rank] if rank is not None else self.UNKNOWN
+
+
 def _parse_amount(text: str) -> float:
     """从文本中提取金额。"""
     nums = RE_AMOUNT.findall(text)
@@ -225,8 +351,9 @@ def _parse_time_seconds(time_str: str) -> float:
         return 0.0
 
 
+@lru_cache(maxsize=4096)
 def _is_bank_sender(sender: str) -> bool:
-    """判断 sender 是否为银行/信用卡/金融类。"""
+    """判断 sender 是否为银行/信用卡/金融类（sender 取值有限，结果缓存）。"""
     if not sender:
         return False
     if sender in ("信用卡还款", "微信转账助手"):
@@ -234,99 +361,144 @@ def _is_bank_sender(sender: str) -> bool:
     return bool(_RE_BANK_SENDER.search(sender))
 
 
-def _collect_finance_events(messages: list) -> list:
-    """Phase 1: 遍历所有消息，收集原始财务事件。
+# ── 关键词扫描器 ──
 
-    每条事件含 time, amount, source(paid/voucher/bank_expense/bank_income/transfer/redpacket),
-    merchant, direction, payment_method 等字段。
+# 京东白条非交易提醒（失败/额度/账单等）
+_RE_JDBT_SKIP = ["失败通知", "交易到账通知", "账单", "还款", "分期", "红包"]
+
+# 类名 → 关键词；单个关键词作类名时直接表示"内容含该词"
+_KW_CLASSES = {
+    "wxpay_skip": _RE_WXPAY_SKIP,
+    "transfer_skip": _RE_TRANSFER_SKIP,
+    "jdbt_skip": _RE_JDBT_SKIP,
+    "bank_skip": _RE_BANK_SKIP_KW,
+    "bank_consume": _RE_BANK_CONSUME_KW,
+    "bank_income": _RE_BANK_INCOME_KW,
+    **{kw: [kw] for kw in ("零钱提现", "零钱充值", "微信支付凭证", "收到转账", "交易提醒", "红包", "收款", "收到")},
+}
+
+
+def _build_keyword_scanner():
+    """把全部关键词编译成一个正则，返回 (pattern, 关键词 → 类集合)。
+
+    正则为长词在前的多选 kw1|kw2|...，每次命中后从下一个字符继续搜索，每个起点都报告最长命中；
+    关键词的类集合并入所有是其子串的关键词的类，于是同一起点被长词遮住的短词也不会漏。
     """
+    kw_classes = defaultdict(set)
+    for cls, kws in _KW_CLASSES.items():
+        for kw in kws:
+            kw_classes[kw].add(cls)
+    closure = {
+        kw: frozenset().union(*(kw_classes[sub] for sub in kw_classes if sub in kw))
+        for kw in kw_classes
+    }
+    alternation = "|".join(re.escape(kw) for kw in sorted(kw_classes, key=len, reverse=True))
+    return re.compile(alternation), closure
+
+
+_KW_SCANNER, _KW_CLOSURE = _build_keyword_scanner()
+
+
+def _scan_keywords(content: str) -> frozenset:
+    """一遍扫描 content，返回命中的关键词类集合。"""
+    hits = frozenset()
+    m = _KW_SCANNER.search(content)
+    while m:
+        hits |= _KW_CLOSURE[m.group()]
+        m = _KW_SCANNER.search(content, m.start() + 1)
+    return hits
+
+
+def _make_event(msg: dict, content: str, **fields: object) -> dict:
+    """确认命中后才构建事件 dict。"""
+    evt = {
+        "time": msg.get("time", ""),
+        "amount": 0.0,
+        "source": "",
+        "merchant": "",
+        "direction": "支出",
+        "category": "未分类-其他",
+        "payment_method": "",
+        "source_text": content[:100],
+        "raw": msg,
+    }
+    evt.update(fields)
+    return evt
+
+
+def _scan_messages(messages: list) -> list:
+    """逐条判定消息，返回财务事件列表（保持消息顺序，未排序）。"""
     events = []
 
     for msg in messages:
         sender = msg.get("sender", "")
         content = msg.get("content") or ""
-        msg_time = msg.get("time", "")
-        msg_type = msg.get("type", "")
-
-        evt = {
-            "time": msg_time,
-            "amount": 0.0,
-            "source": "",
-            "merchant": "",
-            "direction": "支出",
-            "category": "未分类-其他",
-            "payment_method": "",
-            "source_text": content[:100],
-            "raw": msg,
-        }
+        hits = _scan_keywords(content)
 
         # ── 零钱提现/充值（微信余额↔银行卡互转）──
-        if "零钱提现" in content or "零钱充值" in content:
+        if "零钱提现" in hits or "零钱充值" in hits:
             m = RE_AMOUNT.search(content)
             if m:
                 amt = float(m.group(1))
                 if amt > 0:
-                    kw = "零钱提现" if "零钱提现" in content else "零钱充值"
-                    evt["amount"] = amt
-                    evt["source"] = "paid"
-                    evt["merchant"] = kw
-                    evt["category"] = "内部-转账"
-                    evt["payment_method"] = "零钱"
-                    events.append(evt)
+                    kw = "零钱提现" if "零钱提现" in hits else "零钱充值"
+                    events.append(_make_event(
+                        msg, content, amount=amt, source="paid", merchant=kw,
+                        category="内部-转账", payment_method="零钱",
+                    ))
                     continue
 
         # ── 微信支付消息 ──
         if sender == "微信支付":
-            if any(kw in content for kw in _RE_WXPAY_SKIP):
+            if "wxpay_skip" in hits:
                 continue
 
             # paid 消息
             m = RE_PAID.search(content)
             if m:
-                evt["amount"] = float(m.group(1))
-                evt["source"] = "paid"
-                evt["payment_method"] = _detect_payment_method(content)
-                events.append(evt)
+                events.append(_make_event(
+                    msg, content, amount=float(m.group(1)), source="paid",
+                    payment_method=_detect_payment_method(content),
+                ))
                 continue
 
             # 微信支付凭证
-            if "微信支付凭证" in content:
+            if "微信支付凭证" in hits:
                 amt = _parse_amount(content)
                 if amt > 0:
-                    evt["amount"] = amt
-                    evt["source"] = "voucher"
-                    evt["merchant"] = _extract_merchant(content)
-                    evt["payment_method"] = _detect_payment_method(content)
-                    events.append(evt)
+                    events.append(_make_event(
+                        msg, content, amount=amt, source="voucher",
+                        merchant=_extract_merchant(content),
+                        payment_method=_detect_payment_method(content),
+                    ))
                     continue
             continue
 
         # ── 收到转账消息（个人对个人）──
-        m = RE_RECEIVED_TRANSFER.search(content)
+        m = RE_RECEIVED_TRANSFER.search(content) if "收到转账" in hits else None
         if m:
             amt = float(m.group(1))
             if amt > 0:
-                evt["amount"] = amt
-                evt["source"] = "transfer"
                 # send=1 表示我发起的转账（我转出），send=0 表示我接收的转账
                 is_send = msg.get("send", False)
-                evt["direction"] = "支出" if is_send else "收入"
-                evt["category"] = "社交-转账"
-                events.append(evt)
+                events.append(_make_event(
+                    msg, content, amount=amt, source="transfer",
+                    direction="支出" if is_send else "收入", category="社交-转账",
+                ))
                 continue
 
         # ── 微信转账助手汇总消息（排除）──
         if sender == "微信转账助手":
-            if any(kw in content for kw in _RE_TRANSFER_SKIP):
+            if "transfer_skip" in hits:
                 continue
 
         # ── 京东白条消息（格式不同：消费金额/服务商户而非交易金额/交易商户）──
         if sender == "京东白条":
             # 失败通知/额度通知/非交易提醒 → 跳过
-            if any(kw in content for kw in ("失败通知", "交易到账通知", "账单", "还款", "分期", "红包")):
+            if "jdbt_skip" in hits:
                 continue
             # 交易提醒 → 提取金额和商户
-            if "交易提醒" in content:
+            if "交易提醒" in hits:
                 m = re.search(r"消费金额[：:](\d+\.?\d*)元", content)
                 if m:
                     amt = float(m.group(1))
@@ -335,60 +507,80 @@ def _collect_finance_events(messages: list) -> list:
                 if amt > 0:
                     m2 = re.search(r"服务商户[：:]\s*(.+?)(?:\n|\)|$)", content)
                     merchant = m2.group(1).strip() if m2 else "京东白条"
-                    evt["amount"] = amt
-                    evt["source"] = "bank_expense"
-                    evt["merchant"] = merchant
-                    evt["payment_method"] = "京东白条"
-                    events.append(evt)
+                    events.append(_make_event(
+                        msg, content, amount=amt, source="bank_expense",
+                        merchant=merchant, payment_method="京东白条",
+                    ))
                     continue
             continue
 
         # ── 银行/信用卡消息 ──
         if _is_bank_sender(sender):
             # 先走跳过关键词（还款/账单/分期/失败/退款/退税等），过滤非消费
-            is_skip = any(kw in content for kw in _RE_BANK_SKIP_KW)
-            if is_skip:
+            if "bank_skip" in hits:
                 continue
 
-            is_consume = any(kw in content for kw in _RE_BANK_CONSUME_KW)
-            is_bank_income = any(kw in content for kw in _RE_BANK_INCOME_KW)
-
             # 消费类（用 RE_BANK_AMOUNT 提取交易金额，避免误取"可用额度"）
-            if is_consume:
+            if "bank_consume" in hits:
                 m = RE_BANK_AMOUNT.search(content)
                 if m:
                     amt = float(m.group(1))
                 else:
                     amt = _parse_amount(content)
                 if amt > 0:
-                    evt["amount"] = amt
-                    evt["source"] = "bank_expense"
-                    evt["merchant"] = _extract_bank_merchant(content) or sender
-                    events.append(evt)
+                    events.append(_make_event(
+                        msg, content, amount=amt, source="bank_expense",
+                        merchant=_extract_bank_merchant(content) or sender,
+                    ))
                     continue
 
             # 收入类（银行主动推送的入账通知，含理财收益）
-            if is_bank_income:
+            if "bank_income" in hits:
                 amt = _parse_amount(content)
                 if amt > 0:
-                    evt["amount"] = amt
-                    evt["source"] = "bank_income"
-                    evt["direction"] = "收入"
-                    events.append(evt)
+                    events.append(_make_event(
+                        msg, content, amount=amt, source="bank_income", direction="收入",
+                    ))
                     continue
             continue
 
         # ── 红包消息 ──
-        if "红包" in content:
+        if "红包" in hits:
             amt = _parse_amount(content)
             if amt > 0:
-                evt["amount"] = amt
-                evt["source"] = "redpacket"
-                evt["direction"] = "收入" if "收款" in content or "收到" in content else "支出"
-                evt["category"] = "社交-红包"
-                events.append(evt)
+                events.append(_make_event(
+                    msg, content, amount=amt, source="redpacket",
+                    direction="收入" if "收款" in hits or "收到" in hits else "支出",
+                    category="社交-红包",
+                ))
                 continue
 
+    return events
+
+
+def _collect_finance_events(messages: list, workers: int = 1, batchsize: int = 20000) -> list:
+    """Phase 1: 遍历所有消息，收集原始财务事件。
+
+    每条事件含 time, amount, source(paid/voucher/bank_expense/bank_income/transfer/redpacket),
+    merchant, direction, payment_method 等字段。
+    workers > 1 且消息多于一批时按 batchsize 分批交给进程池，结果按批次顺序拼接；
+    无法创建进程池（如 Termux 缺少 sem_open）时退化为串行。
+    """
+    batches = [messages[i:i + batchsize] for i in range(0, len(messages), batchsize)]
+    if workers > 1 and len(batches) > 1:
+        try:
+            executor = ProcessPoolExecutor(max_workers=min(workers, len(batches)))
+        except (ImportError, OSError, NotImplementedError) as e:
+            log.warning(f"无法创建进程池，退化为串行解析。{e}")
+            executor = None
+        if executor is not None:
+            with executor:
+                events = [evt for part in executor.map(_scan_messages, batches) for evt in part]
+        else:
+            events = _scan_messages(messages)
+    else:
+        events = _scan_messages(messages)
+
     # 按时间排序（空时间放最后）
     events.sort(key=lambda e: e["time"] or "9999")
     return events
@@ -401,7 +593,8 @@ def _find_companions(events: list, start_idx: int, used: list) -> list:
     """在已排序 events 中，查找与 start_idx 事件配对的事件。
 
     条件：时间差 < _MERGE_WINDOW 秒 + 金额完全匹配。
-    返回匹配事件的索引列表。"""
+    返回匹配事件的索引列表。逐个候选解析时间的参考实现，批量归并用 _CompanionIndex。
+    """
     evt = events[start_idx]
     base_ts = _parse_time_seconds(evt["time"])
     if base_ts <= 0:
@@ -431,6 +624,66 @@ def _find_companions(events: list, start_idx: int, used: list) -> list:
     return companions
 
 
+class _CompanionIndex:
+    """按金额分桶的 companion 索引，结果与逐个调用 _find_companions 一致。
+
+    - 时间只解析一次，存为 int64 秒数组；金额折算为整数分
+    - 候选（bank_expense/voucher，时间有效）按金额分桶，桶内为升序的事件下标
+    - 查找时在相邻三个分桶（金额差 < 0.01 元可能跨一分）内 searchsorted 定位到 start_idx 之后，
+      向后取到时间窗口为止；被取走的候选用"下一个未用"指针跳过，密集通知也不会反复扫描
+    """
+
+    def __init__(self, events: list) -> None:
+        self.events = events
+        self.ts = np.array([_parse_time_seconds(e["time"]) for e in events], dtype=np.int64)
+        self.cents = np.rint(np.array([e["amount"] for e in events], dtype=np.float64) * 100).astype(np.int64)
+        is_cand = np.array([e["source"] in ("bank_expense", "voucher") for e in events], dtype=bool)
+        cand = np.flatnonzero(is_cand & (self.ts > 0))
+        self.buckets = {}
+        self.skip = {}
+        if len(cand):
+            order = np.argsort(self.cents[cand], kind="stable")
+            cand = cand[order]
+            keys, starts = np.unique(self.cents[cand], return_index=True)
+            for key, part in zip(keys.tolist(), np.split(cand, starts[1:])):
+                self.buckets[key] = part
+                self.skip[key] = list(range(len(part) + 1))
+
+    def _next_free(self, key: int, pos: int) -> int:
+        """桶内 pos 起第一个未被取走的位置（带路径压缩）。"""
+        skip = self.skip[key]
+        root = pos
+        while skip[root] != root:
+            root = skip[root]
+        while skip[pos] != root:
+            skip[pos], pos = root, skip[pos]
+        return root
+
+    def take(self, start_idx: int) -> list:
+        """返回 start_idx 事件的 companion 下标（升序），并从索引中取走。"""
+        evt = self.events[start_idx]
+        base_ts = int(self.ts[start_idx])
+        if base_ts <= 0 or evt["source"] not in ("paid", "voucher"):
+            return []
+        cents = int(self.cents[start_idx])
+        found = []
+        for key in (cents - 1, cents, cents + 1):
+            part = self.buckets.get(key)
+            if part is None:
+                continue
+            pos = self._next_free(key, int(np.searchsorted(part, start_idx, side="right")))
+            while pos < len(part):
+                j = int(part[pos])
+                if self.ts[j] - base_ts > _MERGE_WINDOW:
+                    break
+                if abs(self.events[j]["amount"] - evt["amount"]) < 0.01:
+                    found.append(j)
+                    self.skip[key][pos] = pos + 1
+                pos = self._next_free(key, pos + 1)
+        found.sort()
+        return found
+
+
 def _build_record(primary: dict, companions: list) -> dict:
     """将主事件和它的 companion 事件合并为一条消费记录。
 
@@ -469,7 +722,7 @@ def _build_record(primary: dict, companions: list) -> dict:
     return record
 
 
-def parse_finance_messages(messages: list) -> list:
+def parse_finance_messages(messages: list, workers: int = 1) -> list:
     """从消息列表中提取去重后的财务记录。
 
     去重策略（Phase 2）：
@@ -478,11 +731,12 @@ def parse_finance_messages(messages: list) -> list:
     - 归并条件：时间差 < 30秒 + 金额精确匹配
     - 转账按 (sender, amount, 日期) 分组去重，避免合并库双侧数据重复
     """
-    events = _collect_finance_events(messages)
+    events = _collect_finance_events(messages, workers=workers)
 
     n = len(events)
     used = [False] * n
     records = []
+    index = _CompanionIndex(events)
 
     for i in range(n):
         if used[i]:
@@ -509,7 +763,7 @@ def parse_finance_messages(messages: list) -> list:
             continue
 
         # 查找 companion 事件
-        companions_idx = _find_companions(events, i, used)
+        companions_idx = index.take(i)
         companion_events = [events[j] for j in companions_idx]
         record = _build_record(evt, companion_events)
 
@@ -1,18 +1,21 @@
-"""全量重新导入：清空后走 import_merged（微信+短信归并）。
+"""全量重新导入：清空后走 import_month（微信+短信归并，记入导入日志）。
 覆盖 2023-01 ~ 2026-06，含余额重算。
+--skip-clear 时按导入日志增量：输入未变的月份跳过，变化的月份按 source_group_id 替换流水，
+余额从最早变化的月份起滚动。
 
 用法：
     python tools/reimport_full.py                    # 全量重导
-    python tools/reimport_full.py --skip-clear       # 不清空，增量追加 WeChat
+    python tools/reimport_full.py --skip-clear       # 不清空，只重导有变化的月份
+    python tools/reimport_full.py --workers 4        # 多进程分批解析
+    python tools/reimport_full.py --prefetch 3 --workers 4   # 流水线：预取 3 个月，4 进程解析，单线程按月写库
+    python tools/reimport_full.py --refresh-cache    # 忽略本地月度缓存，全部重新拉取
 """
 
 import argparse
-import json
 import sys
-import urllib.request
-import ssl
 from collections import defaultdict
 from datetime import datetime
+from functools import partial
 from pathlib import Path
 
 sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
@@ -30,9 +33,11 @@ if str(JOPLINAI) not in sys.path:
 from life.ledger.db import Database
 from life.ledger.accounts import AccountManager
 from life.ledger.transactions import TransactionManager
-from life.ledger.cloudcfg import get_sms_api_url
-from life.wechat_finance import parse_finance_messages, classify_merchant, load_category_map
-from life.sms_finance import parse_sms_records
+from life.ledger.fetchcache import MonthCache
+from life.ledger.pipeline import (
+    run_pipeline, thread_local_factory, init_parse_worker, parse_worker_args, parse_month_messages,
+)
+from life.wechat_finance import load_category_map
 from aimod.wechat_client import WeChatClient
 
 
@@ -43,35 +48,16 @@ def get_sms_api_key() -> str:
     return ""
 
 
-def fetch_sms_month(year: int, month: int) -> list:
-    sms_api = get_sms_api_url()
-    date_from = f"{year}-{month:02d}-01"
-    date_to = f"{year}-{month+1:02d}-01" if month < 12 else f"{year+1}-01-01"
-    url = f"{sms_api}?date_from={date_from}&date_to={date_to}&limit=50000"
-
-    ctx = ssl.create_default_context()
-    ctx.check_hostname = False
-    ctx.verify_mode = ssl.CERT_NONE
-
-    sms_api_key = get_sms_api_key()
-    req = urllib.request.Request(url)
-    if sms_api_key:
-        req.add_header("X-API-Key", sms_api_key)
-
-    try:
-        resp = urllib.request.urlopen(req, timeout=30, context=ctx)
-        data = json.loads(resp.read().decode())
-        return data.get("records", [])
-    except Exception as e:
-        log.warning(f"  SMS API 失败 ({year}-{month:02d}): {e}")
-        return []
-
-
 def main():
     parser = argparse.ArgumentParser(description="全量重导财务数据（微信+短信归并）")
-    parser.add_argument("--skip-clear", action="store_true", help="不清空现有数据，仅增量导入 WeChat")
+    parser.add_argument("--skip-clear", action="store_true", help="不清空现有数据，按导入日志只重导有变化的月份")
+    parser.add_argument("--force", action="store_true", help="忽略导入日志摘要，每个月都重新路由比对")
     parser.add_argument("--start-month", default="2023-01")
     parser.add_argument("--end-month", default=datetime.now().strftime("%Y-%m"))
+    parser.add_argument("--workers", type=int, default=1, help="解析微信/短信的进程数")
+    parser.add_argument("--prefetch", type=int, default=0,
+                        help="流水线模式：提前拉取/解析的月份数（0 为逐月顺序导入）")
+    parser.add_argument("--refresh-cache", action="store_true", help="忽略已封月的本地缓存，重新拉取")
     args = parser.parse_args()
 
     sy, sm = map(int, args.start_month.split("-"))
@@ -82,55 +68,71 @@ def main():
     db = Database()
     acct_mgr = AccountManager(db)
     tx_mgr = TransactionManager(db, acct_mgr)
-    client = WeChatClient(mode="local", db_path=str(JOPLINAI / "data" / "wcitemsall_merged.db"))
-    cat_map = load_category_map()
+    # WeChatClient 本地模式持有 SQLite 连接，预取线程各建一个
+    wechat_client = thread_local_factory(
+        lambda: WeChatClient(mode="local", db_path=str(JOPLINAI / "data" / "wcitemsall_merged.db")))
+    cache = MonthCache(refresh=args.refresh_cache)
+    sms_key = get_sms_api_key()
+    # 没有短信密钥时只按微信来源替换，空短信列表绝不能进 merged 替换（会删光该月短信流水）
+    source = "merged" if sms_key else "wechat"
+    if not sms_key:
+        log.warning("未配置 SMS API 密钥，只导入微信流水，库内短信流水保持不变")
 
     if not args.skip_clear:
         log.info("清空 account_flows / account_balances / net_worth_snapshots...")
         db.execute("DELETE FROM account_flows")
+        db.execute("DELETE FROM flow_rollups")
         db.execute("DELETE FROM account_balances")
         db.execute("DELETE FROM net_worth_snapshots")
+        db.execute("DELETE FROM import_journal")
         db.commit()
         log.info("已清空")
 
-    total_flows = 0
+    months = [(y, m) for y in range(sy, ey + 1)
+              for m in range(sm if y == sy else 1, (em if y == ey else 12) + 1)]
     monthly = []
-
-    for y in range(sy, ey + 1):
-        m_start = sm if y == sy else 1
-        m_end = em if y == ey else 12
-        for m in range(m_start, m_end + 1):
-            month_key = f"{y}-{m:02d}"
-            log.info(f"\n=== {month_key} ===")
-
-            # WeChat
-            date_from = f"{y}-{m:02d}-01"
-            date_to = f"{y}-{m+1:02d}-01" if m < 12 else f"{y+1}-01-01"
-            msgs = client.query("白晔峰", date_from=date_from, date_to=date_to, limit=100000)
-            wx_records = parse_finance_messages(msgs)
-            for r in wx_records:
-                if r["category"] == "未分类-其他":
-                    r["category"] = classify_merchant(r["merchant"], cat_map)
-            log.info(f"  微信: {len(msgs)} 条消息 → {len(wx_records)} 条财务记录")
-
-            # SMS
-            sms_list = fetch_sms_month(y, m)
-            sms_records = parse_sms_records(sms_list) if sms_list else []
-            for r in sms_records:
-                if r.get("category", "") == "未分类-其他":
-                    r["category"] = classify_merchant(r["merchant"], cat_map)
-            log.info(f"  SMS:  {len(sms_list)} 条 → {len(sms_records)} 条记录")
-
-            if not wx_records and not sms_records:
-                log.info(f"  {month_key}: 无数据")
-                monthly.append((month_key, 0, 0, 0))
-                continue
-
-            # 合并导入
-            result = tx_mgr.import_merged(wx_records, sms_records, month_key)
-            total_flows += result["total_flows"]
-            monthly.append((month_key, result["total_flows"], len(wx_records), len(sms_records)))
-            log.info(f"  → {result['total_flows']} 条流水（微信: {result['by_source'].get('wechat',0)}, SMS: {result['by_source'].get('sms',0)}）")
+    changed_months = []
+
+    def fetch(ym):
+        y, m = ym
+        msgs = cache.wechat_month(wechat_client(), "白晔峰", y, m, limit=100000)
+        try:
+            sms_list = cache.sms_month(y, m, api_key=sms_key) if sms_key else []
+        except Exception as e:
+            # 拿不到短信不能当作本月无短信，否则按月替换会删光该月短信流水
+            log.error(f"  {y}-{m:02d} SMS 获取失败，本月跳过: {e}")
+            return [], []
+        log.info(f"  {y}-{m:02d} 已拉取: 微信 {len(msgs)} 条消息, SMS {len(sms_list)} 条")
+        return msgs, sms_list
+
+    def write(ym, parsed):
+        month_key = f"{ym[0]}-{ym[1]:02d}"
+        wx_records, sms_records = parsed
+        log.info(f"\n=== {month_key} ===")
+        log.info(f"  微信: {len(wx_records)} 条财务记录, SMS: {len(sms_records)} 条记录")
+
+        if not wx_records and not sms_records:
+            log.info(f"  {month_key}: 无数据")
+            monthly.append((month_key, 0, 0, 0))
+            return 0
+
+        # 合并导入（导入日志记录输入摘要，未变化的月份直接跳过）
+        result = tx_mgr.import_month(wx_records, sms_records, month_key, source=source, force=args.force)
+        monthly.append((month_key, result["total_flows"], len(wx_records), len(sms_records)))
+        if not result["changed"]:
+            log.info(f"  → 未变化，保留 {result['kept']} 条流水")
+            return result["total_flows"]
+        changed_months.append(ym)
+        log.info(f"  → {result['total_flows']} 条流水（微信: {result['by_source'].get('wechat',0)}, SMS: {result['by_source'].get('sms',0)}）"
+                 f"，新写入 {result['inserted']} / 删除 {result['deleted']} / 保留 {result['kept']}")
+        return result["total_flows"]
+
+    # 流水线模式下月份之间并行解析，单月内不再分批；顺序模式把 workers 交给单月分批解析
+    parse = parse_month_messages if args.prefetch > 0 else partial(parse_month_messages, workers=args.workers)
+    total_flows = sum(run_pipeline(
+        months, fetch, parse, write, prefetch=args.prefetch, workers=args.workers,
+        initializer=init_parse_worker, initargs=parse_worker_args(load_category_map()),
+    ))
 
     # 汇总
     print(f"\n{'='*60}")
@@ -138,20 +140,22 @@ def main():
     print(f"\n各月明细:")
     print(f"{'月份':<10} {'流水':<8} {'微信':<8} {'短信':<8}")
     print("-" * 34)
-    for mk, cnt, wx, sm in monthly:
-        print(f"{mk:<10} {cnt:<8} {wx:<8} {sm:<8}")
+    for mk, cnt, wx_n, sms_n in monthly:
+        print(f"{mk:<10} {cnt:<8} {wx_n:<8} {sms_n:<8}")
     print(f"\n{'总计':<10} {total_flows:<8}")
 
-    # 余额重算
-    log.info("重算所有月份余额...")
-    bal_count = 0
-    for y in range(sy, ey + 1):
-        m_start = sm if y == sy else 1
-        m_end = em if y == ey else 12
-        for m in range(m_start, m_end + 1):
-            tx_mgr.calculate_all_balances(y, m)
-            bal_count += 1
-    log.info(f"余额重算完成: {bal_count} 个月 × 账户数")
+    # 余额重算：全量时重算整个区间，增量时从最早变化的月份滚动
+    if not args.skip_clear:
+        log.info("重算所有月份余额...")
+        balances = tx_mgr.calculate_balances(sy, sm, ey, em)
+        log.info(f"余额重算完成: {total_months} 个月 × 账户数 = {len(balances)} 条")
+    elif changed_months:
+        y0, m0 = min(changed_months)
+        log.info(f"从 {y0}-{m0:02d} 起滚动余额...")
+        balances = tx_mgr.roll_balances_forward(y0, m0)
+        log.info(f"余额滚动完成: {len(balances)} 条")
+    else:
+        log.info("无月份变化，余额不需重算")
 
     print(f"\n数据已写入 ledger.db")
     print(f"运行报告: python -m life.ledger.cli report monthly --month {args.end_month}")
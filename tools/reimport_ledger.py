@@ -6,11 +6,8 @@
 """
 
 import argparse
-import json
 import sys
 import time
-import urllib.request
-import ssl
 from datetime import datetime, timedelta
 from pathlib import Path
 
@@ -29,7 +26,7 @@ if str(JOPLINAI) not in sys.path:
 from life.ledger.db import Database
 from life.ledger.accounts import AccountManager
 from life.ledger.transactions import TransactionManager
-from life.ledger.cloudcfg import get_sms_api_url
+from life.ledger.fetchcache import MonthCache
 from life.sms_finance import parse_sms_records
 
 
@@ -40,31 +37,11 @@ def get_sms_api_key() -> str:
     return ""
 
 
-def fetch_sms_month(year: int, month: int) -> list:
-    """拉取指定月份的 SMS 数据。"""
-    sms_api = get_sms_api_url()
-    date_from = f"{year}-{month:02d}-01"
-    date_to = f"{year}-{month+1:02d}-01" if month < 12 else f"{year+1}-01-01"
-    url = f"{sms_api}?date_from={date_from}&date_to={date_to}&limit=50000"
-
-    ctx = ssl.create_default_context()
-    ctx.check_hostname = False
-    ctx.verify_mode = ssl.CERT_NONE
-
-    sms_api_key = get_sms_api_key()
-    req = urllib.request.Request(url)
-    if sms_api_key:
-        req.add_header("X-API-Key", sms_api_key)
-
-    try:
-        resp = urllib.request.urlopen(req, timeout=30, context=ctx)
-        data = json.loads(resp.read().decode())
-        records = data.get("records", [])
-        log.info(f"  SMS API: {len(records)} 条")
-        return records
-    except Exception as e:
-        log.warning(f"  SMS API 失败: {e}")
-        return []
+def fetch_sms_month(year: int, month: int, cache: MonthCache = None) -> list:
+    """拉取指定月份的 SMS 数据（已封月读本地缓存）。"""
+    records = (cache or MonthCache()).sms_month(year, month, api_key=get_sms_api_key())
+    log.info(f"  SMS: {len(records)} 条")
+    return records
 
 
 def main():
@@ -72,6 +49,7 @@ def main():
     parser.add_argument("--dry-run", action="store_true", help="试跑，不写入")
     parser.add_argument("--start-month", help="起始月份 (YYYY-MM)，默认 2023-11")
     parser.add_argument("--end-month", help="结束月份 (YYYY-MM)，默认当前月")
+    parser.add_argument("--refresh-cache", action="store_true", help="忽略已封月的本地缓存，重新拉取")
     args = parser.parse_args()
 
     start = args.start_month or "2023-11"
@@ -85,11 +63,14 @@ def main():
     db = Database()
     acct_mgr = AccountManager(db)
     tx_mgr = TransactionManager(db, acct_mgr)
+    cache = MonthCache(refresh=args.refresh_cache)
 
     if not args.dry_run:
         # 清空现有数据
-        log.info("清空 account_flows 和 account_balances...")
+        log.info("清空 account_flows、import_journal 和 account_balances...")
         db.execute("DELETE FROM account_flows")
+        db.execute("DELETE FROM flow_rollups")
+        db.execute("DELETE FROM import_journal")
         db.execute("DELETE FROM account_balances")
         db.execute("DELETE FROM net_worth_snapshots")
         db.commit()
@@ -105,7 +86,12 @@ def main():
             month_key = f"{y}-{m:02d}"
             log.info(f"\n--- {month_key} ---")
 
-            sms_list = fetch_sms_month(y, m)
+            try:
+                sms_list = fetch_sms_month(y, m, cache)
+            except Exception as e:
+                log.error(f"  {month_key}: SMS 获取失败，本月跳过: {e}")
+                month_flow_counts.append((month_key, 0))
+                continue
             if not sms_list:
                 log.info(f"  {month_key}: 无数据")
                 month_flow_counts.append((month_key, 0))
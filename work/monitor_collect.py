@@ -17,7 +17,9 @@
 # ## 引入库
 
 # %%
+import hashlib
 import re
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 
 # %%
@@ -26,32 +28,43 @@ import pathmagic
 with pathmagic.context():
     from func.datatools import compute_content_hash
     from func.datetimetools import normalize_chinese_dates
-    from func.first import getdirmain
-    from func.jpfuncs import getnote, searchnotes
+    from func.jpfuncs import getapi, getnote, searchnotes
     from func.logme import log
     from func.nettools import ifttt_notify
     from func.sysfunc import not_IPython
+    from work.monitor_joplin import call_joplin
     from work.monitor_store import (
         MAX_PENDING_WAIT_HOURS,
         STABILITY_COOLDOWN_MINUTES,
+        StoreSession,
         delete_pending_change,
         get_last_snapshot_hash,
         get_latest_snapshot,
         get_note_info,
+        get_daily_stat_dates,
         get_note_updated_time,
         get_pending_change,
+        get_poll_state,
         get_previous_snapshot,
+        get_section_index,
         init_db,
         insert_alert,
         insert_snapshot,
         mark_note_inactive,
         mark_report_dirty,
+        touch_notes,
+        transaction,
         update_note_updated_time,
-        upsert_daily_stat,
+        upsert_daily_stats,
         upsert_note,
         upsert_pending_change,
     )
 
+# %%
+# 并发拉取线程数（总请求速率由 monitor_joplin.JOPLIN_MAX_RPS 限制）
+FETCH_WORKERS = 4
+PROBE_PAGE_SIZE = 100  # Joplin API 单页上限
+
 
 # %% [markdown]
 # ## 配置笔记解析
@@ -93,37 +106,52 @@ def fetch_note_list_sections() -> dict[str, list[str]]:
 
 
 # %%
-def parse_daily_entries(body: str, current_time: datetime) -> dict:
-    """解析笔记body中的 ### YYYY年MM月DD日 三级标题段落，返回 {date: word_count}。
+_DATE_HEADER_PTN = re.compile(r"^###\s+(\d{4}\s*年\s*\d{1,2}\s*月\s*\d{1,2}\s*[日号])\s*$", re.M)
 
-    过滤掉超过current_time后一天的日期（防异常日期）。
-    """
-    body = normalize_chinese_dates(body)
-    ptn = re.compile(r"^###\s+(\d{4}\s*年\s*\d{1,2}\s*月\s*\d{1,2}\s*[日号])\s*$", re.M)
 
-    parts = re.split(ptn, body.strip())
-    if len(parts) < 3:
-        return {}
+def parse_daily_sections(body: str, current_time: datetime) -> tuple[str, dict]:
+    """解析笔记body中的 ### YYYY年MM月DD日 三级标题段落，返回 (规范化后的正文, 分节索引)。
 
-    entries = {}
-    for i in range(1, len(parts), 2):
-        date_str_raw = parts[i]
-        content = parts[i + 1]
-        date_str = re.sub(r"\s+", "", date_str_raw).replace("号", "日")
+    分节索引为 {date: (offset, length, section_hash)}，offset/length 是该日内容（标题行之后、
+    下一个日期标题之前）在规范化正文中的位置。过滤掉超过current_time后一天的日期（防异常日期）。
+    """
+    text = normalize_chinese_dates(body).strip()
+    headers = list(_DATE_HEADER_PTN.finditer(text))
+    cutoff = current_time.date() + timedelta(days=1)
 
+    sections = {}
+    for i, m in enumerate(headers):
+        date_str = re.sub(r"\s+", "", m.group(1)).replace("号", "日")
         try:
             entry_date = datetime.strptime(date_str, "%Y年%m月%d日").date()
         except ValueError:
             continue
 
-        cutoff = current_time.date() + timedelta(days=1)
         if entry_date > cutoff:
             log.critical(f"日期 {entry_date} 超过截止日 {cutoff}，已过滤")
             continue
 
-        entries[str(entry_date)] = len(content.strip())
+        start = m.end()
+        end = headers[i + 1].start() if i + 1 < len(headers) else len(text)
+        content = text[start:end]
+        sections[str(entry_date)] = (start, end - start, hashlib.md5(content.encode()).hexdigest())
+
+    return text, sections
+
 
-    return entries
+def section_word_count(text: str, section: tuple) -> int:
+    """按分节索引取出某日内容并计字数（text 为 parse_daily_sections 返回的规范化正文）。"""
+    offset, length, _ = section
+    return len(text[offset:offset + length].strip())
+
+
+def parse_daily_entries(body: str, current_time: datetime) -> dict:
+    """解析笔记body中的 ### YYYY年MM月DD日 三级标题段落，返回 {date: word_count}。
+
+    过滤掉超过current_time后一天的日期（防异常日期）。
+    """
+    text, sections = parse_daily_sections(body, current_time)
+    return {d: section_word_count(text, sec) for d, sec in sections.items()}
 
 
 # %% [markdown]
@@ -134,8 +162,37 @@ def parse_daily_entries(body: str, current_time: datetime) -> dict:
 def collect_one(note_id: str, section: str, current_time: datetime | None = None) -> bool:
     """采集单篇笔记。返回 True 表示触发了稳定快照（需要更新报告）。
 
+    拉取（_fetch_note）与状态机落库（_apply_note）分开，collect_all 并发拉取、单线程落库。
+    """
+    note, error = _fetch_note(note_id)
+    return _apply_note(note_id, section, note, error, current_time)
+
+
+# %%
+def _apply_note(
+    note_id: str,
+    section: str,
+    note: object | None,
+    error: Exception | None = None,
+    current_time: datetime | None = None,
+) -> bool:
+    """按拉取结果推进单篇笔记的状态机并写库（只在写库线程调用），整篇笔记一个事务、一次提交。"""
+    with transaction():
+        return _advance_note(note_id, section, note, error, current_time)
+
+
+# %%
+def _advance_note(
+    note_id: str,
+    section: str,
+    note: object | None,
+    error: Exception | None = None,
+    current_time: datetime | None = None,
+) -> bool:
+    """单篇笔记的状态机。
+
     逻辑：
-    1. getnote() 一次获取 body/title/updated_time
+    1. getnote() 一次获取 body/title/updated_time（失败时 error 非空 → 笔记消失告警）
     2. 本地计算 hash（消除 content_hash 的二次 getnote）
     3. updated_time 未变且无 pending → 快速跳过
     4. hash 未变 → 仅更新元数据（updated_time），清理 pending
@@ -145,13 +202,11 @@ def collect_one(note_id: str, section: str, current_time: datetime | None = None
     if current_time is None:
         current_time = datetime.now()
 
-    try:
-        note = getnote(note_id)
-    except Exception as e:
-        log.critical(f"获取笔记 {note_id} 失败: {e}")
+    if error is not None:
+        log.critical(f"获取笔记 {note_id} 失败: {error}")
         info = get_note_info(note_id)
         if info and info.get("is_active"):
-            latest = get_latest_snapshot(note_id)
+            latest = get_latest_snapshot(note_id, with_body=False)
             prev_wc = latest["word_count"] if latest else 0
             insert_alert(
                 note_id=note_id,
@@ -247,6 +302,9 @@ def collect_one(note_id: str, section: str, current_time: datetime | None = None
     backfill_ref = note_updated if note_updated is not None else (
         _parse_pending_time(pending["last_seen"]) if pending else current_time
     )
+    # 日记分节只解析一次；与上一快照的分节索引比对，只重算、重写内容有变化的日期
+    text, sections = parse_daily_sections(body, current_time)
+    prev_sections = get_section_index(note_id)
     snapshot_id = insert_snapshot(
         note_id=note_id,
         captured_at=snap_time,
@@ -254,30 +312,29 @@ def collect_one(note_id: str, section: str, current_time: datetime | None = None
         word_count=word_count,
         body_fulltext=body,
         is_forced=is_forced,
+        section_index=sections,
     )
 
     delete_pending_change(note_id)
     if note_updated is not None:
         update_note_updated_time(note_id, note_updated)
 
-    # 解析每日条目
-    daily = parse_daily_entries(body, current_time)
-    for entry_date, wc in daily.items():
-        is_backfill = _check_backfill(entry_date, backfill_ref) if snapshot_id else 0
-        upsert_daily_stat(
-            note_id=note_id,
-            entry_date=entry_date,
-            word_count=wc,
-            is_backfill=is_backfill,
-            snapshot_id=snapshot_id,
-        )
+    # 变化日期的每日条目（一次 executemany 写入）
+    changed = [d for d, sec in sections.items() if d not in prev_sections or prev_sections[d][2] != sec[2]]
+    upsert_daily_stats(
+        note_id,
+        [
+            (d, section_word_count(text, sections[d]), _check_backfill(d, backfill_ref) if snapshot_id else 0, snapshot_id)
+            for d in changed
+        ],
+    )
 
     # 处理未写入的日期（填0值）
-    _fill_empty_dates(note_id, body, current_time)
+    _fill_empty_dates(note_id, body, current_time, sections=sections)
 
     # 内容突变检测：对比上一次快照字数
     if person and word_count > 0:
-        prev_snap = get_previous_snapshot(note_id)
+        prev_snap = get_previous_snapshot(note_id, with_body=False)
         if prev_snap and prev_snap["word_count"] > 0:
             drop = prev_snap["word_count"] - word_count
             drop_pct = drop / prev_snap["word_count"]
@@ -310,6 +367,67 @@ def collect_one(note_id: str, section: str, current_time: datetime | None = None
     return True
 
 
+# %% [markdown]
+# ## 并发拉取
+#
+# 所有拉取线程经 monitor_joplin.call_joplin 共用一个限速器；连接类错误指数退避重试，
+# 其余异常（如 404 笔记已删除）直接交给状态机按“笔记消失”处理。
+
+
+# %%
+def _fetch_note(note_id: str) -> tuple:
+    """拉取笔记全文，返回 (note, None) 或 (None, 异常)。"""
+    return call_joplin(getnote, note_id)
+
+
+# %% [markdown]
+# ## 元数据探测
+#
+# 正文下载前先分页拉取全部笔记的 id/updated_time（每页 PROBE_PAGE_SIZE 条，不含正文）。
+# 只有修改时间变化、尚无记录、处于 pending 或在探测结果中缺失（可能已删除）的笔记才下载正文，
+# 稳态下一次采集只需 ceil(笔记总数 / 每页条数) 个请求。
+
+
+# %%
+def _time_key(val) -> str | None:  # noqa: ANN001
+    """updated_time 统一为 isoformat 字符串（与 notes.last_updated_time 的存储格式一致）。"""
+    if val is None:
+        return None
+    return val.isoformat() if hasattr(val, "isoformat") else str(val)
+
+
+def probe_updated_times() -> dict[str, str] | None:
+    """返回 {note_id: updated_time isoformat}；探测失败返回 None（调用方退化为全部下载正文）。"""
+    api, error = call_joplin(getapi)
+    if error is not None:
+        log.warning(f"元数据探测失败，退化为逐篇拉取正文: {error}")
+        return None
+
+    result = {}
+    page = 1
+    while True:
+        resp, error = call_joplin(api.get_notes, fields="id,updated_time", limit=PROBE_PAGE_SIZE, page=page)
+        if error is not None:
+            log.warning(f"元数据探测第{page}页失败，退化为逐篇拉取正文: {error}")
+            return None
+        for item in resp.items:
+            result[item.id] = _time_key(item.updated_time)
+        if not resp.has_more:
+            break
+        page += 1
+    log.info(f"元数据探测: {page} 页，{len(result)} 篇笔记")
+    return result
+
+
+def _needs_body(note_id: str, probed: dict | None, poll_state: dict) -> bool:
+    """是否需要下载正文走完整状态机。"""
+    if probed is None:
+        return True
+    stored_updated, has_pending = poll_state.get(note_id, (None, False))
+    current = probed.get(note_id)
+    return current is None or stored_updated is None or has_pending or current != stored_updated
+
+
 # %% [markdown]
 # ## 辅助函数
 
@@ -335,42 +453,20 @@ def _check_backfill(entry_date_str: str, current_time: datetime) -> int:
 
 
 # %%
-def _fill_empty_dates(note_id: str, body: str, current_time: datetime) -> None:
-    """对于笔记中存在但未写入daily_stats的日期，填0值条目。"""
-    body = normalize_chinese_dates(body)
-    ptn = re.compile(r"^###\s+(\d{4}\s*年\s*\d{1,2}\s*月\s*\d{1,2}\s*[日号])\s*$", re.M)
-    parts = re.split(ptn, body.strip())
-    if len(parts) < 3:
-        return
+def _fill_empty_dates(note_id: str, body: str, current_time: datetime, sections: dict | None = None) -> None:
+    """对于笔记中存在但未写入daily_stats的日期，填0值条目。
 
-    all_dates = set()
-    for i in range(1, len(parts), 2):
-        date_str = re.sub(r"\s+", "", parts[i]).replace("号", "日")
-        try:
-            all_dates.add(datetime.strptime(date_str, "%Y年%m月%d日").date())
-        except ValueError:
-            continue
+    sections 为 parse_daily_sections 已得到的分节索引，给出时不再重复解析 body。
+    """
+    if sections is None:
+        _, sections = parse_daily_sections(body, current_time)
+    if not sections:
+        return
 
-    existing_dates = set()
-    with __import__("sqlite3").connect(str(getdirmain() / "data" / "monitor.db")) as c:
-        c.row_factory = __import__("sqlite3").Row
-        rows = c.execute(
-            "SELECT DISTINCT entry_date FROM daily_stats WHERE note_id=?",
-            (note_id,),
-        ).fetchall()
-        existing_dates = {r["entry_date"] for r in rows}
+    existing_dates = get_daily_stat_dates(note_id)
+    missing = sorted(d for d in sections if d not in existing_dates)
 
-    cutoff = current_time.date() + timedelta(days=1)
-    missing = {d for d in all_dates if str(d) not in existing_dates and d <= cutoff}
-
-    for d in missing:
-        upsert_daily_stat(
-            note_id=note_id,
-            entry_date=str(d),
-            word_count=0,
-            is_backfill=0,
-            snapshot_id=None,
-        )
+    upsert_daily_stats(note_id, [(d, 0, 0, None) for d in missing])
 
 
 # %% [markdown]
@@ -378,9 +474,12 @@ def _fill_empty_dates(note_id: str, body: str, current_time: datetime) -> None:
 
 
 # %%
-def collect_all(current_time: datetime | None = None) -> dict:
+def collect_all(current_time: datetime | None = None, workers: int = FETCH_WORKERS, probe: bool = True) -> dict:
     """全量采集所有被监测笔记。返回采集汇总。
 
+    workers 为并发拉取笔记的线程数（1 即逐篇串行），总请求速率受 JOPLIN_MAX_RPS 限制。
+    probe=True 时先做元数据探测，只为可能变化的笔记下载正文。
+
     Returns:
         {'total': N, 'changed': N, 'persons_dirty': [...], 'pending': N}
     """
@@ -389,21 +488,40 @@ def collect_all(current_time: datetime | None = None) -> dict:
     if current_time is None:
         current_time = datetime.now()
 
+    # 整轮采集共用一个连接，每篇笔记一次提交
+    with StoreSession():
+        return _collect_all(current_time, workers, probe)
+
+
+# %%
+def _collect_all(current_time: datetime, workers: int, probe: bool) -> dict:
     sections = fetch_note_list_sections()
     if not sections:
         log.critical("未找到「四件套笔记列表」中的任何section，跳过采集")
         return {"total": 0, "changed": 0, "persons_dirty": [], "pending": 0}
 
-    total = 0
+    tasks = [(section, note_id) for section, note_ids in sections.items() for note_id in note_ids]
+    total = len(tasks)
     changed = 0
-    all_note_ids = set()
-
-    for section, note_ids in sections.items():
-        for note_id in note_ids:
-            all_note_ids.add(note_id)
-            total += 1
+    all_note_ids = {note_id for _, note_id in tasks}
+
+    # 元数据探测：修改时间未变且无 pending 的笔记不下载正文，只刷新 last_seen
+    probed = probe_updated_times() if probe else None
+    poll_state = get_poll_state(all_note_ids)
+    fetch_tasks = [(section, note_id) for section, note_id in tasks if _needs_body(note_id, probed, poll_state)]
+    skipped = all_note_ids - {note_id for _, note_id in fetch_tasks}
+    if skipped:
+        touch_notes(skipped)
+    if probed is not None:
+        log.info(f"{len(skipped)} 篇未变化跳过，{len(fetch_tasks)} 篇需下载正文")
+
+    # 线程池只负责拉取笔记；状态机与写库都在当前线程按配置顺序执行，SQLite 始终只有一个写者
+    with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="jpfetch") as pool:
+        futures = [pool.submit(_fetch_note, note_id) for _, note_id in fetch_tasks]
+        for (section, note_id), fut in zip(fetch_tasks, futures):
             try:
-                if collect_one(note_id, section, current_time):
+                note, error = fut.result()
+                if _apply_note(note_id, section, note, error, current_time):
                     changed += 1
             except Exception as e:
                 log.critical(f"采集笔记 {note_id} 异常: {e}")
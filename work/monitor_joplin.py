@@ -0,0 +1,96 @@
+# ---
+# jupyter:
+#   jupytext:
+#     cell_metadata_filter: -all
+#     formats: ipynb,py:percent
+#     notebook_metadata_filter: jupytext,-kernelspec,-jupytext.text_representation.jupytext_version
+#     text_representation:
+#       extension: .py
+#       format_name: percent
+#       format_version: '1.3'
+# ---
+
+# %% [markdown]
+# # 笔记监测 —— Joplin API 调用
+#
+# 采集层与报告层共用：Joplin API 为单一主机，同一进程内所有调用共用一个限速器；
+# 连接类错误（含 OSError）指数退避重试，HTTP 状态错误（如 404 笔记已删除）不重试。
+
+# %% [markdown]
+# ## 引入库
+
+# %%
+import random
+import threading
+import time
+
+import requests
+
+# %%
+import pathmagic
+
+with pathmagic.context():
+    from func.logme import log
+
+# %%
+JOPLIN_MAX_RPS = 8.0  # Joplin API 每秒请求上限
+JOPLIN_MAX_TRIES = 3  # 连接类错误的尝试次数
+
+
+# %% [markdown]
+# ## 限速与重试
+
+
+# %%
+class RateLimiter:
+    """最小间隔限速：线程间共享，相邻两次请求至少间隔 1/rate 秒。"""
+
+    def __init__(self, rate: float) -> None:
+        """按每秒 rate 次请求限速，rate<=0 表示不限速。"""
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self._lock = threading.Lock()
+        self._next = 0.0
+
+    def wait(self) -> None:
+        """阻塞到下一个可用的请求时隙。"""
+        if not self.interval:
+            return
+        with self._lock:
+            slot = max(time.monotonic(), self._next)
+            self._next = slot + self.interval
+        delay = slot - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+
+joplin_limiter = RateLimiter(JOPLIN_MAX_RPS)
+
+
+def _retryable(exc: BaseException) -> bool:
+    """连接/超时/系统 I/O 错误可重试；requests 的异常都继承 OSError，其中 HTTP 状态错误排除在外。"""
+    return isinstance(exc, OSError) and not isinstance(exc, requests.exceptions.HTTPError)
+
+
+# %%
+def call_joplin(func, *args, limiter: RateLimiter | None = None, max_tries: int = JOPLIN_MAX_TRIES, **kwargs) -> tuple:  # noqa: ANN001 ANN002 ANN003
+    """限速 + 重试地调用 Joplin API，返回 (结果, None) 或 (None, 异常)，不抛出。"""
+    limiter = limiter or joplin_limiter
+    max_tries = max(1, max_tries)
+    for attempt in range(1, max_tries + 1):
+        limiter.wait()
+        try:
+            return func(*args, **kwargs), None
+        except Exception as e:
+            if not _retryable(e) or attempt == max_tries:
+                return None, e
+            wait = 2 ** (attempt - 1) + random.random()
+            log.warning(f"Joplin API 调用失败（第{attempt}次），{wait:.1f}秒后重试: {e}")
+            time.sleep(wait)
+
+
+def retry_jp(func, *args, max_tries: int = JOPLIN_MAX_TRIES, **kwargs):  # noqa: ANN001 ANN002 ANN003 ANN201
+    """同 call_joplin，但直接返回结果，最终失败时抛出最后一次的异常。"""
+    result, error = call_joplin(func, *args, max_tries=max_tries, **kwargs)
+    if error is not None:
+        raise error
+    return result
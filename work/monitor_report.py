@@ -20,7 +20,6 @@
 import hashlib
 import random
 import re
-import time
 from datetime import date, datetime, timedelta
 from pathlib import Path
 
@@ -29,7 +28,6 @@ import matplotlib.colors as mcolors
 import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
-import requests
 from matplotlib.ticker import MaxNLocator
 from tzlocal import get_localzone
 
@@ -51,6 +49,7 @@ with pathmagic.context():
     )
     from func.logme import log
     from func.sysfunc import not_IPython
+    from work.monitor_joplin import retry_jp
     from work.monitor_store import (
         add_spark_log,
         cleanup_spark_log,
@@ -74,28 +73,6 @@ with pathmagic.context():
 
 
 # %%
-def retry_jp(callable, *args, max_tries: int = 3, **kwargs):  # noqa: ANN001 ANN002 ANN003 ANN201
-    """Joplin API 调用重试，带指数退避"""
-    last_exc = None
-    for attempt in range(1, max_tries + 1):
-        try:
-            return callable(*args, **kwargs)
-        except (
-            requests.exceptions.ConnectionError,
-            requests.exceptions.ReadTimeout,
-            requests.exceptions.ConnectTimeout,
-            ConnectionRefusedError,
-            ConnectionResetError,
-            OSError,
-        ) as e:
-            last_exc = e
-            if attempt < max_tries:
-                wait = random.randint(2, 10) * attempt
-                log.warning(f"Joplin API 调用失败（第{attempt}次），{wait}秒后重试: {e}")
-                time.sleep(wait)
-    raise last_exc
-
-
 def ensure_monitor_note(title: str = "四件套笔记轮询结果") -> str:
     """查找或创建监控笔记，返回note_id"""
     note_id = get_config("monitor_note_id")
@@ -163,7 +140,7 @@ def generate_text_report() -> str:
             first_seen = n.get("first_seen", "")
             last_seen = n.get("last_seen", "")
             snap_count = get_snapshot_count(note_id)
-            latest = get_latest_snapshot(note_id)
+            latest = get_latest_snapshot(note_id, with_body=False)
 
             if latest is None:
                 body_parts.append(f"笔记ID: {note_id}\n")
@@ -17,7 +17,11 @@
 # ## 引入库
 
 # %%
+import difflib
+import json
 import sqlite3
+import threading
+import zlib
 from contextlib import contextmanager
 from datetime import date, datetime, timedelta
 from pathlib import Path
@@ -34,15 +38,102 @@ with pathmagic.context():
 DB_PATH = Path(getdirmain()) / "data" / "monitor.db"
 STABILITY_COOLDOWN_MINUTES = 30
 MAX_PENDING_WAIT_HOURS = 6
+STATEMENT_CACHE_SIZE = 256  # 会话连接的预编译语句缓存条数
+SNAPSHOT_KEYFRAME_INTERVAL = 32  # 快照差分链长度上限，满了存一个全量关键帧
 
 
 # %% [markdown]
 # ## 数据库连接
 
 
+# %%
+class StoreSession:
+    """单连接存储会话：整个会话复用一个连接（WAL 等 PRAGMA 只设一次，预编译语句缓存复用）。
+
+    用 with 进入后成为当前线程的活动会话，本模块所有读写函数都走这个连接；
+    transaction() 内的写操作合并为一次提交，可嵌套，最外层负责提交/回滚。
+
+        with StoreSession() as store:
+            with store.transaction():
+                upsert_note(...)
+                upsert_daily_stats(...)
+    """
+
+    def __init__(self, db_path: Path | str | None = None) -> None:
+        """打开 db_path（默认 DB_PATH）的连接，WAL 与外键约束在这里一次设好。"""
+        self.conn = sqlite3.connect(str(db_path or DB_PATH), cached_statements=STATEMENT_CACHE_SIZE)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA foreign_keys=ON")
+        self._depth = 0
+
+    @contextmanager
+    def transaction(self):  # noqa: ANN201
+        """事务块：正常退出提交、异常回滚；嵌套时只有最外层提交/回滚。"""
+        self._depth += 1
+        try:
+            yield self.conn
+        except BaseException:
+            if self._depth == 1:
+                self.conn.rollback()
+            raise
+        else:
+            if self._depth == 1:
+                self.conn.commit()
+        finally:
+            self._depth -= 1
+
+    def close(self, commit: bool = True) -> None:
+        """关闭连接；commit 为真时先提交未落盘的写入，出错路径传 False 直接丢弃。"""
+        if self.conn is not None:
+            if commit:
+                self.conn.commit()
+            else:
+                self.conn.rollback()
+            self.conn.close()
+            self.conn = None
+
+    def __enter__(self) -> "StoreSession":
+        """压入当前线程的会话栈，成为活动会话。"""
+        _sessions.stack = [*getattr(_sessions, "stack", []), self]
+        return self
+
+    def __exit__(self, *exc) -> None:  # noqa: ANN002
+        """弹出会话栈并关闭连接；带异常退出时回滚，不提交任何残留写入。"""
+        _sessions.stack = _sessions.stack[:-1]
+        self.close(commit=exc[0] is None)
+
+
+_sessions = threading.local()
+
+
+def current_session() -> StoreSession | None:
+    """当前线程的活动会话（没有则为 None）。"""
+    stack = getattr(_sessions, "stack", None)
+    return stack[-1] if stack else None
+
+
+@contextmanager
+def transaction():  # noqa: ANN201
+    """在活动会话上开启（嵌套）事务；没有活动会话时临时开一个，块结束即关闭。"""
+    session = current_session()
+    if session is not None:
+        with session.transaction() as conn:
+            yield conn
+        return
+    with StoreSession() as session, session.transaction() as conn:
+        yield conn
+
+
 # %%
 @contextmanager
 def _get_conn():
+    session = current_session()
+    if session is not None:
+        # 复用会话连接；处于外层事务中时只在外层提交
+        with session.transaction() as conn:
+            yield conn
+        return
     conn = sqlite3.connect(str(DB_PATH))
     conn.row_factory = sqlite3.Row
     conn.execute("PRAGMA journal_mode=WAL")
@@ -127,6 +218,32 @@ def _migrate_notes_updated_time(conn: sqlite3.Connection) -> None:
         conn.execute("ALTER TABLE notes ADD COLUMN last_updated_time TEXT")
 
 
+def _migrate_snapshot_storage(conn: sqlite3.Connection) -> None:
+    """增量迁移：snapshots 表补充正文编码列。
+
+    storage: 'plain' 正文明文存 body_fulltext（旧行）；'zlib' 关键帧，body_blob 为压缩全文；
+    'delta' 差分，body_blob 为相对 base_id 那条快照的压缩前向差分，chain_depth 为距关键帧的差分层数。
+    """
+    cur = conn.execute("PRAGMA table_info(snapshots)")
+    cols = {r[1] for r in cur.fetchall()}
+    if "storage" not in cols:
+        conn.execute("ALTER TABLE snapshots ADD COLUMN storage TEXT NOT NULL DEFAULT 'plain'")
+    if "base_id" not in cols:
+        conn.execute("ALTER TABLE snapshots ADD COLUMN base_id INTEGER REFERENCES snapshots(id)")
+    if "chain_depth" not in cols:
+        conn.execute("ALTER TABLE snapshots ADD COLUMN chain_depth INTEGER NOT NULL DEFAULT 0")
+    if "body_blob" not in cols:
+        conn.execute("ALTER TABLE snapshots ADD COLUMN body_blob BLOB")
+
+
+def _migrate_snapshot_section_index(conn: sqlite3.Connection) -> None:
+    """增量迁移：snapshots 表补充日记分节索引列（zlib 压缩的 JSON，只保留在每篇笔记最新一条快照上）。"""
+    cur = conn.execute("PRAGMA table_info(snapshots)")
+    cols = {r[1] for r in cur.fetchall()}
+    if "section_index" not in cols:
+        conn.execute("ALTER TABLE snapshots ADD COLUMN section_index BLOB")
+
+
 def init_db() -> None:
     with _get_conn() as conn:
         conn.executescript("""
@@ -216,6 +333,10 @@ CREATE INDEX IF NOT EXISTS idx_content_alerts_note_id ON content_alerts(note_id)
         _migrate_spark_log(conn)
         # 增量迁移：notes 表增加 last_updated_time 列（记录 Joplin 侧最后修改时间）
         _migrate_notes_updated_time(conn)
+        # 增量迁移：snapshots 表增加关键帧/差分编码列
+        _migrate_snapshot_storage(conn)
+        # 增量迁移：snapshots 表增加日记分节索引列
+        _migrate_snapshot_section_index(conn)
         # 确保索引存在（CREATE INDEX IF NOT EXISTS 在 execscript 外单独执行更安全）
         conn.execute("CREATE INDEX IF NOT EXISTS idx_spark_log_date ON spark_log(used_date)")
         conn.execute("CREATE INDEX IF NOT EXISTS idx_spark_log_person ON spark_log(person)")
@@ -303,6 +424,32 @@ def get_note_updated_time(note_id: str) -> datetime | None:
         return None
 
 
+def get_poll_state(note_ids: set) -> dict:
+    """批量读取轮询判定所需状态：{note_id: (last_updated_time 字符串, 是否有 pending)}。"""
+    if not note_ids:
+        return {}
+    ids = list(note_ids)
+    placeholders = ",".join("?" * len(ids))
+    with _get_conn() as conn:
+        rows = conn.execute(
+            f"""SELECT n.note_id, n.last_updated_time, p.note_id IS NOT NULL AS has_pending
+                FROM notes n LEFT JOIN pending_changes p ON p.note_id = n.note_id
+                WHERE n.note_id IN ({placeholders})""",
+            ids,
+        ).fetchall()
+        return {r["note_id"]: (r["last_updated_time"], bool(r["has_pending"])) for r in rows}
+
+
+def touch_notes(note_ids: set) -> None:
+    """批量刷新 last_seen（元数据探测判定未变化、未下载正文的笔记）。"""
+    if not note_ids:
+        return
+    ids = list(note_ids)
+    placeholders = ",".join("?" * len(ids))
+    with _get_conn() as conn:
+        conn.execute(f"UPDATE notes SET last_seen=datetime('now') WHERE note_id IN ({placeholders})", ids)
+
+
 # %% [markdown]
 # ## snapshots 表操作
 
@@ -317,6 +464,77 @@ def get_last_snapshot_hash(note_id: str) -> str | None:
         return row["content_hash"] if row else None
 
 
+def _encode_delta(base: str, text: str) -> bytes:
+    """计算 text 相对 base 的行级前向差分，返回 zlib 压缩后的 JSON：[[i1, i2] 复制 base 的行区间 | "新文本", ...]。"""
+    base_lines = base.splitlines(keepends=True)
+    if text.startswith(base):
+        # 日记绝大多数是在末尾追加，直接取尾部，省掉逐行比对
+        ops: list = [[0, len(base_lines)], text[len(base):]]
+    else:
+        ops = []
+        lines = text.splitlines(keepends=True)
+        for tag, i1, i2, j1, j2 in difflib.SequenceMatcher(None, base_lines, lines).get_opcodes():
+            if tag == "equal":
+                ops.append([i1, i2])
+            elif j2 > j1:  # replace / insert；delete 无输出
+                ops.append("".join(lines[j1:j2]))
+    return zlib.compress(json.dumps(ops, ensure_ascii=False).encode("utf-8"), 9)
+
+
+def _apply_delta(base: str, blob: bytes) -> str:
+    base_lines = base.splitlines(keepends=True)
+    ops = json.loads(zlib.decompress(blob).decode("utf-8"))
+    return "".join("".join(base_lines[op[0]:op[1]]) if isinstance(op, list) else op for op in ops)
+
+
+def _encode_snapshot_body(text: str, base: dict | None, keyframe_interval: int = SNAPSHOT_KEYFRAME_INTERVAL) -> dict:
+    """正文编码为 snapshots 的存储列。
+
+    base 为同一笔记上一条快照 {"id", "chain_depth", "text"}；链未满且差分更小时存差分，否则存关键帧。
+    """
+    key_blob = zlib.compress(text.encode("utf-8"), 9)
+    if base is not None and base["chain_depth"] + 1 < keyframe_interval:
+        delta_blob = _encode_delta(base["text"], text)
+        if len(delta_blob) < len(key_blob) and _apply_delta(base["text"], delta_blob) == text:
+            return {"storage": "delta", "base_id": base["id"], "chain_depth": base["chain_depth"] + 1,
+                    "body_fulltext": "", "body_blob": delta_blob}
+    return {"storage": "zlib", "base_id": None, "chain_depth": 0, "body_fulltext": "", "body_blob": key_blob}
+
+
+def _snapshot_body(conn: sqlite3.Connection, snapshot_id: int) -> str:
+    """还原快照全文：一次递归查询取回到关键帧为止的整条链，再从关键帧依次应用差分。"""
+    chain = conn.execute(
+        """WITH RECURSIVE chain(base_id, storage, body_fulltext, body_blob, depth) AS (
+               SELECT base_id, storage, body_fulltext, body_blob, 0 FROM snapshots WHERE id=?
+               UNION ALL
+               SELECT s.base_id, s.storage, s.body_fulltext, s.body_blob, c.depth + 1
+               FROM snapshots s JOIN chain c ON s.id = c.base_id
+               WHERE c.storage = 'delta'
+           )
+           SELECT storage, body_fulltext, body_blob FROM chain ORDER BY depth DESC""",
+        (snapshot_id,),
+    ).fetchall()
+    if not chain:
+        return ""
+    key = chain[0]
+    if key["storage"] == "delta":
+        raise ValueError(f"快照 {snapshot_id} 的差分链缺少关键帧")
+    text = zlib.decompress(key["body_blob"]).decode("utf-8") if key["storage"] == "zlib" else key["body_fulltext"]
+    for row in chain[1:]:
+        text = _apply_delta(text, row["body_blob"])
+    return text
+
+
+_SNAPSHOT_COLS = "id, note_id, captured_at, content_hash, word_count, is_forced"
+
+
+def _snapshot_dict(conn: sqlite3.Connection, row: sqlite3.Row, with_body: bool) -> dict:
+    snap = dict(row)
+    if with_body:
+        snap["body_fulltext"] = _snapshot_body(conn, snap["id"])
+    return snap
+
+
 def insert_snapshot(
     note_id: str,
     captured_at: datetime,
@@ -324,18 +542,73 @@ def insert_snapshot(
     word_count: int,
     body_fulltext: str,
     is_forced: int = 0,
+    section_index: dict | None = None,
 ) -> int | None:
+    """写入快照，正文存为相对该笔记上一条快照的差分（或关键帧）。hash 已存在时返回 None。
+
+    section_index 为日记分节索引 {date: (offset, length, section_hash)}，随快照保存，
+    同一笔记之前快照上的索引随之清除（只有最后写入 daily_stats 的那份索引会被增量比对用到）。
+    hash 已存在（回退到旧版本、恢复快照后）时索引改存到 hash 相同的那条快照上。
+    """
     with _get_conn() as conn:
+        dup = conn.execute(
+            "SELECT id FROM snapshots WHERE note_id=? AND content_hash=?", (note_id, content_hash)
+        ).fetchone()
+        if dup:
+            if section_index is not None:
+                _store_section_index(conn, note_id, dup["id"], section_index)
+            return None
+        prev = conn.execute(
+            "SELECT id, chain_depth FROM snapshots WHERE note_id=? ORDER BY id DESC LIMIT 1", (note_id,)
+        ).fetchone()
+        base = {"id": prev["id"], "chain_depth": prev["chain_depth"], "text": _snapshot_body(conn, prev["id"])} if prev else None
+        enc = _encode_snapshot_body(body_fulltext, base)
         try:
             cursor = conn.execute(
-                """INSERT INTO snapshots (note_id, captured_at, content_hash, word_count, body_fulltext, is_forced)
-                   VALUES (?, ?, ?, ?, ?, ?)""",
-                (note_id, captured_at, content_hash, word_count, body_fulltext, is_forced),
+                """INSERT INTO snapshots (note_id, captured_at, content_hash, word_count, body_fulltext, is_forced,
+                                          storage, base_id, chain_depth, body_blob)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                (note_id, captured_at, content_hash, word_count, enc["body_fulltext"], is_forced,
+                 enc["storage"], enc["base_id"], enc["chain_depth"], enc["body_blob"]),
             )
-            return cursor.lastrowid
         except sqlite3.IntegrityError:
             # hash already exists for this note — no-op
             return None
+        if section_index is not None:
+            _store_section_index(conn, note_id, cursor.lastrowid, section_index)
+        return cursor.lastrowid
+
+
+def _store_section_index(conn: sqlite3.Connection, note_id: str, snapshot_id: int, section_index: dict) -> None:
+    """把分节索引存到指定快照上，并清除该笔记其他快照上的旧索引（每篇笔记只保留一份）。"""
+    conn.execute(
+        "UPDATE snapshots SET section_index=NULL WHERE note_id=? AND section_index IS NOT NULL AND id != ?",
+        (note_id, snapshot_id),
+    )
+    conn.execute(
+        "UPDATE snapshots SET section_index=? WHERE id=?",
+        (zlib.compress(json.dumps(section_index, ensure_ascii=False).encode("utf-8")), snapshot_id),
+    )
+
+
+def set_section_index(note_id: str, snapshot_id: int, section_index: dict) -> None:
+    """按某条快照的正文整篇重写 daily_stats 之后（如恢复快照），记下与之对应的分节索引。"""
+    with _get_conn() as conn:
+        _store_section_index(conn, note_id, snapshot_id, section_index)
+
+
+def get_section_index(note_id: str) -> dict:
+    """笔记当前的日记分节索引 {date: (offset, length, section_hash)}；没有时为空。"""
+    with _get_conn() as conn:
+        row = conn.execute(
+            "SELECT section_index FROM snapshots WHERE note_id=? AND section_index IS NOT NULL"
+            " ORDER BY id DESC LIMIT 1",
+            (note_id,),
+        ).fetchone()
+        if not row or row["section_index"] is None:
+            return {}
+        index = json.loads(zlib.decompress(row["section_index"]).decode("utf-8"))
+        return {d: tuple(sec) for d, sec in index.items()}
 
 
 def get_snapshot_count(note_id: str) -> int:
@@ -344,16 +617,17 @@ def get_snapshot_count(note_id: str) -> int:
         return row["cnt"]
 
 
-def get_latest_snapshot(note_id: str) -> dict | None:
+def get_latest_snapshot(note_id: str, with_body: bool = True) -> dict | None:
+    """最新快照；with_body=False 时不还原正文（只需字数等元数据时用）。"""
     with _get_conn() as conn:
         row = conn.execute(
-            "SELECT * FROM snapshots WHERE note_id=? ORDER BY captured_at DESC LIMIT 1",
+            f"SELECT {_SNAPSHOT_COLS} FROM snapshots WHERE note_id=? ORDER BY captured_at DESC LIMIT 1",
             (note_id,),
         ).fetchone()
-        return dict(row) if row else None
+        return _snapshot_dict(conn, row, with_body) if row else None
 
 
-def get_snapshot_by_date(note_id: str, target_date: str) -> dict | None:
+def get_snapshot_by_date(note_id: str, target_date: str, with_body: bool = True) -> dict | None:
     """获取最接近目标日期且不晚于目标日期次日的快照。
 
     target_date: 'YYYY-MM-DD' 格式。
@@ -362,10 +636,10 @@ def get_snapshot_by_date(note_id: str, target_date: str) -> dict | None:
     """
     with _get_conn() as conn:
         row = conn.execute(
-            "SELECT * FROM snapshots WHERE note_id=? AND captured_at >= ? ORDER BY captured_at ASC LIMIT 1",
+            f"SELECT {_SNAPSHOT_COLS} FROM snapshots WHERE note_id=? AND captured_at >= ? ORDER BY captured_at ASC LIMIT 1",
             (note_id, f"{target_date} 00:00:00"),
         ).fetchone()
-        return dict(row) if row else None
+        return _snapshot_dict(conn, row, with_body) if row else None
 
 
 def list_snapshots(note_id: str, limit: int = 20) -> list[dict]:
@@ -379,14 +653,69 @@ def list_snapshots(note_id: str, limit: int = 20) -> list[dict]:
         return [dict(r) for r in rows]
 
 
-def get_previous_snapshot(note_id: str) -> dict | None:
+def get_previous_snapshot(note_id: str, with_body: bool = True) -> dict | None:
     """获取倒数第二新的快照（用于对比字数变化）。"""
     with _get_conn() as conn:
         rows = conn.execute(
-            "SELECT * FROM snapshots WHERE note_id=? ORDER BY captured_at DESC LIMIT 2",
+            f"SELECT {_SNAPSHOT_COLS} FROM snapshots WHERE note_id=? ORDER BY captured_at DESC LIMIT 2",
             (note_id,),
         ).fetchall()
-        return dict(rows[1]) if len(rows) >= 2 else None
+        return _snapshot_dict(conn, rows[1], with_body) if len(rows) >= 2 else None
+
+
+def _snapshot_storage_bytes(conn: sqlite3.Connection) -> int:
+    row = conn.execute(
+        "SELECT COALESCE(SUM(LENGTH(CAST(body_fulltext AS BLOB)) + COALESCE(LENGTH(body_blob), 0)), 0) AS n FROM snapshots"
+    ).fetchone()
+    return row["n"]
+
+
+def compact_snapshots(keyframe_interval: int = SNAPSHOT_KEYFRAME_INTERVAL, vacuum: bool = True) -> dict:
+    """把已有快照（含旧版明文行）按 id 顺序重编码为关键帧 + 差分链，返回统计。
+
+    每篇笔记一个事务；每行先按现有编码还原全文再改写，改写后的行还原结果不变，
+    所以中途中断也不会损坏后续行。vacuum=True 时最后 VACUUM 回收文件空间。
+    """
+    init_db()
+    with _get_conn() as conn:
+        note_ids = [r["note_id"] for r in conn.execute("SELECT DISTINCT note_id FROM snapshots").fetchall()]
+        bytes_before = _snapshot_storage_bytes(conn)
+    file_before = DB_PATH.stat().st_size if DB_PATH.exists() else 0
+
+    stats = {"notes": len(note_ids), "snapshots": 0, "keyframes": 0, "deltas": 0}
+    for note_id in note_ids:
+        with transaction() as conn:
+            ids = [r["id"] for r in conn.execute(
+                "SELECT id FROM snapshots WHERE note_id=? ORDER BY id", (note_id,)
+            ).fetchall()]
+            base = None
+            for snapshot_id in ids:
+                text = _snapshot_body(conn, snapshot_id)
+                enc = _encode_snapshot_body(text, base, keyframe_interval)
+                conn.execute(
+                    "UPDATE snapshots SET storage=?, base_id=?, chain_depth=?, body_fulltext=?, body_blob=? WHERE id=?",
+                    (enc["storage"], enc["base_id"], enc["chain_depth"], enc["body_fulltext"], enc["body_blob"],
+                     snapshot_id),
+                )
+                base = {"id": snapshot_id, "chain_depth": enc["chain_depth"], "text": text}
+                stats["snapshots"] += 1
+                stats["deltas" if enc["storage"] == "delta" else "keyframes"] += 1
+
+    with _get_conn() as conn:
+        stats["bytes_before"] = bytes_before
+        stats["bytes_after"] = _snapshot_storage_bytes(conn)
+    if vacuum:
+        with _get_conn() as conn:
+            conn.execute("VACUUM")
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    stats["file_before"] = file_before
+    stats["file_after"] = DB_PATH.stat().st_size if DB_PATH.exists() else 0
+    log.info(
+        f"快照压缩完成: {stats['notes']} 篇笔记, {stats['snapshots']} 条快照"
+        f"（关键帧 {stats['keyframes']}，差分 {stats['deltas']}），"
+        f"正文 {bytes_before:,} → {stats['bytes_after']:,} 字节"
+    )
+    return stats
 
 
 # %% [markdown]
@@ -460,6 +789,25 @@ def upsert_daily_stat(
         )
 
 
+def upsert_daily_stats(note_id: str, rows: list[tuple]) -> None:
+    """批量写入一篇笔记的日统计，rows 为 [(entry_date, word_count, is_backfill, snapshot_id), ...]。"""
+    if not rows:
+        return
+    with _get_conn() as conn:
+        conn.executemany(
+            """INSERT OR REPLACE INTO daily_stats (note_id, entry_date, word_count, is_backfill, snapshot_id)
+               VALUES (?, ?, ?, ?, ?)""",
+            [(note_id, *row) for row in rows],
+        )
+
+
+def get_daily_stat_dates(note_id: str) -> set[str]:
+    """笔记已有日统计的日期集合（'YYYY-MM-DD'）。"""
+    with _get_conn() as conn:
+        rows = conn.execute("SELECT DISTINCT entry_date FROM daily_stats WHERE note_id=?", (note_id,)).fetchall()
+        return {r["entry_date"] for r in rows}
+
+
 def get_daily_stats(note_id: str) -> list[dict]:
     with _get_conn() as conn:
         rows = conn.execute(